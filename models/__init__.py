@@ -1,8 +1,66 @@
 # coding=utf-8
+"""
+模型按需加载：models.User 第一次访问时才导入 user.py，
+只用 ORM 的批处理任务不会导入 flask / itsdangerous（它们只在 auth.py 中使用）
+
+Python 3.7 以下不支持模块级 __getattr__，用带 __getattr__ 的模块子类替换 sys.modules 中的模块
+"""
 from __future__ import absolute_import, unicode_literals
 
-from .user import User
-from .token import Token, Authorization, auth_required, auth_header, admin_required
-from .lottery_num import LotteryNum, LotteryLog
-from .payment import Payment, AmountDetail
-from .info import Info
+import importlib
+import sys
+import types
+
+_LAZY = {
+    'User': 'user',
+    'Token': 'token',
+    'Authorization': 'auth',
+    'auth_required': 'auth',
+    'auth_header': 'auth',
+    'admin_required': 'auth',
+    'LotteryNum': 'lottery_num',
+    'LotteryLog': 'lottery_num',
+    'Payment': 'payment',
+    'AmountDetail': 'payment',
+    'Info': 'info',
+}
+
+__all__ = [str(name) for name in _LAZY]
+
+
+def __getattr__(name):
+    module_name = _LAZY.get(name)
+    if module_name is None:
+        raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+    value = getattr(importlib.import_module('.' + module_name, __name__), name)
+    setattr(sys.modules[__name__], name, value)
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
+
+
+def _lazy_module(name, getattr_func, names):
+    """
+    Python 3.7 以下：把 sys.modules[name] 换成同样内容、缺少的属性交给 getattr_func 的模块对象。
+    原模块对象保留引用，Python 2 回收模块时会清空其中函数使用的全局变量
+    """
+    original = sys.modules[name]
+
+    class LazyModule(types.ModuleType):
+        def __getattr__(self, attr):
+            return getattr_func(attr)
+
+        def __dir__(self):
+            return sorted(set(self.__dict__) | set(names))
+
+    module = LazyModule(original.__name__)
+    module.__dict__.update(original.__dict__)
+    module._original_module = original
+    sys.modules[name] = module
+    return module
+
+
+if sys.version_info < (3, 7):
+    _lazy_module(__name__, __getattr__, __all__)
@@ -0,0 +1,86 @@
+# coding=utf-8
+"""
+Model 的 asyncio 接口：同步查询放到有界线程池中执行，返回值与同步接口完全一致
+
+每个任务结束后关闭工作线程上的连接（连接池时归还到池中），配合 pool.PooledMySQL 使用，
+线程数应不大于连接池的 max_connections。事务不能跨越 await。
+
+    user, (logs, pagination) = await aio.gather(
+        User.aget_by_id(user_id),
+        LotteryLog.aget_list({'user_id': user_id}, paging={'limit': 20}))
+"""
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .model import Model
+
+MAX_WORKERS = 8
+
+_executor = None
+_lock = threading.Lock()
+
+
+def configure(max_workers=MAX_WORKERS):
+    """
+    重建线程池，旧线程池中已提交的任务会继续执行完
+    """
+    global _executor
+    with _lock:
+        previous, _executor = _executor, ThreadPoolExecutor(max_workers=max_workers)
+    if previous is not None:
+        previous.shutdown(wait=False)
+    return _executor
+
+
+def get_executor():
+    if _executor is None:
+        configure()
+    return _executor
+
+
+def shutdown(wait=True):
+    global _executor
+    with _lock:
+        previous, _executor = _executor, None
+    if previous is not None:
+        previous.shutdown(wait=wait)
+
+
+def _close_connections():
+    databases = [Model.db] + (Model.router.replicas if Model.router is not None else [])
+    for database in databases:
+        if not database.is_closed() and not database.transaction_depth():
+            database.close()
+
+
+def _call(func, args, kwargs):
+    try:
+        return func(*args, **kwargs)
+    finally:
+        _close_connections()
+
+
+def run(func, *args, **kwargs):
+    """
+    在线程池中执行同步函数，返回可 await 的 future，需在协程内调用
+    """
+    loop = asyncio.get_running_loop()
+    return loop.run_in_executor(get_executor(), functools.partial(_call, func, args, kwargs))
+
+
+def gather(*awaitables, **kwargs):
+    """
+    并发执行多个查询，结果顺序与参数一致，参数同 asyncio.gather
+    """
+    return asyncio.gather(*awaitables, **kwargs)
+
+
+async def gather_dict(awaitables):
+    """
+    {name: awaitable} -> {name: result}
+    """
+    keys = list(awaitables)
+    results = await asyncio.gather(*[awaitables[key] for key in keys])
+    return dict(zip(keys, results))
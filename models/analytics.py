@@ -0,0 +1,157 @@
+# coding=utf-8
+"""
+开奖历史的列式导出和向量化统计，依赖 numpy
+
+    draws = export_draws({'type': 1})
+    digit_frequency(draws), sum_distribution(draws), hot_cold(draws, window=100)
+"""
+from __future__ import absolute_import, division, unicode_literals
+
+from .lottery_num import LotteryNum
+from .model import CHUNK_SIZE, _iter_chunks
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+DIGITS = ('num_one', 'num_sec', 'num_thr')
+SUM_VALUES = 28
+
+DRAW_FIELDS = ('id', 'num_one', 'num_sec', 'num_thr', 'num_add', 'type')
+DRAW_DTYPE = [
+    (str('id'), 'i8'),
+    (str('num_one'), 'i1'),
+    (str('num_sec'), 'i1'),
+    (str('num_thr'), 'i1'),
+    (str('num_add'), 'i1'),
+    (str('type'), 'i2'),
+]
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError('numpy is required for models.analytics')
+
+
+def export_draws(query_or_model=None, chunk_size=CHUNK_SIZE):
+    """
+    按期号升序导出开奖记录为结构化数组，参数同 LotteryNum.get_list，
+    结果按 chunk_size 从服务端游标分块读取，不构造模型实例
+    """
+    _require_numpy()
+    query = LotteryNum.get_query(query_or_model) \
+        .select(*[getattr(LotteryNum, name) for name in DRAW_FIELDS]) \
+        .order_by(LotteryNum.id)
+    query = LotteryNum.route_read(query)
+    sql, params = query.sql()
+
+    chunks = []
+    for keys, rows in _iter_chunks(query.database, sql, params, chunk_size):
+        chunks.append(np.array([tuple(row) for row in rows], dtype=DRAW_DTYPE))
+    if not chunks:
+        return np.zeros(0, dtype=DRAW_DTYPE)
+    return np.concatenate(chunks)
+
+
+def digit_frequency(draws):
+    """
+    每个位置 0-9 出现次数，shape (3, 10)
+    """
+    _require_numpy()
+    return np.vstack([np.bincount(draws[name], minlength=10)[:10] for name in DIGITS])
+
+
+def sum_distribution(draws):
+    """
+    和值 0-27 出现次数
+    """
+    _require_numpy()
+    return np.bincount(draws['num_add'], minlength=SUM_VALUES)[:SUM_VALUES]
+
+
+def hot_cold(draws, window=100, top=3):
+    """
+    最近 window 期三个位置合计出现最多 / 最少的数字
+    """
+    _require_numpy()
+    recent = draws[-window:] if window else draws
+    counts = np.bincount(np.concatenate([recent[name] for name in DIGITS]), minlength=10)[:10]
+    order = np.argsort(counts, kind='mergesort')
+    return {
+        'counts': counts,
+        'hot': order[::-1][:top],
+        'cold': order[:top]
+    }
+
+
+def omission(values, minlength, block=1024):
+    """
+    每个取值距今未出现的期数（遗漏），从未出现为总期数；从最近一期往前分块扫描，全部出现即停止
+    """
+    _require_numpy()
+    reversed_values = np.asarray(values, dtype=np.int64)[::-1]
+    result = np.full(minlength, len(reversed_values), dtype=np.int64)
+    missing = np.ones(minlength, dtype=bool)
+    for start in range(0, len(reversed_values), block):
+        found, first = np.unique(reversed_values[start:start + block], return_index=True)
+        keep = (found >= 0) & (found < minlength)
+        found, first = found[keep], first[keep]
+        new = missing[found]
+        result[found[new]] = start + first[new]
+        missing[found[new]] = False
+        if not missing.any():
+            break
+    return result
+
+
+def digit_omission(draws):
+    """
+    每个位置 0-9 的遗漏，shape (3, 10)
+    """
+    return np.vstack([omission(draws[name], 10) for name in DIGITS])
+
+
+def sum_omission(draws):
+    return omission(draws['num_add'], SUM_VALUES)
+
+
+def longest_run(mask):
+    """
+    布尔序列中最长的连续 True 长度，如 longest_run(draws['num_add'] >= 14) 为最长连大
+    """
+    _require_numpy()
+    mask = np.asarray(mask, dtype=np.int8)
+    if not mask.any():
+        return 0
+    edges = np.diff(np.concatenate(([0], mask, [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    return int((ends - starts).max())
+
+
+def current_run(mask):
+    """
+    以最近一期结尾的连续 True 长度
+    """
+    _require_numpy()
+    mask = np.asarray(mask, dtype=bool)
+    misses = np.flatnonzero(~mask)
+    return int(len(mask) - 1 - misses[-1]) if len(misses) else len(mask)
+
+
+def rolling_frequency(values, window, minlength):
+    """
+    滑动窗口内每个取值的出现次数，第 i 行对应 [i, i + window) 期，shape (n - window + 1, minlength)
+    """
+    _require_numpy()
+    values = np.asarray(values, dtype=np.int64)
+    size = len(values)
+    if size < window:
+        return np.zeros((0, minlength), dtype=np.int32)
+
+    result = np.empty((size - window + 1, minlength), dtype=np.int32)
+    for value in range(minlength):
+        counts = np.concatenate(([0], np.cumsum(values == value, dtype=np.int32)))
+        result[:, value] = counts[window:] - counts[:size - window + 1]
+    return result
@@ -32,8 +32,3 @@ class App(Model):
         values.setdefault('create_time', cls.now())
         with cls.db.transaction():
             return cls.create(**values)
-        
-        
-print("123")
-print("这是第二个版本")
-print("这是第三个版本")
@@ -0,0 +1,351 @@
+# coding=utf-8
+"""
+按月归档冷数据：把原表中一个月的行导出为 CSV.gz 后从原表删除，已归档的月份只读查询
+
+模型混入 ArchiveMixin 并设置 archive_time_field / archive_time_format 后：
+
+    AmountDetail.archive_month(201601, '/data/archive')     # 导出 amount_detail_201601.csv.gz 并删除这些行
+    AmountDetail.get_archived_list({'user_id': 1, 'date_id__gte': 20160101}, paging={'limit': 20})
+
+只做冷数据归档，不做按月分表：行在归档前一直在原表中，id 全局唯一，add / get_list 等读写仍只访问原表
+（需要时原表可在 MySQL 中按时间字段分区，对模型透明）。get_archived_list 按时间字段上的条件裁剪归档月份，
+合并归档文件和原表。只能归档当前月份之前的月份，同一 archive_dir 的归档用文件锁串行执行，
+只删除导出的行，导出时新写入该月的行留在原表
+"""
+from __future__ import absolute_import, unicode_literals
+
+import csv
+import datetime
+import gzip
+import hashlib
+import io
+import json
+import os
+import re
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from .filters import OR, matches
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+PY2 = sys.version_info[0] == 2
+
+MANIFEST = 'manifest.json'
+LOCK_FILE = '.lock'
+NULL = '\\N'
+LIMIT = 10
+BATCH_SIZE = 1000
+
+_lock = threading.Lock()
+
+_RE_MONTH = re.compile(r'(\d{4})-(\d{2})')
+
+
+def _next_month(month):
+    return month + 1 if month % 100 < 12 else month + 89
+
+
+def _date_id_month(value):
+    return int(value) // 100 if value else None
+
+
+def _date_id_bounds(month):
+    return month * 100, _next_month(month) * 100
+
+
+def _datetime_month(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return int(value.strftime('%Y%m'))
+    match = _RE_MONTH.match('{}'.format(value))
+    return int(match.group(1) + match.group(2)) if match else None
+
+
+def _datetime_bounds(month):
+    return tuple('{}-{:02d}'.format(value // 100, value % 100) for value in (month, _next_month(month)))
+
+
+def _timestamp_month(value):
+    return int(datetime.datetime.fromtimestamp(int(value)).strftime('%Y%m')) if value else None
+
+
+def _timestamp_bounds(month):
+    return tuple(int(time.mktime(datetime.date(value // 100, value % 100, 1).timetuple()))
+                 for value in (month, _next_month(month)))
+
+
+# archive_time_format -> (字段值 -> YYYYMM，无法识别如默认值 0 时为 None, YYYYMM -> 该月的 [起, 止) 取值)
+TIME_FORMATS = {
+    'date_id': (_date_id_month, _date_id_bounds),          # 20170301
+    'datetime': (_datetime_month, _datetime_bounds),       # '2017-03-01 12:00:00'、datetime、date
+    'timestamp': (_timestamp_month, _timestamp_bounds),    # 本地时区的 unix 时间戳
+}
+
+
+class ArchiveMixin(object):
+    """
+    archive_time_field: 按月归档的时间字段，必须设置；archive_time_format: 字段取值的格式，见 TIME_FORMATS；
+    archive_dir: 默认归档目录。两个时间属性在第一次使用归档方法时校验
+    """
+    archive_time_field = None
+    archive_time_format = None
+    archive_dir = None
+
+    @classmethod
+    def _archive_time(cls):
+        """
+        校验并返回 (时间字段名, 格式)
+        """
+        name, time_format = cls.archive_time_field, cls.archive_time_format
+        if name not in cls._meta.fields:
+            raise Exception('{}.archive_time_field = {!r} is not a field'.format(cls.__name__, name))
+        if time_format not in TIME_FORMATS:
+            raise Exception('{}.archive_time_format = {!r} not in {}'.format(
+                cls.__name__, time_format, sorted(TIME_FORMATS)))
+        return name, time_format
+
+    @classmethod
+    def month_of(cls, value):
+        """
+        时间字段的值 -> YYYYMM，无法识别（如默认值 0）时返回 None
+        """
+        return TIME_FORMATS[cls._archive_time()[1]][0](value)
+
+    @classmethod
+    def month_conditions(cls, month):
+        """
+        一个月的行在时间字段上的 dict 条件
+        """
+        name, time_format = cls._archive_time()
+        low, high = TIME_FORMATS[time_format][1](month)
+        return {name + '__gte': low, name + '__lt': high}
+
+    @classmethod
+    def archived_months(cls, archive_dir=None):
+        return sorted(_read_manifest(cls, archive_dir))
+
+    @classmethod
+    def prune(cls, conditions, months):
+        """
+        按时间字段上的 eq / in / gt / gte / lt / lte / between 条件裁剪月份
+        """
+        name = cls._archive_time()[0]
+        low, high, allowed = None, None, None
+        for key, value in (conditions or {}).items():
+            if key == OR:
+                continue
+            field, _, op = key.partition('__')
+            if field != name:
+                continue
+            op = op or 'eq'
+            if op == 'eq' and value is not None:
+                allowed = _intersect(allowed, [cls.month_of(value)])
+            elif op == 'in':
+                allowed = _intersect(allowed, [cls.month_of(item) for item in value])
+            elif op in ('gt', 'gte'):
+                low = _max(low, cls.month_of(value))
+            elif op in ('lt', 'lte'):
+                high = _min(high, cls.month_of(value))
+            elif op == 'between':
+                low = _max(low, cls.month_of(value[0]))
+                high = _min(high, cls.month_of(value[1]))
+
+        return [month for month in months
+                if (low is None or month >= low) and (high is None or month <= high)
+                and (allowed is None or month in allowed)]
+
+    @classmethod
+    def get_archived_list(cls, conditions=None, paging=None, archive_dir=None):
+        """
+        包含已归档月份的查询，conditions 同 get_list 的 dict 条件；先按月份升序返回归档的行，
+        再按 id 升序返回原表的行，paging 支持 offset / limit（不支持负 offset）
+        """
+        conditions = conditions or {}
+        pk_name = cls._meta.primary_key.name
+        archived = []
+        for month in cls.prune(conditions, cls.archived_months(archive_dir)):
+            archived.extend(row for row in read_archive(cls, month, archive_dir) if matches(conditions, row))
+        if archived:
+            # 归档后删除原表前中断时，两边都有的行以原表为准
+            live = cls._live_ids([row[pk_name] for row in archived])
+            archived = [row for row in archived if row[pk_name] not in live]
+
+        query = cls.get_query(conditions).order_by(cls._meta.primary_key)
+        if not paging:
+            return archived + cls.get_list(query)
+
+        offset = max(int(paging.get('offset', 0)), 0)
+        limit = int(paging.get('limit', LIMIT))
+        data = archived[offset:offset + limit]
+        if len(data) < limit:
+            data.extend(cls.get_list(query.offset(max(offset - len(archived), 0)).limit(limit - len(data))))
+        return data, {'offset': offset, 'limit': limit, 'rows_found': len(archived) + query.count()}
+
+    @classmethod
+    def _live_ids(cls, ids):
+        pk = cls._meta.primary_key
+        result = set()
+        for start in range(0, len(ids), BATCH_SIZE):
+            query = cls.select(pk).where(pk.in_(ids[start:start + BATCH_SIZE]))
+            result.update(row[0] for row in cls.route_read(query).tuples())
+        return result
+
+    @classmethod
+    def archive_month(cls, month, archive_dir=None, batch_size=BATCH_SIZE):
+        """
+        把一个月的行导出为 CSV.gz，校验行数、写入 manifest 后按 id 从原表删除，返回归档的行数。
+        已归档的月份不再导出，只删除原表中仍残留的已归档行（上次删除前中断时）
+        """
+        archive_dir = archive_dir or cls.archive_dir
+        if month >= int(datetime.date.today().strftime('%Y%m')):
+            raise Exception('month {} is not cold yet'.format(month))
+
+        with _archive_lock(archive_dir):
+            item = _read_manifest(cls, archive_dir).get(month)
+            if item is not None:
+                path = os.path.join(archive_dir, item['file'])
+                cls._delete_archived([row[cls._meta.primary_key.name] for row in read_archive_file(cls, path)],
+                                     batch_size)
+                return 0
+
+            names = [field.name for field in cls._meta.sorted_fields]
+            filename = '{}_{}.csv.gz'.format(cls._meta.db_table, month)
+            path = os.path.join(archive_dir, filename)
+            query = cls.get_query(cls.month_conditions(month)).order_by(cls._meta.primary_key)
+
+            ids = []
+            with _open_csv(path, 'w') as f:
+                writer = csv.writer(f)
+                writer.writerow(_encode(names))
+                for row in cls.iter_list(query):
+                    writer.writerow(_encode([NULL if row[name] is None else row[name] for name in names]))
+                    ids.append(row[cls._meta.primary_key.name])
+
+            archived = sum(1 for _ in read_archive_file(cls, path))
+            if archived != len(ids):
+                raise Exception('archive {} rows = {} not match table rows = {}'.format(path, archived, len(ids)))
+
+            manifest = _read_manifest(cls, archive_dir, all_tables=True)
+            manifest.setdefault(cls._meta.db_table, {})['{}'.format(month)] = {
+                'file': filename,
+                'rows': len(ids),
+                'columns': names,
+                'sha256': _sha256(path),
+                'archived_at': int(time.time())
+            }
+            _write_manifest(archive_dir, manifest)
+            cls._delete_archived(ids, batch_size)
+        return len(ids)
+
+    @classmethod
+    def _delete_archived(cls, ids, batch_size=BATCH_SIZE):
+        pk = cls._meta.primary_key
+        for start in range(0, len(ids), batch_size):
+            with cls.db.atomic():
+                cls.delete().where(pk.in_(ids[start:start + batch_size])).execute()
+
+
+@contextmanager
+def _archive_lock(archive_dir):
+    """
+    进程内用线程锁，进程间用 archive_dir 下的文件锁（不支持 fcntl 的平台只有进程内的锁）
+    """
+    with _lock:
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(archive_dir, LOCK_FILE), 'a') as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def _intersect(allowed, months):
+    months = set(month for month in months if month is not None)
+    return months if allowed is None else allowed & months
+
+
+def _max(low, month):
+    return month if low is None else low if month is None else max(low, month)
+
+
+def _min(high, month):
+    return month if high is None else high if month is None else min(high, month)
+
+
+def _open_csv(path, mode):
+    if PY2:
+        return gzip.open(path, mode + 'b')
+    return io.TextIOWrapper(gzip.open(path, mode + 'b'), encoding='utf-8', newline='')
+
+
+def _encode(values):
+    if PY2:
+        return [value.encode('utf-8') if isinstance(value, unicode) else value for value in values]  # noqa
+    return values
+
+
+def _decode(values):
+    if PY2:
+        return [value.decode('utf-8') for value in values]
+    return values
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _read_manifest(model_class, archive_dir=None, all_tables=False):
+    archive_dir = archive_dir or model_class.archive_dir
+    path = os.path.join(archive_dir, MANIFEST) if archive_dir else None
+    manifest = {}
+    if path and os.path.exists(path):
+        with open(path) as f:
+            manifest = json.load(f)
+    if all_tables:
+        return manifest
+    return dict((int(month), item) for month, item in manifest.get(model_class._meta.db_table, {}).items())
+
+
+def _write_manifest(archive_dir, manifest):
+    path = os.path.join(archive_dir, MANIFEST)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.rename(tmp_path, path)
+
+
+def read_archive_file(model_class, path):
+    """
+    逐行读取归档文件，值按字段类型还原
+    """
+    fields = model_class._meta.fields
+    with _open_csv(path, 'r') as f:
+        reader = csv.reader(f)
+        names = _decode(next(reader))
+        converters = [fields[name].python_value for name in names]
+        for values in reader:
+            yield dict((name, None if value == NULL else convert(value))
+                       for name, convert, value in zip(names, converters, _decode(values)))
+
+
+def read_archive(model_class, month, archive_dir=None):
+    """
+    已归档月份的只读访问
+    """
+    archive_dir = archive_dir or model_class.archive_dir
+    item = _read_manifest(model_class, archive_dir).get(month)
+    if item is None:
+        raise Exception('month {} of {} is not archived'.format(month, model_class._meta.db_table))
+    return read_archive_file(model_class, os.path.join(archive_dir, item['file']))
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+请求鉴权，依赖 flask 和 itsdangerous；批处理任务只需要 Token 模型时从 token.py 导入
+"""
+from functools import wraps
+from flask import request, g
+from itsdangerous import URLSafeTimedSerializer
+import time
+from logging import getLogger
+
+
+from config import SECRET_KEY, TOKEN_SALT
+from utils.func import random_ascii_string
+from .. import meta
+from .token import TOKEN_CACHE, Token
+from .user import User
+
+LOGGER = getLogger()
+
+_token_serializer = None
+
+
+def get_token_serializer():
+    """
+    进程内共享的 token 序列化器
+    """
+    global _token_serializer
+    if _token_serializer is None:
+        _token_serializer = URLSafeTimedSerializer(SECRET_KEY, salt=TOKEN_SALT)
+    return _token_serializer
+
+
+def enable_user_cache(maxsize=10000, ttl=60):
+    """
+    开启 User 的进程缓存。token 缓存命中后用户按主键从 User 缓存读取，不开启时每个请求仍查询一次 user 表；
+    余额等用户数据的写入（save、update_amount、ledger、settlement）都会 invalidate 对应的行
+    """
+    if User.cache is None:
+        User.enable_cache(maxsize=maxsize, ttl=ttl)
+    return User.cache
+
+
+def auth_header(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        access_token = request.args.get('access_token')
+        if access_token:
+            g.headers['Authorization'] = "Bearer {}".format(access_token)
+        return f(*args, **kwargs)
+
+    return decorated_function
+
+
+def auth_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        authorization = Authorization().get_authorization()
+        if not authorization.is_valid:
+            raise meta.UNAUTHORIZED
+
+        g.auth = authorization
+
+        return f(*args, **kwargs)
+
+    return decorated_function
+
+
+def admin_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        authorization = Authorization().get_authorization()
+        if not authorization.is_valid:
+            raise meta.UNAUTHORIZED
+
+        g.auth = authorization
+
+        return f(*args, **kwargs)
+
+    return decorated_function
+
+
+class Authorization(dict):
+    def __init__(self, *args, **kwargs):
+        super(Authorization, self).__init__(*args, **kwargs)
+        self.is_valid = False
+        self.token_length = 40
+        self.token_serializer = get_token_serializer()
+        self.user = None
+
+    def gen_token(self, grant_type, client_id, user_id):
+
+        token_type = 'Bearer'
+
+        time_now = int(time.time())
+
+        # 永不过期
+        expires_in = 0
+        refresh_token = random_ascii_string(self.token_length)
+        access_token = self.token_serializer.dumps((grant_type, client_id, user_id, time_now, expires_in))
+
+        values = {
+            'grant_type': grant_type,
+            'access_token': access_token,
+            'expires_in': expires_in,
+            'refresh_token': refresh_token,
+            'client_id': client_id,
+            'user_id': user_id,
+            'create_time': time_now
+        }
+
+        # 保存token信息，已有 token 时返回已有的
+        token, created = Token.issue(values)
+        return {
+            'access_token': token.access_token,
+            'token_type': token_type,
+            'expires_in': token.expires_in,
+            'refresh_token': token.refresh_token,
+        }
+
+    def get_token(self, access_token):
+        token = Token.get_one_by_query(
+            Token.select(Token, User).join(User, on=(Token.user_id == User.id).alias('user')).where(
+                Token.access_token == access_token))
+        if token:
+            self.update(token.to_dict(recurse=False))
+            self.user = token.user
+            # JOIN 查询可能读从库，用户不放入进程缓存，缓存只由 User.get_by_id 从主库读取后写入
+            TOKEN_CACHE.set(access_token, dict(self))
+        return token
+
+    def get_cached_token(self, access_token):
+        """
+        从进程缓存中取已校验过的 token，命中时不再解签名和查询 token 表；
+        用户通过 User.get_by_id 读取，只有 enable_user_cache 开启后才不查询 user 表
+        """
+        data = TOKEN_CACHE.get(access_token)
+        if data is None:
+            return None
+
+        if data['expires_in'] and data['create_time'] + data['expires_in'] <= time.time():
+            TOKEN_CACHE.delete(access_token)
+            return None
+
+        user = User.get_by_id(data['user_id'])
+        if user is None:
+            TOKEN_CACHE.delete(access_token)
+            return None
+
+        self.update(data)
+        self.user = user
+        return data
+
+    def destroy(self):
+        TOKEN_CACHE.delete(self['access_token'])
+        return Token.delete().where(Token.access_token == self['access_token']).execute()
+
+    def get_authorization(self):
+        if 'Authorization' in request.headers:
+            header = request.headers.get('Authorization')
+        elif request.args.get('access_token'):
+            header = "Bearer {}".format(request.args.get('access_token'))
+        else:
+            header = g.headers.get('Authorization')
+
+        if header and header.split:
+            header = header.split()
+
+            if len(header) > 1 and header[0] == 'Bearer':
+                if self.get_cached_token(header[1]):
+                    self.is_valid = True
+                    return self
+
+                # try:
+                row = self.token_serializer.loads(header[1])
+                LOGGER.debug('token row %s', row)
+                grant_type, client_id, foreign_key_id, create_time, expires_in = row
+
+                # 过期时间为0为不过期
+                if expires_in == 0 or (create_time + expires_in) > time.time():
+                    if self.get_token(header[1]):
+                        self.is_valid = True
+                # except Exception as e:
+                #     LOGGER.debug(e)
+
+        return self
+
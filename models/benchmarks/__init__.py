@@ -0,0 +1,22 @@
+# coding=utf-8
+"""
+models 包的性能基准，每个模块可单独运行: python -m <package>.models.benchmarks.<name>
+"""
+from __future__ import absolute_import, division, unicode_literals
+
+import time
+
+
+def best_of(func, repeat=5, number=1):
+    """
+    运行 repeat 轮、每轮 number 次，返回最快一轮的单次耗时（秒）
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        for _ in range(number):
+            func()
+        elapsed = (time.time() - start) / number
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
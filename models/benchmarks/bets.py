@@ -0,0 +1,54 @@
+# coding=utf-8
+"""
+一期下注的派奖计算：逐行 payout_of、按文本缓存赔率（settle_period 的做法）与 bet_kernel 的对比，不需要数据库
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import random
+
+from . import best_of
+from ..bet_kernel import BetKernel
+from ..settlement import PayoutRules
+
+# 基准用的示例赔率，不是线上配置
+RULES = PayoutRules(
+    odds=dict((text, '1.98') for text in ('大', '小', '单', '双')),
+    sum_odds=dict((value, '9.8') for value in range(28))
+)
+TEXTS = sorted(RULES.odds) + ['{}'.format(value) for value in range(28)] + [' 大 ', '28', 'abc', '']
+
+
+def make_bets(size, seed=0):
+    rng = random.Random(seed)
+    texts = [rng.choice(TEXTS) for _ in range(size)]
+    amounts = [rng.randint(1, 1000) for _ in range(size)]
+    return texts, amounts
+
+
+def cached_loop(texts, amounts, draw):
+    odds_cache = {}
+    payouts = []
+    for text, amount in zip(texts, amounts):
+        odds = odds_cache.get(text)
+        if odds is None:
+            odds = odds_cache[text] = RULES.odds_of(RULES.parse(text), draw)
+        payouts.append(amount * odds // 1000)
+    return payouts
+
+
+def run(size=100000, repeat=5):
+    texts, amounts = make_bets(size)
+    kernel = BetKernel(RULES)
+    codes = kernel.encode(texts)
+    draw = (10, frozenset(['10', '小', '双']))
+    return {
+        'bets': size,
+        'oracle_ms': best_of(lambda: kernel.oracle(texts, amounts, draw), repeat) * 1000,
+        'cached_loop_ms': best_of(lambda: cached_loop(texts, amounts, draw), repeat) * 1000,
+        'encode_ms': best_of(lambda: kernel.encode(texts), repeat) * 1000,
+        'evaluate_ms': best_of(lambda: kernel.evaluate(codes, amounts, draw), repeat) * 1000,
+    }
+
+
+if __name__ == '__main__':
+    print(run())
@@ -0,0 +1,159 @@
+# coding=utf-8
+"""
+基准测试数据：按规模生成 user / lottery_num / lottery_log / payment / amount_detail，结果可复现（固定随机种子）
+"""
+from __future__ import absolute_import, division, unicode_literals
+
+import random
+from contextlib import contextmanager
+
+from ..lottery_num import LotteryLog, LotteryNum
+from ..model import Model
+from ..payment import AmountDetail, Payment
+from ..token import Token
+from ..user import User
+
+MODELS = (User, Token, LotteryNum, LotteryLog, Payment, AmountDetail)
+
+SCALES = {
+    'tiny': {'users': 100, 'draws': 200, 'bets': 2000, 'payments': 200, 'details': 2000},
+    'small': {'users': 2000, 'draws': 2000, 'bets': 50000, 'payments': 5000, 'details': 50000},
+    'medium': {'users': 20000, 'draws': 10000, 'bets': 500000, 'payments': 50000, 'details': 500000},
+}
+
+# 和值下注的内容是数字本身（见 settlement.PayoutRules.parse）
+BET_TEXTS = ('大', '小', '单', '双', '大单', '大双', '小单', '小双', '极大', '极小', '豹子', '13', '14')
+START_TIME = 1500000000
+DRAW_INTERVAL = 210
+SEED = 20170101
+
+
+@contextmanager
+def bind(database, models=MODELS):
+    """
+    with 块内 Model.db 和各模型的 _meta.database 指向 database，退出时恢复
+    """
+    previous = Model.db, [(model, model._meta.database) for model in models]
+    Model.db = database
+    for model in models:
+        model._meta.database = database
+    try:
+        yield database
+    finally:
+        Model.db = previous[0]
+        for model, original in previous[1]:
+            model._meta.database = original
+
+
+def create_tables(models=MODELS):
+    for model in models:
+        model.drop_table(fail_silently=True)
+        model.create_table()
+
+
+def users(rng, count):
+    for i in range(count):
+        yield {
+            'username': 'user{:07d}'.format(i),
+            'nickname': 'nick{}'.format(i),
+            # 基准不测密码校验，用固定的哈希避免生成数据耗时
+            'password': 'pbkdf2:sha256:150000$benchmark${:064x}'.format(i),
+            'enabled': True,
+            'create_time': START_TIME + i,
+            'avatar_url': 'https://img.example.com/{}.png'.format(i),
+            'balance': rng.randint(0, 100000)
+        }
+
+
+def outcomes(digits):
+    """
+    开奖结果中列出的中奖玩法（和值在第一个），按常见的 0-27 和值规则：
+    14 及以上为大，22 及以上为极大，5 及以下为极小，三个号码相同为豹子
+    """
+    total = sum(digits)
+    size = '大' if total >= 14 else '小'
+    parity = '双' if total % 2 == 0 else '单'
+    result = [str(total), size, parity, size + parity]
+    if total >= 22:
+        result.append('极大')
+    elif total <= 5:
+        result.append('极小')
+    if len(set(digits)) == 1:
+        result.append('豹子')
+    return result
+
+
+def draws(rng, count):
+    for i in range(count):
+        digits = [rng.randint(0, 9) for _ in range(3)]
+        total = sum(digits)
+        yield {
+            'id': i + 1,
+            'time': str(START_TIME + i * DRAW_INTERVAL),
+            'num_one': digits[0],
+            'num_sec': digits[1],
+            'num_thr': digits[2],
+            'num_add': total,
+            'num_str': ','.join(str(digit) for digit in digits),
+            'result': ','.join(outcomes(digits)),
+            'type': 1,
+            'by_hand': 0,
+            'create_time': str(START_TIME + i * DRAW_INTERVAL)
+        }
+
+
+def bets(rng, count, user_count, draw_count):
+    for i in range(count):
+        yield {
+            'user_id': rng.randint(1, user_count),
+            'period': rng.randint(1, draw_count),
+            'create_time': str(START_TIME + i),
+            'text': rng.choice(BET_TEXTS),
+            'amount': rng.choice((10, 20, 50, 100, 500)),
+            'is_checked': 1,
+            'room_id': rng.randint(0, 5)
+        }
+
+
+def payments(rng, count, user_count):
+    for i in range(count):
+        yield {
+            'user_id': rng.randint(1, user_count),
+            'create_time': START_TIME + i * 60,
+            'charge_amount': rng.choice((100, 500, 1000, 5000)),
+            'confirmed': 1,
+            'nick': 'nick',
+            'info': ''
+        }
+
+
+def details(rng, count, user_count):
+    for i in range(count):
+        create_time = START_TIME + i * 30
+        change = rng.randint(-500, 1000)
+        yield {
+            'user_id': rng.randint(1, user_count),
+            'create_time': create_time,
+            'amount': rng.randint(0, 100000),
+            'type': rng.randint(1, 3),
+            'date_id': AmountDetail.get_date_id_from_timestamp(create_time),
+            'amount_change': change,
+            'tips': ''
+        }
+
+
+def generate(database, scale='small', seed=SEED):
+    """
+    在 database 中建表并写入数据，返回各表行数
+    """
+    sizes = SCALES[scale] if not isinstance(scale, dict) else scale
+    rng = random.Random(seed)
+    with bind(database):
+        create_tables()
+        return {
+            'user': User.add_many(users(rng, sizes['users'])),
+            'lottery_num': LotteryNum.add_many(draws(rng, sizes['draws'])),
+            'lottery_log': LotteryLog.add_many(bets(rng, sizes['bets'], sizes['users'], sizes['draws'])),
+            'payment': Payment.add_many(payments(rng, sizes['payments'], sizes['users'])),
+            'amount_detail': AmountDetail.add_many(details(rng, sizes['details'], sizes['users']))
+        }
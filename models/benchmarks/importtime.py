@@ -0,0 +1,91 @@
+# coding=utf-8
+"""
+import 耗时基准：在子进程中用 python -X importtime 导入 models 包，与预算比较
+
+    python -m <package>.models.benchmarks.importtime [budget_ms]
+
+超出预算或导入了 HEAVY_MODULES 中的模块时退出码为 1；Python 3.7 以下没有 -X importtime，只统计子进程总耗时
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import json
+import os
+import subprocess
+import sys
+import time
+
+BUDGET_MS = 200
+TOP = 10
+
+PACKAGE = (__package__ or __name__).rsplit('.benchmarks', 1)[0]
+
+# 只使用 ORM 的进程不应导入的模块
+HEAVY_MODULES = ('flask', 'itsdangerous', 'werkzeug', 'numpy')
+
+# 导入包并访问批处理任务常用的模型
+SCRIPT = '''
+import json, sys
+import {package} as models
+models.User, models.LotteryNum, models.LotteryLog, models.Payment, models.AmountDetail
+sys.stderr.write('\\nloaded ' + json.dumps(sorted(set(name.split('.')[0] for name in sys.modules))) + '\\n')
+'''
+
+
+def _parse_importtime(stderr):
+    """
+    解析 -X importtime 输出，返回 [(cumulative_us, self_us, module)]
+    """
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        rows.append((int(cumulative_us), int(self_us), name.rstrip()))
+    return rows
+
+
+def run(budget_ms=BUDGET_MS, top=TOP):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(path for path in sys.path if path))
+    args = [sys.executable]
+    if sys.version_info >= (3, 7):
+        args += ['-X', 'importtime']
+    args += ['-c', SCRIPT.format(package=PACKAGE)]
+
+    start = time.time()
+    process = subprocess.Popen(args, env=env, stderr=subprocess.PIPE, universal_newlines=True)
+    stderr = process.communicate()[1]
+    wall_ms = (time.time() - start) * 1000
+    if process.returncode:
+        raise Exception('import failed:\n{}'.format(stderr))
+
+    loaded = []
+    for line in stderr.splitlines():
+        if line.startswith('loaded '):
+            loaded = json.loads(line[len('loaded '):])
+
+    rows = _parse_importtime(stderr)
+    # 从导入包开始的所有顶层导入（包括访问模型时的按需导入），不含解释器启动
+    names = [name.strip() for cumulative, own, name in rows]
+    first = names.index(PACKAGE.split('.')[0]) if PACKAGE.split('.')[0] in names else None
+    if first is None:
+        total_ms = wall_ms
+    else:
+        total_ms = sum(cumulative for cumulative, own, name in rows[first:]
+                       if len(name) - len(name.lstrip()) == 1) / 1000
+    heavy = [name for name in HEAVY_MODULES if name in loaded]
+    return {
+        'package': PACKAGE,
+        'total_ms': total_ms,
+        'wall_ms': wall_ms,
+        'budget_ms': budget_ms,
+        'heavy_modules': heavy,
+        'top': [{'module': name.strip(), 'cumulative_ms': cumulative / 1000, 'self_ms': own / 1000}
+                for cumulative, own, name in sorted(rows, reverse=True)[:top]],
+        'ok': total_ms <= budget_ms and not heavy
+    }
+
+
+if __name__ == '__main__':
+    result = run(*[float(arg) for arg in sys.argv[1:2]])
+    print(json.dumps(result, indent=2))
+    sys.exit(0 if result['ok'] else 1)
@@ -0,0 +1,65 @@
+# coding=utf-8
+"""
+模型实例 + to_dict 与轻量行对象的构造耗时、遍历耗时和内存对比，不需要数据库
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from . import best_of
+from .serializer import make_instances, make_rows
+from ..lottery_num import LotteryLog
+from ..payment import AmountDetail
+from ..rows import row_class
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+def memory_per_row(func, size):
+    """
+    func() 结果常驻内存的字节数 / size，Python 2 下没有 tracemalloc，返回 None
+    """
+    if tracemalloc is None:
+        return None
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = func()
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    del result
+    return (after - before) / size
+
+
+def run(size=10000, repeat=5):
+    results = {}
+    for model_class in (LotteryLog, AmountDetail):
+        rows = make_rows(model_class, size)
+        names = [field.name for field in model_class._meta.sorted_fields]
+        make = row_class(model_class, names)._make
+
+        instances = make_instances(model_class, rows)
+        compact = [make(row) for row in rows]
+        if [row.as_dict() for row in compact] != [instance.to_dict() for instance in instances]:
+            raise Exception('rows of {} not match to_dict'.format(model_class.__name__))
+
+        def iterate(items):
+            return lambda: [item.id for item in items]
+
+        results[model_class.__name__] = {
+            'rows': size,
+            'instances_ms': best_of(lambda: make_instances(model_class, rows), repeat) * 1000,
+            'rows_ms': best_of(lambda: [make(row) for row in rows], repeat) * 1000,
+            'iterate_instances_ms': best_of(iterate(instances), repeat) * 1000,
+            'iterate_rows_ms': best_of(iterate(compact), repeat) * 1000,
+            'instance_bytes': memory_per_row(lambda: make_instances(model_class, rows), size),
+            'row_bytes': memory_per_row(lambda: [make(row) for row in rows], size)
+        }
+    return results
+
+
+if __name__ == '__main__':
+    for name, result in sorted(run().items()):
+        print(name, result)
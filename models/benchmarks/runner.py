@@ -0,0 +1,159 @@
+# coding=utf-8
+"""
+基准测试运行器：生成数据，逐个场景计时，输出 ops/sec、p50/p99 延迟和峰值 RSS 的增长，可与保存的基线比较
+
+    python -m <package>.models.benchmarks.runner --scale small --output result.json
+    python -m <package>.models.benchmarks.runner --db mysql://root@127.0.0.1/bench --baseline result.json
+
+--db 为 playhouse.db_url 格式，默认使用临时 SQLite 文件；ops/sec 比基线下降超过 --threshold 时退出码为 1
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+from . import datagen, scenarios
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+DURATION = 2.0
+WARMUP = 20
+THRESHOLD = 0.1
+
+timer = getattr(time, 'perf_counter', time.time)
+
+
+def peak_rss_kb():
+    """
+    进程峰值 RSS（KB），不支持的平台返回 None
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    return sorted_values[min(int(len(sorted_values) * q), len(sorted_values) - 1)]
+
+
+def measure(op, duration=DURATION, warmup=WARMUP):
+    """
+    rss_growth_kb 为场景运行期间进程峰值 RSS 的增长；峰值不会回落，
+    场景用的内存没有超过之前的峰值（如生成数据时）时为 0
+    """
+    peak_before = peak_rss_kb()
+    for _ in range(warmup):
+        op()
+    latencies = []
+    start = timer()
+    while timer() - start < duration:
+        begin = timer()
+        op()
+        latencies.append(timer() - begin)
+    elapsed = timer() - start
+    latencies.sort()
+    return {
+        'ops': len(latencies),
+        'ops_per_sec': len(latencies) / elapsed,
+        'p50_ms': percentile(latencies, 0.5) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'rss_growth_kb': peak_rss_kb() - peak_before if peak_before is not None else None
+    }
+
+
+def connect(url=None):
+    """
+    返回 (database, 临时目录)；url 为空时使用临时 SQLite 文件
+    """
+    if url:
+        from playhouse.db_url import connect as db_connect
+        return db_connect(url), None
+    import peewee
+    directory = tempfile.mkdtemp()
+    return peewee.SqliteDatabase(os.path.join(directory, 'bench.db'), check_same_thread=False), directory
+
+
+def compare(results, baseline, threshold=THRESHOLD):
+    """
+    与基线比较 ops/sec，返回 {场景: {ratio, regression}}
+    """
+    comparison = {}
+    for name, result in results['scenarios'].items():
+        base = baseline.get('scenarios', {}).get(name)
+        if not result or not base:
+            continue
+        ratio = result['ops_per_sec'] / base['ops_per_sec'] if base['ops_per_sec'] else None
+        comparison[name] = {
+            'ratio': ratio,
+            'regression': ratio is not None and ratio < 1 - threshold
+        }
+    return comparison
+
+
+def run(url=None, scale='small', names=None, duration=DURATION, baseline=None, threshold=THRESHOLD):
+    database, directory = connect(url)
+    try:
+        start = timer()
+        sizes = datagen.generate(database, scale)
+        results = {
+            'database': type(database).__name__,
+            'scale': scale,
+            'rows': sizes,
+            'generate_sec': timer() - start,
+            'python': platform.python_version(),
+            'time': int(time.time()),
+            'scenarios': {}
+        }
+        with datagen.bind(database):
+            for name, op in scenarios.build(sizes, names):
+                results['scenarios'][name] = measure(op, duration) if op is not None else None
+        results['peak_rss_kb'] = peak_rss_kb()
+        if baseline is not None:
+            results['baseline'] = compare(results, baseline, threshold)
+        return results
+    finally:
+        database.close()
+        if directory:
+            shutil.rmtree(directory)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='models benchmark suite')
+    parser.add_argument('--db', help='playhouse.db_url, e.g. mysql://root@127.0.0.1/bench')
+    parser.add_argument('--scale', default='small', choices=sorted(datagen.SCALES))
+    parser.add_argument('--scenario', action='append', help='only run this scenario (repeatable)')
+    parser.add_argument('--duration', type=float, default=DURATION, help='seconds per scenario')
+    parser.add_argument('--output', help='write JSON results to this file')
+    parser.add_argument('--baseline', help='JSON results to compare against')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD, help='allowed ops/sec drop')
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    results = run(args.db, args.scale, args.scenario, args.duration, baseline, args.threshold)
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    print(output)
+    regressions = [name for name, item in results.get('baseline', {}).items() if item['regression']]
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
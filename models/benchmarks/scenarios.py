@@ -0,0 +1,105 @@
+# coding=utf-8
+"""
+基准场景：每个场景接收 datagen.generate 的行数，返回无参的单次操作函数
+"""
+from __future__ import absolute_import, division, unicode_literals
+
+import random
+
+from ..lottery_num import LotteryLog
+from ..payment import AmountDetail
+from ..user import User
+from .datagen import SEED
+
+
+def get_list_page(sizes, rng):
+    def op():
+        LotteryLog.get_list({'user_id': rng.randint(1, sizes['user'])}, paging={'offset': 0, 'limit': 20})
+    return op
+
+
+def get_list_filter(sizes, rng):
+    def op():
+        start = rng.randint(1, max(sizes['amount_detail'] - 200, 1))
+        AmountDetail.get_list({'id__gte': start, 'id__lt': start + 200, 'type__in': [1, 2]})
+    return op
+
+
+def to_dict(sizes, rng):
+    instances = list(LotteryLog.select().limit(200))
+
+    def op():
+        [instance.to_dict() for instance in instances]
+    return op
+
+
+def get_by_ids(sizes, rng):
+    def op():
+        User.get_by_ids([rng.randint(1, sizes['user']) for _ in range(50)])
+    return op
+
+
+def parse_operator(sizes, rng):
+    conditions = {'user_id': 1, 'period__gte': 10, 'period__lt': 100, 'room_id__in': [1, 2, 3],
+                  'is_checked__ne': 0, 'amount__nin': [1, 2]}
+
+    def op():
+        LotteryLog.get_query(conditions).sql()
+    return op
+
+
+def get_authorization(sizes, rng):
+    """
+    需要 flask 和应用的 config，缺少时跳过。按线上配置开启 User 缓存（auth.enable_user_cache），
+    只在本场景内生效，不影响 get_by_ids 等场景
+    """
+    try:
+        from flask import Flask, g
+        from ..auth import Authorization
+    except ImportError:
+        return None
+    from ..cache import LRUCache
+    user_cache = LRUCache(maxsize=10000, ttl=60)
+
+    app = Flask(__name__)
+    tokens = []
+    with app.app_context():
+        for user_id in range(1, min(sizes['user'], 100) + 1):
+            tokens.append(Authorization().gen_token('PASSWORD', 1, user_id)['access_token'])
+
+    def op():
+        token = rng.choice(tokens)
+        cache, User.cache = User.cache, user_cache
+        try:
+            with app.test_request_context(headers={'Authorization': 'Bearer {}'.format(token)}):
+                g.headers = {}
+                if not Authorization().get_authorization().is_valid:
+                    raise Exception('token {} is not valid'.format(token))
+        finally:
+            User.cache = cache
+    return op
+
+
+def update_amount(sizes, rng):
+    def op():
+        User.update_amount(rng.randint(1, sizes['user']), 1, adding=rng.random() < 0.5)
+    return op
+
+
+SCENARIOS = (
+    ('get_list_page', get_list_page),
+    ('get_list_filter', get_list_filter),
+    ('to_dict', to_dict),
+    ('get_by_ids', get_by_ids),
+    ('parse_operator', parse_operator),
+    ('get_authorization', get_authorization),
+    ('update_amount', update_amount),
+)
+
+
+def build(sizes, names=None, seed=SEED):
+    """
+    返回 [(name, op)]，op 为 None 表示依赖缺失跳过
+    """
+    return [(name, factory(sizes, random.Random(seed)))
+            for name, factory in SCENARIOS if not names or name in names]
@@ -0,0 +1,65 @@
+# coding=utf-8
+"""
+Model.to_dict 与预编译序列化器的对比，不需要数据库
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from . import best_of
+from ..lottery_num import LotteryLog
+from ..serializer import get_serializer
+from ..user import User
+
+
+def make_rows(model_class, size):
+    rows = []
+    for i in range(size):
+        row = []
+        for field in model_class._meta.sorted_fields:
+            if field.get_db_field() in ('int', 'smallint', 'bool', 'primary_key'):
+                row.append(i)
+            else:
+                row.append('value-{}'.format(i))
+        rows.append(tuple(row))
+    return rows
+
+
+def make_instances(model_class, rows):
+    names = [field.name for field in model_class._meta.sorted_fields]
+    instances = []
+    for row in rows:
+        instance = model_class(**dict(zip(names, row)))
+        instance._prepare_instance()
+        instances.append(instance)
+    return instances
+
+
+def run(size=1000, repeat=5):
+    results = {}
+    for model_class in (User, LotteryLog):
+        rows = make_rows(model_class, size)
+        instances = make_instances(model_class, rows)
+        serializer = get_serializer(model_class)
+        names = [field.name for field in model_class._meta.sorted_fields]
+        columns = [names.index(name) for name in serializer.names]
+
+        expected = [instance.to_dict() for instance in instances]
+        if [serializer.from_instance(instance) for instance in instances] != expected \
+                or list(serializer.iter_tuples(rows, columns)) != expected:
+            raise Exception('serializer output of {} not match to_dict'.format(model_class.__name__))
+
+        to_dict = best_of(lambda: [instance.to_dict() for instance in instances], repeat)
+        from_instance = best_of(lambda: [serializer.from_instance(instance) for instance in instances], repeat)
+        from_tuples = best_of(lambda: list(serializer.iter_tuples(rows, columns)), repeat)
+        results[model_class.__name__] = {
+            'rows': size,
+            'to_dict_ms': to_dict * 1000,
+            'from_instance_ms': from_instance * 1000,
+            'from_tuples_ms': from_tuples * 1000,
+            'speedup': to_dict / from_tuples if from_tuples else None
+        }
+    return results
+
+
+if __name__ == '__main__':
+    for name, result in sorted(run().items()):
+        print(name, result)
@@ -0,0 +1,113 @@
+# coding=utf-8
+"""
+并发登录的 token 签发吞吐：原来的先查询再插入 与 Token.issue 一条语句的 upsert 对比
+
+使用临时 SQLite 文件库，每个线程一个连接：
+
+    python -m <package>.models.benchmarks.tokens
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from peewee import IntegrityError
+
+from ..pool import PooledSqlite
+from ..token import Token
+
+
+def _values(user_id, client_id, seq):
+    now = int(time.time())
+    return {
+        'grant_type': 'PASSWORD',
+        'access_token': 'token-{}-{}-{}'.format(user_id, client_id, seq),
+        'expires_in': 0,
+        'refresh_token': 'refresh-{}'.format(seq),
+        'client_id': client_id,
+        'user_id': user_id,
+        'create_time': now
+    }
+
+
+def select_then_insert(values):
+    """
+    改动前 Authorization.gen_token 的查询方式
+    """
+    token = Token.select().where(Token.grant_type == values['grant_type'], Token.user_id == values['user_id'],
+                                 Token.client_id == values['client_id']).first()
+    if token:
+        return token
+    try:
+        with Token._meta.database.atomic():
+            return Token.create(**values)
+    except IntegrityError:
+        return None
+
+
+def upsert(values):
+    return Token.issue(values)[0]
+
+
+def bench(func, threads, logins, users):
+    """
+    threads 个线程共登录 logins 次，用户在 users 个中轮换（users 小于 logins 时有重复登录）
+    """
+    Token.delete().execute()
+    errors = []
+    per_thread = logins // threads
+
+    def worker(n):
+        try:
+            for i in range(per_thread):
+                seq = n * per_thread + i
+                func(_values(seq % users, 1, seq))
+        except Exception as e:
+            errors.append(e)
+        finally:
+            Token._meta.database.close()
+
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    start = time.time()
+    for item in workers:
+        item.start()
+    for item in workers:
+        item.join()
+    elapsed = time.time() - start
+    return {
+        'logins_per_sec': per_thread * threads / elapsed if elapsed else None,
+        'errors': len(errors),
+        'tokens': Token.select().count()
+    }
+
+
+def run(threads=8, logins=4000):
+    """
+    first_login 每次登录都是新用户；repeat_login 四分之三的登录已有 token
+    """
+    directory = tempfile.mkdtemp()
+    database = PooledSqlite(os.path.join(directory, 'tokens.db'), max_connections=threads + 1,
+                            pragmas=[('journal_mode', 'wal')])
+    original = Token._meta.database
+    Token._meta.database = database
+    try:
+        Token.create_table()
+        results = {}
+        for scenario, users in (('first_login', logins), ('repeat_login', logins // 4)):
+            results[scenario] = {
+                'select_then_insert': bench(select_then_insert, threads, logins, users),
+                'upsert': bench(upsert, threads, logins, users)
+            }
+        return results
+    finally:
+        Token._meta.database = original
+        database.close_all()
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    for name, result in sorted(run().items()):
+        print(name, result)
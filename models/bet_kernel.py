@@ -0,0 +1,199 @@
+# coding=utf-8
+"""
+按期批量计算派奖，依赖 numpy
+
+    bets, payouts = evaluate_period(lottery_num_id, primary=True)   # payouts 与 bets['id'] 一一对应
+    totals = user_totals(bets['user_id'], payouts)                  # {user_id: 派奖金额}，可直接传给 settlement.apply_payouts
+
+settlement.settle_period 在一期的下注不少于 KERNEL_MIN_BETS 且安装了 numpy 时用 settle_rows 计算派奖
+
+下注内容按不同的文本只解析一次，编码为 uint16 的玩法码；每期只对全部玩法码算一次赔率表，
+派奖 = amount * 赔率表[玩法码] // 1000，结果与 PayoutRules.payout_of 逐行计算一致（oracle 用于校验）
+"""
+from __future__ import absolute_import, division, unicode_literals
+
+import weakref
+from contextlib import contextmanager
+
+from .lottery_num import LotteryNum, LotteryLog
+from .model import CHUNK_SIZE, _iter_chunks
+from .pool import use_primary
+from .settlement import SUM, get_rules
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+MAX_CACHED = 65536
+
+BET_DTYPE = [
+    (str('id'), 'i8'),
+    (str('user_id'), 'i8'),
+    (str('code'), 'u2'),
+    (str('amount'), 'i8'),
+]
+
+_kernels = weakref.WeakKeyDictionary()
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError('numpy is required for models.bet_kernel')
+
+
+class BetKernel(object):
+    """
+    一套 PayoutRules 对应的玩法码：odds 中的玩法按名字排序，之后为 sum_odds 中的和值，最后一个为无法识别
+    """
+
+    def __init__(self, rules):
+        self.rules = rules
+        self.kinds = tuple(sorted(rules.odds))
+        self.sums = tuple(sorted(rules.sum_odds))
+        self.invalid = len(self.kinds) + len(self.sums)
+        self._codes = {}
+
+    def encode_text(self, text):
+        """
+        下注内容 -> 玩法码，结果按文本缓存
+        """
+        code = self._codes.get(text)
+        if code is None:
+            bet = self.rules.parse(text)
+            if bet is None:
+                code = self.invalid
+            elif bet[0] == SUM:
+                code = len(self.kinds) + self.sums.index(bet[1])
+            else:
+                code = self.kinds.index(bet[0])
+            if len(self._codes) < MAX_CACHED:
+                self._codes[text] = code
+        return code
+
+    def decode(self, code):
+        """
+        玩法码 -> PayoutRules.parse 的结果
+        """
+        if code == self.invalid:
+            return None
+        if code >= len(self.kinds):
+            return SUM, self.sums[code - len(self.kinds)]
+        return self.kinds[code], 0
+
+    def encode(self, texts):
+        _require_numpy()
+        get = self._codes.get
+        codes = []
+        for text in texts:
+            code = get(text)
+            codes.append(self.encode_text(text) if code is None else code)
+        return np.array(codes, dtype=np.uint16)
+
+    def odds_table(self, draw):
+        """
+        draw 为 PayoutRules.draw 的结果，返回每个玩法码的赔率（千分之一），未中奖为 0
+        """
+        _require_numpy()
+        return np.array([self.rules.odds_of(self.decode(code), draw) for code in range(self.invalid + 1)],
+                        dtype=np.int64)
+
+    def evaluate(self, codes, amounts, draw):
+        """
+        返回与 codes 对齐的派奖金额（int64），与 PayoutRules.payout_of 一样 amount * 赔率 // 1000
+        """
+        _require_numpy()
+        amounts = np.asarray(amounts, dtype=np.int64)
+        return amounts * self.odds_table(draw)[np.asarray(codes)] // 1000
+
+    def oracle(self, texts, amounts, draw):
+        """
+        逐行调用 PayoutRules.payout_of 的参考实现，用于校验 evaluate
+        """
+        return [self.rules.payout_of(text, amount, draw) for text, amount in zip(texts, amounts)]
+
+
+def kernel(rules=None):
+    """
+    rules 对应的 BetKernel，默认为 settlement.configure 设置的规则
+    """
+    rules = get_rules(rules)
+    result = _kernels.get(rules)
+    if result is None:
+        result = _kernels[rules] = BetKernel(rules)
+    return result
+
+
+@contextmanager
+def _reads(primary):
+    if primary:
+        with use_primary():
+            yield
+    else:
+        yield
+
+
+def load_period(lottery_num_id, unchecked=True, rules=None, chunk_size=CHUNK_SIZE, primary=False):
+    """
+    一期的下注，结构化数组 (id, user_id, code, amount)，按 id 升序；unchecked 时只取未结算的。
+    primary 为 True 时从主库读取，结果用于派奖时使用
+    """
+    _require_numpy()
+    bet_kernel = kernel(rules)
+    query = LotteryLog.select(LotteryLog.id, LotteryLog.user_id, LotteryLog.text, LotteryLog.amount) \
+        .where(LotteryLog.period == lottery_num_id).order_by(LotteryLog.id)
+    if unchecked:
+        query = query.where(LotteryLog.is_checked == 0)
+    with _reads(primary):
+        query = LotteryLog.route_read(query)
+    sql, params = query.sql()
+
+    chunks = []
+    for keys, rows in _iter_chunks(query.database, sql, params, chunk_size):
+        chunk = np.zeros(len(rows), dtype=BET_DTYPE)
+        if rows:
+            log_ids, user_ids, texts, amounts = zip(*rows)
+            chunk['id'] = log_ids
+            chunk['user_id'] = user_ids
+            chunk['code'] = bet_kernel.encode(texts)
+            chunk['amount'] = amounts
+        chunks.append(chunk)
+    if not chunks:
+        return np.zeros(0, dtype=BET_DTYPE)
+    return np.concatenate(chunks)
+
+
+def evaluate_period(lottery_num_id, unchecked=True, rules=None, primary=False):
+    """
+    返回 (bets, payouts)，payouts[i] 为 bets['id'][i] 的派奖金额；
+    primary 为 True 时开奖记录和下注都从主库读取，结果用于派奖时使用
+    """
+    bet_kernel = kernel(rules)
+    with _reads(primary):
+        lottery_num = LotteryNum.get_one(LotteryNum.id == lottery_num_id)
+    if lottery_num is None:
+        raise Exception('lottery_num id = {} not exist'.format(lottery_num_id))
+    bets = load_period(lottery_num_id, unchecked, bet_kernel.rules, primary=primary)
+    return bets, bet_kernel.evaluate(bets['code'], bets['amount'], bet_kernel.rules.draw(lottery_num))
+
+
+def settle_rows(user_ids, texts, amounts, rules, draw):
+    """
+    settle_period 使用：返回 ({user_id: 派奖金额}，不含 0, 中奖注数)，与逐行 odds_of 的结果一致
+    """
+    bet_kernel = kernel(rules)
+    codes = bet_kernel.encode(texts)
+    amounts = np.asarray(amounts, dtype=np.int64)
+    odds = bet_kernel.odds_table(draw)[codes]
+    return user_totals(user_ids, amounts * odds // 1000), int(np.count_nonzero(odds))
+
+
+def user_totals(user_ids, payouts):
+    """
+    按用户汇总派奖，返回 {user_id: 金额}，不含 0
+    """
+    _require_numpy()
+    unique, inverse = np.unique(np.asarray(user_ids, dtype=np.int64), return_inverse=True)
+    totals = np.zeros(len(unique), dtype=np.int64)
+    np.add.at(totals, inverse.reshape(-1), payouts)
+    return dict((int(user_id), int(total)) for user_id, total in zip(unique, totals) if total)
@@ -0,0 +1,170 @@
+# coding=utf-8
+from __future__ import absolute_import, unicode_literals
+
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+_local = threading.local()
+_hook_lock = threading.Lock()
+
+
+class LRUCache(object):
+    """
+    线程安全的 LRU 缓存，ttl 为 None 时不过期
+    """
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.pop(key, None)
+            if item is None:
+                self.misses += 1
+                return default
+            value, expires_at = item
+            if expires_at is not None and expires_at < time.time():
+                self.misses += 1
+                return default
+            self._data[key] = item
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.time() + ttl if ttl else None
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (value, expires_at)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            return self._data.pop(key, None) is not None
+
+    def delete_where(self, predicate):
+        """
+        删除 predicate(key, value) 为真的项，返回删除的个数
+        """
+        with self._lock:
+            keys = [key for key, (value, expires_at) in self._data.items() if predicate(key, value)]
+            for key in keys:
+                del self._data[key]
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+    def __len__(self):
+        return len(self._data)
+
+
+def current_identity_map():
+    """
+    当前线程（请求）的 identity map，不在 unit of work 内时返回 None
+    """
+    return getattr(_local, 'identity_map', None)
+
+
+def begin_unit_of_work():
+    """
+    开始一个 unit of work，可挂在 app.before_request 上
+    """
+    _local.identity_map = {}
+    return _local.identity_map
+
+
+def end_unit_of_work(*args):
+    """
+    结束当前 unit of work，可挂在 app.teardown_request 上
+    """
+    _local.identity_map = None
+
+
+@contextmanager
+def unit_of_work():
+    """
+    with unit_of_work(): 内同一行只查询一次；嵌套时复用外层的 identity map
+    """
+    identity_map = current_identity_map()
+    if identity_map is not None:
+        yield identity_map
+        return
+
+    identity_map = begin_unit_of_work()
+    try:
+        yield identity_map
+    finally:
+        end_unit_of_work()
+
+
+def after_commit(database, callback):
+    """
+    database 在事务（transaction / atomic）中时，callback 在最外层事务提交后调用，回滚则丢弃；
+    不在事务中时立即调用
+    """
+    if database.transaction_depth() == 0:
+        callback()
+        return
+    _install_commit_hook(database)
+    _pending(database).append(callback)
+
+
+def _pending(database):
+    pending = getattr(_local, 'after_commit', None)
+    if pending is None:
+        pending = _local.after_commit = {}
+    return pending.setdefault(id(database), [])
+
+
+def _pop_pending(database):
+    pending = getattr(_local, 'after_commit', None)
+    return pending.pop(id(database), []) if pending else []
+
+
+def _install_commit_hook(database):
+    """
+    替换该 database 实例的 commit / rollback（同 profiler 替换 execute_sql 的方式），只安装一次
+    """
+    if '_after_commit_hook' in database.__dict__:
+        return
+    with _hook_lock:
+        if '_after_commit_hook' in database.__dict__:
+            return
+        commit, rollback = database.commit, database.rollback
+
+        def commit_hook():
+            commit()
+            if database.transaction_depth() <= 1:
+                for callback in _pop_pending(database):
+                    callback()
+
+        def rollback_hook():
+            rollback()
+            if database.transaction_depth() <= 1:
+                _pop_pending(database)
+
+        database.commit = commit_hook
+        database.rollback = rollback_hook
+        database._after_commit_hook = True
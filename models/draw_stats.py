@@ -0,0 +1,298 @@
+# coding=utf-8
+"""
+开奖号码的增量统计，按彩种 (LotteryNum.type) 分开：LotteryNum.create_record 插入时 O(1) 更新，读取 O(1)
+
+    LotteryNum.stats = {1: DrawStats.open('/data/draw_stats_1.json', type=1)}
+
+open 时读取快照并只补算快照之后的期号，不需要全表扫描；快照由后台线程每 snapshot_interval 秒写一次，
+不在 create_record 中做文件 I/O。多进程部署时只有入库的进程有本进程写入的开奖，
+其他进程读取 (snapshot) 时每 refresh_interval 秒检查一次快照文件和数据库，有新数据时重新读取或补算
+"""
+from __future__ import absolute_import, unicode_literals
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+from .lottery_num import LotteryNum
+
+LOGGER = logging.getLogger()
+
+POSITIONS = 3
+DIGIT_VALUES = 10
+SUM_VALUES = 28
+WINDOW = 100
+SNAPSHOT_INTERVAL = 5
+REFRESH_INTERVAL = 1
+
+
+class DrawStats(object):
+    def __init__(self, window=WINDOW, path=None, type=None, snapshot_interval=SNAPSHOT_INTERVAL,
+                 refresh_interval=REFRESH_INTERVAL):
+        """
+        :param window: 滑动窗口期数
+        :param path: 快照文件，为 None 时不持久化
+        :param type: 统计的彩种，为 None 时不区分
+        :param snapshot_interval: 后台写快照的间隔（秒），见 start
+        :param refresh_interval: snapshot 检查其他进程写入的最小间隔（秒），为 None 时不检查
+        """
+        self.window = window
+        self.path = path
+        self.type = type
+        self.snapshot_interval = snapshot_interval
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._mtime = None
+        self._checked = 0
+        self._stop = None
+        self.reset()
+
+    def reset(self):
+        self.draws = 0
+        self.last_period = 0
+        self.digit_counts = [[0] * DIGIT_VALUES for _ in range(POSITIONS)]
+        self.digit_last_seen = [[-1] * DIGIT_VALUES for _ in range(POSITIONS)]
+        self.digit_last_period = [[0] * DIGIT_VALUES for _ in range(POSITIONS)]
+        self.sum_counts = [0] * SUM_VALUES
+        self.sum_last_seen = [-1] * SUM_VALUES
+        self.sum_last_period = [0] * SUM_VALUES
+        self.recent = deque()
+        self.window_digit_counts = [[0] * DIGIT_VALUES for _ in range(POSITIONS)]
+        self.window_sum_counts = [0] * SUM_VALUES
+
+    def update(self, period, num_one, num_sec, num_thr, num_add):
+        """
+        追加一期，期号不大于已统计的最后一期时忽略并返回 False
+        """
+        with self._lock:
+            if period <= self.last_period:
+                LOGGER.warning('draw stats ignore period %s <= %s', period, self.last_period)
+                return False
+
+            index = self.draws
+            digits = (num_one, num_sec, num_thr)
+            for position, digit in enumerate(digits):
+                self.digit_counts[position][digit] += 1
+                self.digit_last_seen[position][digit] = index
+                self.digit_last_period[position][digit] = period
+                self.window_digit_counts[position][digit] += 1
+            self.sum_counts[num_add] += 1
+            self.sum_last_seen[num_add] = index
+            self.sum_last_period[num_add] = period
+            self.window_sum_counts[num_add] += 1
+
+            self.recent.append((period, num_one, num_sec, num_thr, num_add))
+            if len(self.recent) > self.window:
+                expired = self.recent.popleft()
+                for position, digit in enumerate(expired[1:4]):
+                    self.window_digit_counts[position][digit] -= 1
+                self.window_sum_counts[expired[4]] -= 1
+
+            self.draws += 1
+            self.last_period = period
+            self._dirty = True
+        return True
+
+    def digit_omission(self, position, digit):
+        return self.draws - 1 - self.digit_last_seen[position][digit]
+
+    def sum_omission(self, value):
+        return self.draws - 1 - self.sum_last_seen[value]
+
+    def hot_cold(self, top=3):
+        """
+        窗口内三个位置合计出现最多 / 最少的数字
+        """
+        counts = [sum(self.window_digit_counts[position][digit] for position in range(POSITIONS))
+                  for digit in range(DIGIT_VALUES)]
+        order = sorted(range(DIGIT_VALUES), key=lambda digit: (counts[digit], digit))
+        return {'counts': counts, 'hot': order[::-1][:top], 'cold': order[:top]}
+
+    def state(self):
+        """
+        可序列化的完整状态，也用于快照和校验
+        """
+        with self._lock:
+            return {
+                'window': self.window,
+                'type': self.type,
+                'draws': self.draws,
+                'last_period': self.last_period,
+                'digit_counts': [list(item) for item in self.digit_counts],
+                'digit_last_seen': [list(item) for item in self.digit_last_seen],
+                'digit_last_period': [list(item) for item in self.digit_last_period],
+                'sum_counts': list(self.sum_counts),
+                'sum_last_seen': list(self.sum_last_seen),
+                'sum_last_period': list(self.sum_last_period),
+                'recent': [list(item) for item in self.recent],
+                'window_digit_counts': [list(item) for item in self.window_digit_counts],
+                'window_sum_counts': list(self.window_sum_counts)
+            }
+
+    def snapshot(self):
+        """
+        最新统计，包含遗漏和冷热号
+        """
+        self.refresh()
+        state = self.state()
+        draws = state['draws']
+        state['digit_omission'] = [[draws - 1 - seen for seen in item] for item in state['digit_last_seen']]
+        state['sum_omission'] = [draws - 1 - seen for seen in state['sum_last_seen']]
+        state['hot_cold'] = self.hot_cold()
+        return state
+
+    def save(self, path=None):
+        """
+        先写本进程自己的临时文件再改名，进程崩溃或多个进程同时写时不会留下半个快照
+        """
+        path = path or self.path
+        with self._lock:
+            dirty, self._dirty = self._dirty, False
+        state = self.state()
+        tmp_path = '{}.{}.{}.tmp'.format(path, os.getpid(), threading.current_thread().ident)
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(state, f)
+            os.rename(tmp_path, path)
+        except Exception:
+            with self._lock:
+                self._dirty = self._dirty or dirty
+            raise
+        if path == self.path:
+            self._mtime = os.path.getmtime(path)
+
+    def load(self, state):
+        """
+        用 state() / 快照的内容替换当前统计，窗口或彩种不同时抛出异常
+        """
+        if state.get('window') != self.window or state.get('type') != self.type:
+            raise Exception('draw stats state window = {} type = {} not match {} {}'.format(
+                state.get('window'), state.get('type'), self.window, self.type))
+        with self._lock:
+            self.draws = state['draws']
+            self.last_period = state['last_period']
+            self.digit_counts = state['digit_counts']
+            self.digit_last_seen = state['digit_last_seen']
+            self.digit_last_period = state['digit_last_period']
+            self.sum_counts = state['sum_counts']
+            self.sum_last_seen = state['sum_last_seen']
+            self.sum_last_period = state['sum_last_period']
+            self.recent = deque(tuple(item) for item in state['recent'])
+            self.window_digit_counts = state['window_digit_counts']
+            self.window_sum_counts = state['window_sum_counts']
+
+    def _read_snapshot(self):
+        """
+        快照文件比本进程上次读写的新时读取，窗口或彩种不同时返回 None
+        """
+        if not self.path or not os.path.exists(self.path):
+            return None
+        mtime = os.path.getmtime(self.path)
+        if mtime == self._mtime:
+            return None
+        with open(self.path) as f:
+            state = json.load(f)
+        self._mtime = mtime
+        if state.get('window') != self.window or state.get('type') != self.type:
+            return None
+        return state
+
+    def refresh(self, force=False):
+        """
+        其他进程写入的开奖：快照文件更新过（如更正后全量重算）且不比本进程旧时重新读取，
+        再从数据库补算之后的期号。默认每 refresh_interval 秒最多检查一次，返回是否有变化
+        """
+        if not force:
+            if self.refresh_interval is None or time.time() - self._checked < self.refresh_interval:
+                return False
+        self._checked = time.time()
+        changed = False
+        state = self._read_snapshot()
+        if state is not None and state['last_period'] >= self.last_period:
+            self.load(state)
+            changed = True
+        return bool(self.catch_up()) or changed
+
+    def start(self):
+        """
+        启动后台线程，每 snapshot_interval 秒在有更新时写快照
+        """
+        if not self.path or self._stop is not None:
+            return self
+        self._stop = threading.Event()
+        thread = threading.Thread(target=self._run, name='draw-stats-{}'.format(self.type))
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def _run(self):
+        stop = self._stop
+        while not stop.wait(self.snapshot_interval):
+            if self._dirty:
+                try:
+                    self.save()
+                except Exception as e:
+                    LOGGER.exception('draw stats save failed: %s', e)
+
+    def close(self):
+        """
+        停止后台线程并写入最后的快照
+        """
+        if self._stop is not None:
+            self._stop.set()
+            self._stop = None
+        if self.path and self._dirty:
+            self.save()
+
+    def catch_up(self, after_period=None):
+        """
+        从数据库补算 after_period（默认已统计的最后一期）之后的开奖
+        """
+        after_period = self.last_period if after_period is None else after_period
+        query = LotteryNum.select(LotteryNum.id, LotteryNum.num_one, LotteryNum.num_sec,
+                                  LotteryNum.num_thr, LotteryNum.num_add) \
+            .where(LotteryNum.id > after_period).order_by(LotteryNum.id)
+        if self.type is not None:
+            query = query.where(LotteryNum.type == self.type)
+        count = 0
+        for row in LotteryNum.iter_list(query):
+            if self.update(row['id'], row['num_one'], row['num_sec'], row['num_thr'], row['num_add']):
+                count += 1
+        return count
+
+    @classmethod
+    def open(cls, path, window=WINDOW, type=None, snapshot_interval=SNAPSHOT_INTERVAL,
+             refresh_interval=REFRESH_INTERVAL):
+        """
+        读取快照（不存在或窗口、彩种不同则从头统计），再补算快照之后的开奖，并启动后台写快照
+        """
+        stats = cls(window=window, path=path, type=type, snapshot_interval=snapshot_interval,
+                    refresh_interval=refresh_interval)
+        state = stats._read_snapshot()
+        if state is not None:
+            stats.load(state)
+        if stats.catch_up() and path:
+            stats.save()
+        stats._checked = time.time()
+        return stats.start()
+
+    @classmethod
+    def rebuild(cls, window=WINDOW, type=None):
+        """
+        全量扫描重新统计，不持久化
+        """
+        stats = cls(window=window, type=type)
+        stats.catch_up(after_period=0)
+        return stats
+
+    def verify(self):
+        """
+        与全量重新统计的结果比较，返回不一致的字段列表，为空表示一致
+        """
+        expected = self.rebuild(window=self.window, type=self.type).state()
+        actual = self.state()
+        return sorted(key for key in expected if expected[key] != actual[key])
@@ -0,0 +1,237 @@
+# coding=utf-8
+"""
+字典查询条件的编译和缓存，供 Model.get_query / parse_operator / get_list 使用
+
+    {'user_id': 1, 'period__between': (10, 20), 'text__startswith': '大',
+     '$or': [{'room_id__in': [1, 2]}, {'is_checked': 0}]}
+
+条件的形状（字段、操作符、in 列表长度、是否为 None）只解析一次，之后每次调用只按缓存的字段和操作符
+生成表达式；不分页的 dict 列表查询还会缓存整条 SQL，只绑定参数
+"""
+from __future__ import absolute_import, unicode_literals
+
+import operator
+import re
+from functools import reduce
+
+from .cache import LRUCache
+
+OR = '$or'
+
+
+def _scalar(field, value):
+    return [field.db_value(value)]
+
+
+def _items(field, value):
+    return [field.db_value(item) for item in value]
+
+
+def _pair(field, value):
+    low, high = value
+    return [field.db_value(low), field.db_value(high)]
+
+
+def _nullable(field, value):
+    return [] if value is None else [field.db_value(value)]
+
+
+def _none(field, value):
+    return []
+
+
+def _pattern(template):
+    def params(field, value):
+        return [field.db_value(template % value)]
+    return params
+
+
+# 操作符 -> (生成表达式, 生成参数)，参数顺序与表达式编译出的占位符一致
+OPERATORS = {
+    'eq': (operator.eq, _nullable),
+    'ne': (operator.ne, _nullable),
+    'gt': (operator.gt, _scalar),
+    'gte': (operator.ge, _scalar),
+    'lt': (operator.lt, _scalar),
+    'lte': (operator.le, _scalar),
+    'in': (lambda field, value: field.in_(value), _items),
+    'nin': (lambda field, value: field.not_in(value), _items),
+    'between': (lambda field, value: field.between(*value), _pair),
+    'like': (lambda field, value: field ** value, _scalar),
+    'startswith': (lambda field, value: field.startswith(value), _pattern('%s%%')),
+    'contains': (lambda field, value: field.contains(value), _pattern('%%%s%%')),
+    'isnull': (lambda field, value: field.is_null(bool(value)), _none),
+}
+
+PLAN_CACHE = LRUCache(maxsize=1024)
+
+
+def parse_key(model_class, key):
+    """
+    'period__gte' -> (LotteryLog.period, 'gte')
+    """
+    name, _, op = key.partition('__')
+    op = op or 'eq'
+    if op not in OPERATORS:
+        raise Exception('field = {} not support operator = {}'.format(name, op))
+    field = model_class._meta.fields.get(name)
+    if field is None:
+        raise Exception('field = {} not exist in {}'.format(name, model_class.__name__))
+    return field, op
+
+
+def _value_shape(op, value):
+    if op in ('in', 'nin'):
+        return len(value)
+    if op in ('eq', 'ne'):
+        return value is None
+    if op == 'isnull':
+        return bool(value)
+    return None
+
+
+def shape_of(conditions):
+    shape = []
+    for key in sorted(conditions):
+        value = conditions[key]
+        if key == OR:
+            shape.append((key, tuple(shape_of(item) for item in value)))
+        else:
+            shape.append((key, _value_shape(key.partition('__')[2] or 'eq', value)))
+    return tuple(shape)
+
+
+def _always_true(plans):
+    """
+    $or 没有分支或有恒为真的分支（如 {}）时整个 $or 恒为真，与 matches 一致
+    """
+    return not plans or any(plan.always_true for plan in plans)
+
+
+class FilterPlan(object):
+    def __init__(self, model_class, conditions):
+        self.model_class = model_class
+        self.terms = []
+        for key in sorted(conditions):
+            if key == OR:
+                self.terms.append((key, None, [FilterPlan(model_class, item) for item in conditions[key]]))
+            else:
+                field, op = parse_key(model_class, key)
+                self.terms.append((key, field, op))
+        # 没有条件，或只有恒为真的 $or
+        self.always_true = all(key == OR and _always_true(op) for key, field, op in self.terms)
+        self._templates = {}
+
+    def expressions(self, conditions):
+        result = []
+        for key, field, op in self.terms:
+            if key == OR:
+                if _always_true(op):
+                    continue
+                groups = [reduce(operator.and_, plan.expressions(item)) for plan, item in zip(op, conditions[key])]
+                result.append(reduce(operator.or_, groups))
+            else:
+                result.append(OPERATORS[op][0](field, conditions[key]))
+        return result
+
+    def params(self, conditions):
+        result = []
+        for key, field, op in self.terms:
+            if key == OR:
+                if _always_true(op):
+                    continue
+                for plan, item in zip(op, conditions[key]):
+                    result.extend(plan.params(item))
+            else:
+                result.extend(OPERATORS[op][1](field, conditions[key]))
+        return result
+
+    def where(self, query, conditions):
+        expressions = self.expressions(conditions)
+        return query.where(*expressions) if expressions else query
+
+    def template(self, conditions, serializer):
+        """
+        编译 SELECT 全部输出字段的 SQL，参数与 params() 不一致（字段有特殊转换）时返回 None，
+        同一形状之后都走普通查询
+        """
+        template = self._templates.get(serializer)
+        if template is None:
+            query = self.where(self.model_class.select(*serializer.fields), conditions)
+            sql, params = query.sql()
+            if params == self.params(conditions):
+                template = (sql, [field.python_value for field in serializer.fields])
+            else:
+                template = False
+            self._templates[serializer] = template
+        return template or None
+
+    def select(self, conditions, serializer, make=None):
+        """
+        用缓存的 SQL 查询，返回 dict 列表（或 make(values) 的列表）；不能使用缓存 SQL 时返回 None
+        """
+        template = self.template(conditions, serializer)
+        if template is None:
+            return None
+        sql, converters = template
+        cursor = self.model_class.read_database().execute_sql(sql, self.params(conditions), False)
+        names = serializer.names
+        rows = [[convert(value) if value is not None else None for convert, value in zip(converters, row)]
+                for row in cursor.fetchall()]
+        if make is not None:
+            return [make(row) for row in rows]
+        return [dict(zip(names, row)) for row in rows]
+
+
+def compile_filter(model_class, conditions):
+    """
+    取缓存的条件计划
+    """
+    key = (model_class, shape_of(conditions))
+    plan = PLAN_CACHE.get(key)
+    if plan is None:
+        plan = FilterPlan(model_class, conditions)
+        PLAN_CACHE.set(key, plan)
+    return plan
+
+
+def _like(pattern):
+    regex = ''.join('.*' if char == '%' else '.' if char == '_' else re.escape(char) for char in pattern)
+    return re.compile('^{}$'.format(regex), re.I | re.S)
+
+
+def _compare(compare):
+    return lambda value, arg: value is not None and compare(value, arg)
+
+
+# 与 OPERATORS 对应的 Python 判断，用于不在数据库中的数据（如已归档的分区）
+PY_OPERATORS = {
+    'eq': operator.eq,
+    'ne': lambda value, arg: value is not None and value != arg if arg is not None else value is not None,
+    'gt': _compare(operator.gt),
+    'gte': _compare(operator.ge),
+    'lt': _compare(operator.lt),
+    'lte': _compare(operator.le),
+    'in': lambda value, arg: value in arg,
+    'nin': lambda value, arg: value is not None and value not in arg,
+    'between': lambda value, arg: value is not None and arg[0] <= value <= arg[1],
+    'like': lambda value, arg: value is not None and bool(_like(arg).match(value)),
+    'startswith': lambda value, arg: value is not None and value.lower().startswith(arg.lower()),
+    'contains': lambda value, arg: value is not None and arg.lower() in value.lower(),
+    'isnull': lambda value, arg: (value is None) == bool(arg),
+}
+
+
+def matches(conditions, row):
+    """
+    dict 形式的行是否满足条件，语义同 SQL（与 NULL 比较为假）
+    """
+    for key, value in conditions.items():
+        if key == OR:
+            if value and not any(matches(item, row) for item in value):
+                return False
+            continue
+        name, _, op = key.partition('__')
+        if not PY_OPERATORS[op or 'eq'](row.get(name), value):
+            return False
+    return True
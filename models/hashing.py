@@ -0,0 +1,203 @@
+# coding=utf-8
+"""
+密码哈希服务：PBKDF2 计算放到线程池中执行，请求线程只等待结果
+
+    hashing.configure(method='pbkdf2:sha256:260000', threads=4, max_pending=64)
+
+hashlib.pbkdf2_hmac 计算时释放 GIL，多个线程可以同时占用多个核；不用进程池，避免在已有线程的 worker 中 fork。
+（Python 2 需链接 OpenSSL 1.0+，否则 pbkdf2_hmac 是纯 Python 实现，计算时持有 GIL）
+同时提交的任务数超过 max_pending 时，新任务最多等待 timeout 秒，仍没有空位或计算超时则抛出 HashingBusy；
+超时的任务仍在计算，完成后才释放占用的空位。
+method 变更后旧哈希仍可校验，登录成功时按新参数重新计算（见 User.check_password）。
+threads=0 时在当前线程计算，用于测试和单线程脚本
+"""
+from __future__ import absolute_import, division, unicode_literals
+
+import atexit
+import os
+import threading
+import time
+
+METHOD = 'pbkdf2:sha256:150000'
+SALT_LENGTH = 8
+MAX_PENDING = 64
+TIMEOUT = 10
+CHUNK_SIZE = 64
+
+
+class HashingBusy(Exception):
+    pass
+
+
+def _generate(password, method, salt_length):
+    from werkzeug.security import generate_password_hash
+    return generate_password_hash(password, method=method, salt_length=salt_length)
+
+
+def _generate_many(args):
+    return _generate(*args)
+
+
+def _check(pwhash, password):
+    from werkzeug.security import check_password_hash
+    # Python 2 下数据库取出的是 unicode，werkzeug 只接受 str 的方法名
+    return check_password_hash(str(pwhash), password)
+
+
+class PasswordHasher(object):
+    def __init__(self, method=METHOD, salt_length=SALT_LENGTH, threads=None,
+                 max_pending=MAX_PENDING, timeout=TIMEOUT):
+        """
+        :param method: werkzeug 的哈希方法，需带迭代次数，如 pbkdf2:sha256:150000
+        :param threads: 线程数，默认 CPU 核数
+        :param max_pending: 同时提交到线程池的任务上限
+        :param timeout: 等待空位和等待结果的秒数
+        """
+        import multiprocessing
+        self.method = str(method)
+        self.salt_length = salt_length
+        self.threads = multiprocessing.cpu_count() if threads is None else threads
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._slots = threading.Condition(threading.Lock())
+        self._pending = 0
+        self._metrics = {'hashed': 0, 'verified': 0, 'rehashed': 0, 'busy': 0, 'max_pending': 0}
+
+    def _get_pool(self):
+        # 线程池在第一次使用时创建；fork 出的子进程中没有父进程的线程，需要重新创建
+        from multiprocessing.pool import ThreadPool
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid():
+                self._pool = ThreadPool(self.threads)
+                self._pid = os.getpid()
+            return self._pool
+
+    def _acquire(self):
+        with self._slots:
+            deadline = time.time() + self.timeout
+            while self._pending >= self.max_pending:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    self._metrics['busy'] += 1
+                    raise HashingBusy('password hashing queue is full')
+                self._slots.wait(remaining)
+            self._pending += 1
+            self._metrics['max_pending'] = max(self._metrics['max_pending'], self._pending)
+
+    def _release(self):
+        with self._slots:
+            self._pending -= 1
+            self._slots.notify()
+
+    def _count(self, name, value=1):
+        with self._slots:
+            self._metrics[name] += value
+
+    def _call(self, func, args):
+        # 在线程池中执行，计算结束（包括调用方已超时放弃）后才释放空位
+        try:
+            return func(*args)
+        finally:
+            self._release()
+
+    def _run(self, func, *args):
+        if not self.threads:
+            return func(*args)
+        import multiprocessing
+        self._acquire()
+        try:
+            result = self._get_pool().apply_async(self._call, (func, args))
+        except Exception:
+            self._release()
+            raise
+        try:
+            return result.get(self.timeout)
+        except multiprocessing.TimeoutError:
+            self._count('busy')
+            raise HashingBusy('password hashing timed out')
+
+    def hash(self, password):
+        result = self._run(_generate, password, self.method, self.salt_length)
+        self._count('hashed')
+        return result
+
+    def verify(self, pwhash, password):
+        if not pwhash or not password:
+            return False
+        result = self._run(_check, pwhash, password)
+        self._count('verified')
+        return result
+
+    def needs_rehash(self, pwhash):
+        """
+        哈希不是按当前 method 生成的
+        """
+        return bool(pwhash) and pwhash.split('$', 1)[0] != self.method
+
+    def rehash(self, pwhash, password):
+        """
+        password 已校验通过；需要升级时返回新哈希，否则返回 None
+        """
+        if not self.needs_rehash(pwhash):
+            return None
+        self._count('rehashed')
+        return self.hash(password)
+
+    def hash_many(self, passwords, chunk_size=CHUNK_SIZE):
+        """
+        批量哈希，按顺序返回列表，用于批量导入帐号；不占用 max_pending，会占满全部线程
+        """
+        args = [(password, self.method, self.salt_length) for password in passwords]
+        if not self.threads:
+            result = [_generate_many(item) for item in args]
+        else:
+            result = self._get_pool().map(_generate_many, args, chunk_size)
+        self._count('hashed', len(result))
+        return result
+
+    def stats(self):
+        with self._slots:
+            stats = dict(self._metrics, pending=self._pending)
+        stats['threads'] = self.threads
+        return stats
+
+    def close(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None and self._pid == os.getpid():
+            pool.terminate()
+            pool.join()
+
+
+_hasher = None
+_hasher_lock = threading.Lock()
+
+
+def configure(**kwargs):
+    """
+    替换全局哈希服务，参数同 PasswordHasher
+    """
+    global _hasher
+    with _hasher_lock:
+        previous, _hasher = _hasher, PasswordHasher(**kwargs)
+    if previous is not None:
+        previous.close()
+    return _hasher
+
+
+def get_hasher():
+    global _hasher
+    if _hasher is None:
+        with _hasher_lock:
+            if _hasher is None:
+                _hasher = PasswordHasher()
+    return _hasher
+
+
+@atexit.register
+def _close():
+    if _hasher is not None:
+        _hasher.close()
@@ -0,0 +1,366 @@
+# coding=utf-8
+"""
+开奖入库：校验 -> 按期号幂等写入 -> 进程内发布给订阅者（统计、结算、缓存），不需要轮询
+
+    pipeline = DrawPipeline()
+    pipeline.subscribe('stats', stats_subscriber(DrawStats.open('/data/draw_stats_1.json', type=1)))
+    pipeline.subscribe('settlement', settlement_subscriber())
+    pipeline.subscribe('cache', cache_subscriber())
+    LotteryNum.pipeline = pipeline      # create_record 改走 pipeline.ingest
+
+- 同一期重复到达（多个数据源）且号码相同时忽略，不报错也不重复通知
+- 号码不同时只有人工录入 (by_hand=1) 能覆盖已有记录，通知 kind = 'corrected'；否则记为冲突
+- 每个订阅者一个线程和队列，慢的订阅者不影响其他订阅者；stats() 返回入库和各订阅者的端到端延迟
+"""
+from __future__ import absolute_import, division, unicode_literals
+
+import datetime
+import logging
+import re
+import threading
+import time
+from collections import deque
+
+from peewee import IntegrityError, OperationalError
+
+from .lottery_num import LotteryNum
+from .model import is_retryable
+from .pool import use_primary
+
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+LOGGER = logging.getLogger()
+
+DIGITS = ('num_one', 'num_sec', 'num_thr')
+FIELDS = DIGITS + ('num_add', 'num_str', 'result')
+LATENCY_SAMPLES = 1000
+RECENT_DRAWS = 100
+MAX_RETRIES = 3
+
+INSERTED, CORRECTED, DUPLICATE, CONFLICT, INVALID = 'inserted', 'corrected', 'duplicate', 'conflict', 'invalid'
+
+_RE_NUMBER = re.compile(r'\d+')
+_STOP = object()
+
+timer = getattr(time, 'perf_counter', time.time)
+
+
+class DrawInvalid(Exception):
+    pass
+
+
+def _int(value):
+    try:
+        return int(value) if not isinstance(value, bool) else None
+    except (TypeError, ValueError):
+        return None
+
+
+def validate(values):
+    """
+    号码 0-9、和值等于三个号码之和；num_str 中的数字依次为三个号码（可带和值），
+    result 中有数字时第一个为和值；time、type 必填，字符串不超过字段长度。
+    期号、号码和 type 转为 int，不通过时抛出 DrawInvalid
+    """
+    period = _int(values.get('id'))
+    if period is None or period <= 0:
+        raise DrawInvalid('invalid period {!r}'.format(values.get('id')))
+    values['id'] = period
+    draw_type = _int(values.get('type'))
+    if draw_type is None:
+        raise DrawInvalid('period {} type = {!r} invalid'.format(period, values.get('type')))
+    values['type'] = draw_type
+    if not values.get('time'):
+        raise DrawInvalid('period {} time is required'.format(period))
+    by_hand = _int(values.get('by_hand', 0))
+    if by_hand not in (0, 1):
+        raise DrawInvalid('period {} by_hand = {!r} not 0 or 1'.format(period, values.get('by_hand')))
+    values['by_hand'] = by_hand
+    for name in ('time', 'num_str', 'result'):
+        max_length = LotteryNum._meta.fields[name].max_length
+        if values.get(name) and len('{}'.format(values[name])) > max_length:
+            raise DrawInvalid('period {} {} = {!r} longer than {}'.format(period, name, values[name], max_length))
+    digits = []
+    for name in DIGITS + ('num_add',):
+        values[name] = _int(values.get(name))
+    for name in DIGITS:
+        value = values[name]
+        if value is None or not 0 <= value <= 9:
+            raise DrawInvalid('period {} {} = {!r} not in 0-9'.format(period, name, value))
+        digits.append(value)
+    if values.get('num_add') != sum(digits):
+        raise DrawInvalid('period {} num_add = {!r} != {}'.format(period, values.get('num_add'), sum(digits)))
+
+    numbers = [int(item) for item in _RE_NUMBER.findall(values.get('num_str') or '')]
+    if numbers[:3] != digits or numbers[3:] not in ([], [sum(digits)]):
+        raise DrawInvalid('period {} num_str = {!r} not match {}'.format(period, values.get('num_str'), digits))
+    numbers = _RE_NUMBER.findall(values.get('result') or '')
+    if not values.get('result') or numbers and int(numbers[0]) != sum(digits):
+        raise DrawInvalid('period {} result = {!r} not match sum {}'.format(period, values.get('result'), sum(digits)))
+    return values
+
+
+class DrawEvent(object):
+    __slots__ = ('period', 'kind', 'draw', 'source', 'received', 'committed')
+
+    def __init__(self, period, kind, draw, source, received, committed):
+        """
+        :param draw: 写入后的开奖 dict
+        :param received / committed: ingest 收到和提交的时间（perf_counter）
+        """
+        self.period = period
+        self.kind = kind
+        self.draw = draw
+        self.source = source
+        self.received = received
+        self.committed = committed
+
+    def digits(self):
+        return tuple(self.draw[name] for name in DIGITS + ('num_add',))
+
+
+class _Latency(object):
+    def __init__(self, samples=LATENCY_SAMPLES):
+        self.samples = deque(maxlen=samples)
+        self.count = 0
+        self.errors = 0
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+        self.count += 1
+
+    def summary(self):
+        values = sorted(self.samples)
+        result = {'count': self.count, 'errors': self.errors}
+        if values:
+            result.update({
+                'p50_ms': values[len(values) // 2] * 1000,
+                'p99_ms': values[min(int(len(values) * 0.99), len(values) - 1)] * 1000,
+                'max_ms': values[-1] * 1000
+            })
+        return result
+
+
+class _Subscriber(object):
+    def __init__(self, name, callback, pipeline):
+        self.name = name
+        self.callback = callback
+        self.pipeline = pipeline
+        self.latency = _Latency()
+        self.queue = Queue()
+        self.thread = threading.Thread(target=self._run, name='draw-{}'.format(name))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            event = self.queue.get()
+            if event is _STOP:
+                return
+            try:
+                self.callback(event)
+            except Exception as e:
+                self.latency.errors += 1
+                LOGGER.exception('draw subscriber %s failed on period %s: %s', self.name, event.period, e)
+            else:
+                elapsed = timer() - event.received
+                self.latency.add(elapsed)
+                self.pipeline._record(event.period, self.name, elapsed)
+            finally:
+                self.queue.task_done()
+
+
+class DrawPipeline(object):
+    def __init__(self, validators=(validate,)):
+        self.validators = list(validators)
+        self._subscribers = {}
+        self._lock = threading.Lock()
+        self._ingest = _Latency()
+        self._counts = dict((kind, 0) for kind in (INSERTED, CORRECTED, DUPLICATE, CONFLICT, INVALID))
+        self._recent = {}
+        self._recent_order = deque()
+
+    def subscribe(self, name, callback):
+        """
+        callback(event) 在订阅者自己的线程中调用，异常只记日志
+        """
+        with self._lock:
+            if name in self._subscribers:
+                raise Exception('draw subscriber {} already exists'.format(name))
+            self._subscribers[name] = _Subscriber(name, callback, self)
+
+    def unsubscribe(self, name, timeout=None):
+        """
+        已入队的通知处理完后停止订阅者线程，等待最多 timeout 秒
+        """
+        with self._lock:
+            subscriber = self._subscribers.pop(name, None)
+        if subscriber is not None:
+            subscriber.queue.put(_STOP)
+            if threading.current_thread() is not subscriber.thread:
+                subscriber.thread.join(timeout)
+
+    def ingest(self, values, source=None):
+        """
+        values 为 LotteryNum 字段（期号为 id 或 period_id），返回 (kind, 开奖 dict)，
+        kind 为 inserted / corrected / duplicate / conflict
+        """
+        received = timer()
+        values = dict(values)
+        if 'period_id' in values:
+            values['id'] = values.pop('period_id')
+        values.setdefault('by_hand', 0)
+        try:
+            for validator in self.validators:
+                validator(values)
+        except DrawInvalid:
+            with self._lock:
+                self._counts[INVALID] += 1
+            raise
+
+        kind, draw = self._upsert_with_retry(values)
+        committed = timer()
+        with self._lock:
+            self._counts[kind] += 1
+            if kind in (INSERTED, CORRECTED):
+                self._ingest.add(committed - received)
+            subscribers = list(self._subscribers.values())
+
+        if kind in (INSERTED, CORRECTED):
+            event = DrawEvent(draw['id'], kind, draw, source, received, committed)
+            self._record(event.period, 'ingest', committed - received)
+            for subscriber in subscribers:
+                subscriber.queue.put(event)
+        elif kind == CONFLICT:
+            LOGGER.warning('draw period %s from %s conflicts with stored result, ignored', values['id'], source)
+        return kind, draw
+
+    def _upsert_with_retry(self, values):
+        # 在外层事务内时不能重试，死锁后整个事务已被回滚
+        nested = LotteryNum.db.transaction_depth() > 0
+        attempt = 0
+        while True:
+            try:
+                return self._upsert(dict(values))
+            except OperationalError as e:
+                if nested or attempt >= MAX_RETRIES or not is_retryable(e):
+                    raise
+                attempt += 1
+                LOGGER.warning('draw period %s ingest retry %s: %s', values['id'], attempt, e)
+                time.sleep(0.01 * attempt)
+
+    def _upsert(self, values):
+        period = values['id']
+        try:
+            with LotteryNum.db.atomic():
+                values.setdefault('create_time', datetime.datetime.now())
+                LotteryNum.insert(**values).execute()
+            return INSERTED, values
+        except IntegrityError:
+            pass
+
+        with LotteryNum.db.atomic():
+            existing = LotteryNum.select().where(LotteryNum.id == period).for_update(LotteryNum.db.for_update) \
+                .dicts().first()
+            if existing is None:
+                raise Exception('lottery_num id = {} insert failed but not exist'.format(period))
+            if all(existing[name] == values[name] for name in FIELDS):
+                return DUPLICATE, existing
+            if not values['by_hand']:
+                return CONFLICT, existing
+            changes = dict((name, values[name]) for name in FIELDS + ('time', 'type', 'by_hand') if name in values)
+            LotteryNum.update(**changes).where(LotteryNum.id == period).execute()
+            existing.update(changes)
+        LotteryNum.invalidate(period)
+        return CORRECTED, existing
+
+    def _record(self, period, name, seconds):
+        with self._lock:
+            item = self._recent.get(period)
+            if item is None:
+                item = self._recent[period] = {}
+                self._recent_order.append(period)
+                while len(self._recent_order) > RECENT_DRAWS:
+                    self._recent.pop(self._recent_order.popleft(), None)
+            item[name] = seconds * 1000
+
+    def join(self):
+        """
+        等待已发布的通知处理完
+        """
+        for subscriber in list(self._subscribers.values()):
+            subscriber.queue.join()
+
+    def latency(self, period):
+        """
+        某一期入库和各订阅者完成的耗时（毫秒，从 ingest 收到开始计）
+        """
+        with self._lock:
+            return dict(self._recent.get(period, {}))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'counts': dict(self._counts),
+                'ingest': self._ingest.summary(),
+                'subscribers': dict((name, subscriber.latency.summary())
+                                    for name, subscriber in self._subscribers.items())
+            }
+
+    def close(self, timeout=None):
+        for name in list(self._subscribers):
+            self.unsubscribe(name, timeout)
+
+
+def stats_subscriber(stats):
+    """
+    更新 draw_stats.DrawStats，只处理 stats.type 的开奖；更正的期号已统计过时全量重算
+    """
+    def callback(event):
+        if stats.type is not None and event.draw.get('type') != stats.type:
+            return
+        if event.kind == CORRECTED and event.period <= stats.last_period:
+            stats.load(stats.rebuild(window=stats.window, type=stats.type).state())
+            if stats.path:
+                stats.save()
+        else:
+            stats.update(event.period, *event.digits())
+    return callback
+
+
+def settlement_subscriber(rules=None, batch_size=None):
+    """
+    新开奖后结算该期，rules 为 settlement.PayoutRules（默认用 settlement.configure 的规则）；
+    已结算的下注不会因更正重新派奖，只记日志。结算可重复执行，锁冲突时重试。
+    结算的读查询都走主库，从库延迟时也能读到刚写入的一期
+    """
+    from .settlement import settle_period
+
+    def callback(event):
+        if event.kind == CORRECTED:
+            LOGGER.warning('draw period %s corrected, settled bets are not recomputed', event.period)
+        kwargs = {'batch_size': batch_size} if batch_size else {}
+        attempt = 0
+        while True:
+            try:
+                with use_primary():
+                    return settle_period(event.period, rules, **kwargs)
+            except OperationalError as e:
+                if attempt >= MAX_RETRIES or not is_retryable(e):
+                    raise
+                attempt += 1
+                LOGGER.warning('draw period %s settlement retry %s: %s', event.period, attempt, e)
+                time.sleep(0.01 * attempt)
+    return callback
+
+
+def cache_subscriber():
+    """
+    清除 LotteryNum 的进程缓存（开启 enable_cache 时）
+    """
+    def callback(event):
+        LotteryNum.invalidate(event.period)
+    return callback
@@ -0,0 +1,274 @@
+# coding=utf-8
+"""
+余额账本：批量余额变动在一个事务内完成，每个变动写一行 AmountDetail
+"""
+from __future__ import absolute_import, unicode_literals
+
+import logging
+import random
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from peewee import *
+from playhouse.shortcuts import case
+
+from .model import Model, BATCH_SIZE, is_retryable
+from .payment import AmountDetail
+from .user import User
+
+LOGGER = logging.getLogger()
+
+
+class InsufficientBalance(Exception):
+    def __init__(self, user_id, balance, amount):
+        super(InsufficientBalance, self).__init__(
+            'user_id = {} balance = {} not enough for {}'.format(user_id, balance, amount))
+        self.user_id = user_id
+        self.balance = balance
+        self.amount = amount
+
+
+class BalanceSlot(Model):
+    """
+    热点账户的分片余额，记账时随机写入一个分片，定期合并回 user.balance
+    """
+    class Meta:
+        db_table = 'user_balance_slot'
+        indexes = (
+            (('user_id', 'slot'), True),
+        )
+    id = PrimaryKeyField()
+    user_id = IntegerField()
+    slot = SmallIntegerField(default=0)
+    balance = IntegerField(default=0)
+    update_time = IntegerField(default=0)
+
+
+class Ledger(object):
+    def __init__(self, hot_accounts=None, max_retries=3, batch_size=BATCH_SIZE):
+        """
+        :param dict hot_accounts: {user_id: 分片数}，这些账户的变动写入分片
+        :param int max_retries: 死锁或锁等待超时时的重试次数
+        """
+        self.hot_accounts = dict(hot_accounts or {})
+        self.max_retries = max_retries
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._stats = {
+            'batches': 0,
+            'deltas': 0,
+            'retries': 0,
+            'failures': 0,
+            'insufficient': 0,
+            'lock_wait': 0.0,
+            'slot_writes': 0,
+            'folds': 0
+        }
+
+    def _incr(self, key, value=1):
+        with self._lock:
+            self._stats[key] += value
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    def apply(self, deltas, type=0, tips='', check_balance=True):
+        """
+        原子地应用一批余额变动
+
+        :param deltas: [(user_id, amount_change), ...] 或 [(user_id, amount_change, tips), ...]
+        :param bool check_balance: 变动后余额（热点账户包含分片余额）为负时抛出 InsufficientBalance，整批回滚
+        :return: {user_id: 变动后余额}，热点账户为包含分片的余额
+        """
+        deltas = [delta if len(delta) == 3 else (delta[0], delta[1], tips) for delta in deltas]
+        if not deltas:
+            return {}
+
+        # 在外层事务内时 atomic 只是 savepoint，死锁后整个事务已被回滚，不能在这里重试
+        nested = Model.db.transaction_depth() > 0
+        attempt = 0
+        while True:
+            try:
+                with Model.db.atomic():
+                    balances = self._apply(deltas, type, check_balance)
+                break
+            except InsufficientBalance:
+                self._incr('insufficient')
+                raise
+            except (OperationalError, IntegrityError) as e:
+                if nested or attempt >= self.max_retries or not is_retryable(e):
+                    self._incr('failures')
+                    raise
+                attempt += 1
+                self._incr('retries')
+                LOGGER.warning('ledger retry %s: %s', attempt, e)
+                time.sleep(0.01 * attempt)
+
+        self._incr('batches')
+        self._incr('deltas', len(deltas))
+        return balances
+
+    def _apply(self, deltas, type, check_balance):
+        now = Model.now()
+        date_id = Model.get_date_id_from_timestamp(now)
+
+        # 热点账户的入账写分片；有扣款且需要校验余额时和普通账户一样锁 user 行，按 user.balance + 分片余额校验
+        debtors = set(delta[0] for delta in deltas if delta[1] < 0) if check_balance else set()
+        is_hot = [delta[0] in self.hot_accounts and delta[0] not in debtors for delta in deltas]
+        normal = [delta for delta, hot in zip(deltas, is_hot) if not hot]
+        hot = [delta for delta, hot in zip(deltas, is_hot) if hot]
+
+        # 按 id 顺序加锁，避免并发批次互相死锁
+        user_ids = sorted(set(delta[0] for delta in normal))
+        balances = OrderedDict()
+        start = time.time()
+        for i in range(0, len(user_ids), self.batch_size):
+            chunk = user_ids[i:i + self.batch_size]
+            query = User.select(User.id, User.balance).where(User.id.in_(chunk)).order_by(User.id) \
+                .for_update(Model.db.for_update).tuples()
+            balances.update(query)
+        pending = self._slot_balances([user_id for user_id in user_ids if user_id in self.hot_accounts], lock=True)
+        self._incr('lock_wait', time.time() - start)
+
+        details = []
+        for user_id, amount_change, delta_tips in normal:
+            if user_id not in balances:
+                raise Exception('user_id = {} not exist'.format(user_id))
+            balance = balances[user_id] + amount_change
+            if check_balance and amount_change < 0 and balance + pending.get(user_id, 0) < 0:
+                raise InsufficientBalance(user_id, balances[user_id] + pending.get(user_id, 0), -amount_change)
+            balances[user_id] = balance
+            details.append(self._detail(user_id, amount_change, balance + pending.get(user_id, 0), type,
+                                        delta_tips, now, date_id))
+
+        items = list(balances.items())
+        for i in range(0, len(items), self.batch_size):
+            chunk = items[i:i + self.batch_size]
+            User.update({User.balance: case(User.id, chunk, User.balance)}) \
+                .where(User.id.in_([user_id for user_id, balance in chunk])).execute()
+        User.invalidate(*user_ids)
+        for user_id, amount in pending.items():
+            balances[user_id] += amount
+
+        slot_deltas = defaultdict(int)
+        for user_id, amount_change, delta_tips in hot:
+            slot = random.randrange(self.hot_accounts[user_id])
+            slot_deltas[(user_id, slot)] += amount_change
+        for (user_id, slot), amount_change in sorted(slot_deltas.items()):
+            self._add_to_slot(user_id, slot, amount_change, now)
+
+        # 热点账户的流水记录写入后的合并余额（user.balance + 分片），同一批内按变动顺序倒推
+        folded = self._folded_balances(sorted(set(delta[0] for delta in hot)))
+        hot_details = []
+        for user_id, amount_change, delta_tips in reversed(hot):
+            hot_details.append(self._detail(user_id, amount_change, folded[user_id], type, delta_tips, now, date_id))
+            balances.setdefault(user_id, folded[user_id])
+            folded[user_id] -= amount_change
+        details.extend(reversed(hot_details))
+
+        AmountDetail.add_many(details, batch_size=self.batch_size)
+        return dict(balances)
+
+    @staticmethod
+    def _detail(user_id, amount_change, balance, type, tips, now, date_id):
+        return {
+            'user_id': user_id,
+            'create_time': now,
+            'amount': balance,
+            'amount_change': amount_change,
+            'type': type,
+            'date_id': date_id,
+            'tips': tips
+        }
+
+    @staticmethod
+    def _slot_balances(user_ids, lock=False):
+        """
+        {user_id: 分片余额之和}，lock 时锁住这些分片行（会阻塞并发的入账，只在扣款时使用）
+        """
+        if not user_ids:
+            return {}
+        query = BalanceSlot.select(BalanceSlot.user_id, fn.SUM(BalanceSlot.balance)) \
+            .where(BalanceSlot.user_id.in_(user_ids)).group_by(BalanceSlot.user_id)
+        if lock:
+            query = query.for_update(Model.db.for_update)
+        return dict((user_id, int(total or 0)) for user_id, total in query.tuples())
+
+    def _folded_balances(self, user_ids):
+        if not user_ids:
+            return {}
+        balances = dict(User.select(User.id, User.balance).where(User.id.in_(user_ids)).tuples())
+        missing = [user_id for user_id in user_ids if user_id not in balances]
+        if missing:
+            raise Exception('user_id = {} not exist'.format(missing[0]))
+        for user_id, total in self._slot_balances(user_ids).items():
+            balances[user_id] += total
+        return balances
+
+    def _add_to_slot(self, user_id, slot, amount_change, now):
+        if isinstance(Model.db, MySQLDatabase):
+            sql = 'INSERT INTO `{}` (`user_id`, `slot`, `balance`, `update_time`) VALUES (%s, %s, %s, %s) ' \
+                  'ON DUPLICATE KEY UPDATE `balance` = `balance` + VALUES(`balance`), ' \
+                  '`update_time` = VALUES(`update_time`)'.format(BalanceSlot._meta.db_table)
+            Model.db.execute_sql(sql, (user_id, slot, amount_change, now))
+        else:
+            # 其他数据库（SQLite）写入是串行的，UPDATE 后 INSERT 不会并发冲突
+            updated = BalanceSlot.update(balance=BalanceSlot.balance + amount_change, update_time=now) \
+                .where(BalanceSlot.user_id == user_id, BalanceSlot.slot == slot).execute()
+            if not updated:
+                BalanceSlot.insert(user_id=user_id, slot=slot, balance=amount_change, update_time=now).execute()
+        self._incr('slot_writes')
+
+    def debit(self, user_id, amount, type=0, tips=''):
+        """
+        单个账户扣款，余额不足时抛出 InsufficientBalance，不需要先 SELECT ... FOR UPDATE；
+        热点账户按包含分片的余额校验，走 apply
+        """
+        if user_id in self.hot_accounts:
+            return self.apply([(user_id, -amount)], type=type, tips=tips)[user_id]
+
+        with Model.db.atomic():
+            updated = User.update(balance=User.balance - amount) \
+                .where(User.id == user_id, User.balance >= amount).execute()
+            User.invalidate(user_id)
+            balance = User.select(User.balance).where(User.id == user_id).scalar()
+            if not updated:
+                self._incr('insufficient')
+                raise InsufficientBalance(user_id, balance, amount)
+
+            now = Model.now()
+            AmountDetail.add_many([self._detail(user_id, -amount, balance, type, tips, now,
+                                                Model.get_date_id_from_timestamp(now))])
+        self._incr('deltas')
+        return balance
+
+    def fold(self, user_id):
+        """
+        把热点账户的分片余额合并回 user.balance，建议定时调用
+        """
+        with Model.db.atomic():
+            # 和 apply 一样先锁 user 行再锁分片，避免与扣款互相死锁
+            User.select(User.id).where(User.id == user_id).for_update(Model.db.for_update).execute()
+            slots = list(BalanceSlot.select(BalanceSlot.id, BalanceSlot.balance)
+                         .where(BalanceSlot.user_id == user_id, BalanceSlot.balance != 0)
+                         .for_update(Model.db.for_update).tuples())
+            total = sum(balance for slot_id, balance in slots)
+            if slots:
+                User.update(balance=User.balance + total).where(User.id == user_id).execute()
+                BalanceSlot.update(balance=0, update_time=Model.now()) \
+                    .where(BalanceSlot.id.in_([slot_id for slot_id, balance in slots])).execute()
+                User.invalidate(user_id)
+        self._incr('folds')
+        return total
+
+    def fold_all(self):
+        return dict((user_id, self.fold(user_id)) for user_id in sorted(self.hot_accounts))
+
+    def get_balance(self, user_id):
+        """
+        账户余额，包含尚未合并的分片余额
+        """
+        balance = User.select(User.balance).where(User.id == user_id).scalar() or 0
+        return balance + self._slot_balances([user_id]).get(user_id, 0)
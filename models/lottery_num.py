@@ -3,7 +3,8 @@ import datetime
 import logging
 
 from peewee import *
-from .model import Model
+from .model import Model, BATCH_SIZE
+from .archive import ArchiveMixin
 
 LOGGER = logging.getLogger()
 
@@ -23,14 +24,34 @@ class LotteryNum(Model):
     by_hand = SmallIntegerField(null=False, default=0)
     create_time = CharField(default=0, max_length=32)
 
+    # 增量统计 {type: DrawStats}，见 draw_stats.DrawStats.open
+    stats = None
+    # 开奖入库管道，见 ingest.DrawPipeline
+    pipeline = None
+
     @classmethod
     def create_record(cls, period_id, time, num_one, num_sec, num_thr, num_add, num_str, result, type, by_hand):
-        return cls.insert(id=period_id, time=time, num_one=num_one,
-                          num_sec=num_sec, num_thr=num_thr, num_add=num_add, num_str=num_str,
-                          result=result, type=type, by_hand=by_hand, create_time=datetime.datetime.now()).execute()
+        """
+        设置 pipeline 时改为校验、幂等写入并通知订阅者（统计由订阅者更新），返回期号
+        """
+        if cls.pipeline is not None:
+            cls.pipeline.ingest(dict(id=period_id, time=time, num_one=num_one, num_sec=num_sec, num_thr=num_thr,
+                                     num_add=num_add, num_str=num_str, result=result, type=type, by_hand=by_hand))
+            return period_id
+        row_id = cls.insert(id=period_id, time=time, num_one=num_one,
+                            num_sec=num_sec, num_thr=num_thr, num_add=num_add, num_str=num_str,
+                            result=result, type=type, by_hand=by_hand, create_time=datetime.datetime.now()).execute()
+        stats = cls.stats.get(type) if cls.stats else None
+        if stats is not None:
+            try:
+                stats.update(period_id, num_one, num_sec, num_thr, num_add)
+            except Exception as e:
+                # 统计失败不影响开奖入库，可用 stats.verify() / DrawStats.rebuild 修复
+                LOGGER.exception('draw stats update failed: %s', e)
+        return row_id
 
 
-class LotteryLog(Model):
+class LotteryLog(ArchiveMixin, Model):
     class Meta:
         db_table = 'lottery_log'
     id = PrimaryKeyField()
@@ -42,10 +63,39 @@ class LotteryLog(Model):
     is_checked = IntegerField(default=0)
     room_id = IntegerField(default=0)
 
+    archive_time_field = 'create_time'
+    archive_time_format = 'datetime'
+
     @classmethod
     def create_record(cls, user_id, num_id, text, amount):
-        return cls.insert(user_id=user_id, num_id=num_id, text=text,
-                          amount=amount, create_time=datetime.datetime.now()).execute()
+        """
+        开启 write_behind 时异步写入，返回 None
+        """
+        values = dict(user_id=user_id, period=num_id, text=text,
+                      amount=amount, create_time=datetime.datetime.now())
+        if cls.write_behind is not None:
+            return cls.write_behind.put(values)
+        return cls.insert(**values).execute()
+
+    @classmethod
+    def bulk_create_records(cls, records, batch_size=BATCH_SIZE):
+        """
+        批量下注记录，records 为 dict 的可迭代对象（可以是生成器），
+        字段同 create_record: user_id, num_id (或 period), text, amount, 可选 room_id
+
+        :return: 插入的行数
+        """
+        create_time = datetime.datetime.now()
+
+        def rows():
+            for record in records:
+                values = dict(record)
+                if 'num_id' in values:
+                    values['period'] = values.pop('num_id')
+                values.setdefault('create_time', create_time)
+                yield values
+
+        return cls.add_many(rows(), batch_size=batch_size)
 
 
 
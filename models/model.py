@@ -5,13 +5,51 @@ import peewee
 from peewee import *
 from peewee import Node
 
+from collections import OrderedDict
 from datetime import datetime
+from functools import reduce
+from itertools import islice
+import base64
+import operator
 import time
 import json
 
 from extensions import db
+from .cache import LRUCache, after_commit, current_identity_map
+from .filters import OPERATORS, compile_filter, parse_key
+from .pool import ReplicaRouter, use_primary
+from .profiler import QueryProfiler
+from .prefetch import prefetch as prefetch_related
+from .rows import row_class, to_rows
+from .serializer import get_serializer
 
 LIMIT = 10
+BATCH_SIZE = 500
+CHUNK_SIZE = 1000
+
+# MySQL 锁等待超时 / 死锁
+RETRY_ERRORS = (1205, 1213)
+
+
+def is_retryable(e):
+    """
+    锁等待超时、死锁或 SQLite 的 database is locked，整个事务可以重试
+    """
+    code = e.args[0] if e.args else None
+    return code in RETRY_ERRORS or 'locked' in '{}'.format(e)
+
+
+def _async(name):
+    """
+    生成 name 的 asyncio 版本（类方法），在 aio 的线程池中执行
+    """
+    def method(cls, *args, **kwargs):
+        # aio 只支持 Python 3，用到时才导入
+        from . import aio
+        return aio.run(getattr(cls, name), *args, **kwargs)
+    method.__name__ = str('a' + name)
+    method.__doc__ = 'asyncio 版本的 {}，见 aio 模块'.format(name)
+    return classmethod(method)
 
 
 class Model(db.Model):
@@ -20,6 +58,18 @@ class Model(db.Model):
 
     db = db.database
 
+    # 进程级 (model, pk) 缓存，默认关闭，通过 enable_cache 开启
+    cache = None
+
+    # SQL 统计，默认关闭，通过 enable_profiler 开启
+    profiler = None
+
+    # 读写分离，默认关闭，通过 use_replicas 开启
+    router = None
+
+    # 写缓冲，默认关闭，通过 enable_write_behind 按模型开启
+    write_behind = None
+
     @classmethod
     def table_name(cls):
         return cls._meta.db_table
@@ -40,9 +90,145 @@ class Model(db.Model):
             create_time = cls.now()
         return int(datetime.fromtimestamp(create_time).strftime('%Y%m%d'))
 
+    @classmethod
+    def enable_write_behind(cls, **kwargs):
+        """
+        为该模型开启异步批量写入，参数见 writebehind.WriteBehind
+        """
+        from .writebehind import WriteBehind
+        cls.disable_write_behind()
+        cls.write_behind = WriteBehind(cls, **kwargs).start()
+        return cls.write_behind
+
+    @classmethod
+    def disable_write_behind(cls, timeout=None):
+        """
+        写完队列后关闭，之后恢复同步写入
+        """
+        write_behind, cls.write_behind = cls.write_behind, None
+        if write_behind is not None:
+            write_behind.stop(timeout)
+
+    @classmethod
+    def enable_cache(cls, maxsize=1024, ttl=60):
+        """
+        为该模型开启进程级 LRU 缓存，get_by_id / get_by_ids 先查缓存
+        """
+        cls.cache = LRUCache(maxsize=maxsize, ttl=ttl)
+        return cls.cache
+
+    @classmethod
+    def use_replicas(cls, *replicas):
+        """
+        SELECT 查询轮询走从库，事务内和 pool.use_primary() 内仍走主库
+        """
+        Model.router = ReplicaRouter(cls.db, replicas) if replicas else None
+        if Model.profiler is not None:
+            for replica in replicas:
+                Model.profiler.install(replica)
+        return Model.router
+
+    @classmethod
+    def read_database(cls):
+        if Model.router is None:
+            return cls.db
+        return Model.router.read_database()
+
+    @classmethod
+    def route_read(cls, query):
+        """
+        返回路由到读库的查询副本
+        """
+        if Model.router is None or not isinstance(query, peewee.SelectQuery):
+            return query
+        database = Model.router.read_database()
+        if database is query.database:
+            return query
+        query = query.clone()
+        query.database = database
+        return query
+
+    @classmethod
+    def enable_profiler(cls, slow_ms=100, explain=False):
+        """
+        开启 SQL 统计，所有模型共用一个 profiler，统计主库和从库，见 profiler.QueryProfiler
+        """
+        Model.disable_profiler()
+        Model.profiler = QueryProfiler(slow_ms=slow_ms, explain=explain).install(cls.db)
+        for replica in (Model.router.replicas if Model.router is not None else ()):
+            Model.profiler.install(replica)
+        return Model.profiler
+
+    @classmethod
+    def disable_profiler(cls):
+        if Model.profiler is not None:
+            Model.profiler.uninstall()
+            Model.profiler = None
+
+    @classmethod
+    def _cache_key(cls, pk_value):
+        return cls._meta.db_table, cls._meta.primary_key.python_value(pk_value)
+
+    @classmethod
+    def _get_cached(cls, pk_value):
+        """
+        依次查 identity map 和进程缓存，命中缓存时放入 identity map
+        """
+        key = cls._cache_key(pk_value)
+        identity_map = current_identity_map()
+        if identity_map is not None and key in identity_map:
+            return identity_map[key]
+
+        if cls.cache is not None:
+            data = cls.cache.get(key)
+            if data is not None:
+                instance = cls(**data)
+                instance._prepare_instance()
+                if identity_map is not None:
+                    identity_map[key] = instance
+                return instance
+        return None
+
+    @classmethod
+    def _set_cached(cls, instance):
+        key = cls._cache_key(instance._get_pk_value())
+        identity_map = current_identity_map()
+        if identity_map is not None:
+            identity_map[key] = instance
+        if cls.cache is not None:
+            cls.cache.set(key, dict(instance._data))
+
+    @classmethod
+    def invalidate(cls, *pk_values):
+        """
+        写操作后清除 identity map 和进程缓存中对应的行；在事务中时提交后再清除一次进程缓存，
+        避免其他线程在提交前把旧数据重新放入缓存
+        """
+        identity_map = current_identity_map()
+        keys = [cls._cache_key(pk_value) for pk_value in pk_values]
+        for key in keys:
+            if identity_map is not None:
+                identity_map.pop(key, None)
+            if cls.cache is not None:
+                cls.cache.delete(key)
+
+        cache = cls.cache
+        if cache is not None and cls.db.transaction_depth():
+            after_commit(cls.db, lambda: [cache.delete(key) for key in keys])
+
     @classmethod
     def get_by_id(cls, pk_value):
-        return cls.get_one(cls._meta.primary_key == pk_value)
+        if cls.cache is None and current_identity_map() is None:
+            return cls.get_one(cls._meta.primary_key == pk_value)
+
+        instance = cls._get_cached(pk_value)
+        if instance is None:
+            # 放入缓存的数据从主库读，从库的延迟数据不能进缓存
+            with use_primary():
+                instance = cls.get_one(cls._meta.primary_key == pk_value)
+            if instance is not None:
+                cls._set_cached(instance)
+        return instance
 
     @classmethod
     def get_by_ids(cls, ids, is_object=False):
@@ -52,11 +238,34 @@ class Model(db.Model):
 
         ids = set(ids)
 
-        query = cls.select().where(cls._meta.primary_key.in_(ids))
-        data = cls.get_list(query, is_object=is_object)
+        if cls.cache is None and current_identity_map() is None:
+            query = cls.select().where(cls._meta.primary_key.in_(ids))
+            data = cls.get_list(query, is_object=is_object)
 
-        for value in data:
-            result[value[cls._meta.primary_key.name]] = value
+            for value in data:
+                result[value[cls._meta.primary_key.name]] = value
+            return result
+
+        # 只查询 identity map 和缓存中没有的 id
+        instances = []
+        missing = []
+        for pk_value in ids:
+            instance = cls._get_cached(pk_value)
+            if instance is None:
+                missing.append(pk_value)
+            else:
+                instances.append(instance)
+
+        if missing:
+            query = cls.select().where(cls._meta.primary_key.in_(missing))
+            with use_primary():
+                missing_instances = cls.get_list(query, is_object=True)
+            for instance in missing_instances:
+                cls._set_cached(instance)
+                instances.append(instance)
+
+        for instance in instances:
+            result[instance._get_pk_value()] = instance if is_object else instance.to_dict()
         return result
 
     @classmethod
@@ -65,6 +274,9 @@ class Model(db.Model):
         if not values:
             return result
 
+        if key == cls._meta.primary_key.name:
+            return cls.get_by_ids(values, is_object=is_object)
+
         values = set(values)
 
         query = cls.select().where(getattr(cls, key).in_(values))
@@ -76,56 +288,63 @@ class Model(db.Model):
 
     @classmethod
     def get_one(cls, *query, **kwargs):
-        try:
-            return cls.get(*query, **kwargs)
-        except peewee.DoesNotExist:
-            return None
+        select_query = cls.select().naive()
+        if query:
+            select_query = select_query.where(*query)
+        if kwargs:
+            select_query = select_query.filter(**kwargs)
+        return cls.get_one_by_query(select_query)
 
     @classmethod
     def get_one_by_query(cls, query):
         try:
-            return query.get()
+            return cls.route_read(query).get()
         except peewee.DoesNotExist:
             return None
 
     @classmethod
     def parse_operator(cls, query, key, value):
-        if '__' not in key:
-            query = query.where(getattr(cls, key) == value)
-        else:
-            field, operator = key.split('__')
-            if operator == 'in':
-                query = query.where(getattr(getattr(cls, field), 'in_')(value))
-            elif operator == 'gt':
-                query = query.where(getattr(cls, field) > value)
-            elif operator == 'gte':
-                query = query.where(getattr(cls, field) >= value)
-            elif operator == 'lt':
-                query = query.where(getattr(cls, field) < value)
-            elif operator == 'lte':
-                query = query.where(getattr(cls, field) <= value)
-            elif operator == 'ne':
-                query = query.where(getattr(cls, field) != value)
-            elif operator == 'nin':
-                query = query.where(getattr(getattr(cls, field), 'not_in')(value))
-            else:
-                raise Exception('field = {} not support operator = {}'.format(field, operator))
-
-        return query
+        """
+        单个条件，操作符见 filters.OPERATORS
+        """
+        field, op = parse_key(cls, key)
+        return query.where(OPERATORS[op][0](field, value))
 
     @classmethod
-    def get_list(cls, query_or_model=None, paging=None, is_object=False, recurse=False):
+    def get_query(cls, query_or_model=None):
         if query_or_model is None:
             query = cls.select()
 
         elif isinstance(query_or_model, dict):
-            query = cls.select()
-            for key, value in query_or_model.items():
-                query = cls.parse_operator(query, key, value)
+            query = compile_filter(cls, query_or_model).where(cls.select(), query_or_model)
         else:
             query = query_or_model
+        return query
+
+    @classmethod
+    def get_list(cls, query_or_model=None, paging=None, is_object=False, recurse=False, as_rows=False,
+                 prefetch=None):
+        """
+        :param as_rows: 返回只读的轻量行对象（见 rows.py），代替 dict
+        :param prefetch: 关联预取，如 {'user': (User, 'user_id', ['nickname', 'avatar_url'])}，见 prefetch.py
+        """
+        if prefetch:
+            if as_rows:
+                raise Exception('prefetch not support as_rows')
+            result = cls.get_list(query_or_model, paging=paging, is_object=is_object, recurse=recurse)
+            prefetch_related(result[0] if paging else result, prefetch)
+            return result
+
+        if isinstance(query_or_model, dict) and not paging and not is_object:
+            data = cls._select_by_filter(query_or_model, recurse, as_rows)
+            if data is not None:
+                return data
+
+        query = cls.route_read(cls.get_query(query_or_model))
 
         if paging:
+            if 'after' in paging or 'before' in paging:
+                return cls.get_seek_page(query, paging, is_object=is_object, recurse=recurse, as_rows=as_rows)
 
             rows_found = query.count()
 
@@ -143,9 +362,7 @@ class Model(db.Model):
 
             query = query.offset(offset).limit(limit)
 
-            data = []
-            for result in query:
-                data.append(result if is_object else result.to_dict(recurse=recurse))
+            data = cls._fetch(query, is_object, recurse, as_rows)
 
             pagination = {
                 'offset': offset,
@@ -155,19 +372,216 @@ class Model(db.Model):
             return data, pagination
 
         else:
-            data = []
-            for result in query:
-                data.append(result if is_object else result.to_dict(recurse=recurse))
-            return data
+            return cls._fetch(query, is_object, recurse, as_rows)
+
+    @classmethod
+    def _select_by_filter(cls, conditions, recurse=False, as_rows=False):
+        """
+        用条件形状缓存的 SQL 直接查询，模型自定义了 to_dict 等不能使用时返回 None
+        """
+        if getattr(cls.to_dict, '__func__', cls.to_dict) is not _to_dict:
+            return None
+        serializer = get_serializer(cls, recurse=recurse)
+        if serializer is None or serializer.extra_attrs:
+            return None
+        make = row_class(cls, serializer.names)._make if as_rows else None
+        return compile_filter(cls, conditions).select(conditions, serializer, make)
+
+    @classmethod
+    def _fetch(cls, query, is_object=False, recurse=False, as_rows=False):
+        if is_object:
+            return list(query)
+        if as_rows:
+            return to_rows(query, cls)
+        return cls.to_dicts(query, recurse=recurse)
+
+    @classmethod
+    def get_seek_page(cls, query, paging, is_object=False, recurse=False, as_rows=False):
+        """
+        游标（keyset）分页，避免深分页的 OFFSET 扫描和每页一次的 COUNT
+
+        paging 参数:
+            after / before: 上一页返回的游标，首页传 None
+            limit: 每页条数
+            order_by: 同 set_order_by 的排序字符串，不传时使用 query 已有的排序（默认主键），
+                      主键自动追加为最后一个排序列
+            count: True 返回精确总数，'estimate' 返回 EXPLAIN 估算值，默认不统计
+
+        排序列的 NULL 按 MySQL / SQLite 的规则视为最小值
+        """
+        limit = int(paging.get('limit', LIMIT))
+        ordering = _query_ordering(query)
+        if paging.get('order_by'):
+            parsed = cls.parse_order_by(paging['order_by'])
+            if ordering and _ordering_key(ordering) != _ordering_key(parsed):
+                raise Exception('order_by = {} conflicts with the ordering of query'.format(paging['order_by']))
+            ordering = parsed
+        elif not ordering:
+            ordering = cls.parse_order_by(cls._meta.primary_key.name)
+        for field, desc in ordering:
+            if field.model_class is not query.model_class:
+                raise Exception('seek paging not support order by field = {} of {}'.format(
+                    field.name, field.model_class.__name__))
+        pk_name = cls._meta.primary_key.name
+        if not [field for field, desc in ordering if field.name == pk_name]:
+            ordering.append((cls._meta.primary_key, ordering[-1][1] if ordering else False))
+
+        count = paging.get('count')
+        if count == 'estimate':
+            rows_found = cls.estimate_count(query)
+        elif count:
+            rows_found = query.count()
+        else:
+            rows_found = None
+
+        before = paging.get('before')
+        backward = bool(before) and not paging.get('after')
+        cursor = before if backward else paging.get('after')
+        if cursor:
+            values = _decode_cursor(cursor)
+            if len(values) != len(ordering):
+                raise Exception('cursor = {} not match order_by'.format(cursor))
+            query = query.where(_seek_expression(ordering, values, backward))
+
+        order_by_list = []
+        for field, desc in ordering:
+            order_by_list.append(field.asc() if desc == backward else field.desc())
+
+        rows = list(query.order_by(*order_by_list).limit(limit + 1))
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if backward:
+            rows.reverse()
+
+        if is_object:
+            data = rows
+        elif as_rows:
+            data = to_rows(rows, query.model_class)
+        else:
+            data = cls.to_dicts(rows, recurse=recurse)
+
+        has_next = has_more if not backward else bool(cursor)
+        has_prev = has_more if backward else bool(cursor)
+        pagination = {
+            'limit': limit,
+            'after': _encode_cursor(rows[-1], ordering) if rows and has_next else None,
+            'before': _encode_cursor(rows[0], ordering) if rows and has_prev else None,
+            'rows_found': rows_found
+        }
+        return data, pagination
+
+    @classmethod
+    def estimate_count(cls, query):
+        """
+        通过 EXPLAIN 估算行数，数据库不支持时返回 None
+        """
+        sql, params = query.order_by().sql()
+        try:
+            row = cls.execute('EXPLAIN ' + sql, params, one=True)
+        except Exception:
+            return None
+        if row and row.get('rows') is not None:
+            return int(row['rows'])
+        return None
+
+    @classmethod
+    def to_dicts(cls, query, recurse=False):
+        """
+        批量 to_dict，使用预编译的序列化器，模型自定义了 to_dict 时逐行调用
+        """
+        model_class = getattr(query, 'model_class', cls)
+        serializer = None
+        if getattr(model_class.to_dict, '__func__', model_class.to_dict) is _to_dict:
+            serializer = get_serializer(model_class, recurse=recurse)
+        if serializer is None:
+            return [result.to_dict(recurse=recurse) for result in query]
+        return serializer.serialize(query)
+
+    @classmethod
+    def iter_list(cls, query_or_model=None, is_object=False, chunk_size=CHUNK_SIZE):
+        """
+        流式版本的 get_list，使用服务端游标每次 fetchmany(chunk_size)，逐行 yield，
+        dict 的字段和 exclude 与 get_list 相同；联表查询中其他模型与本模型重名的字段被丢弃
+
+        迭代结束前同一连接不能执行其他查询
+        """
+        query = cls.route_read(cls.get_query(query_or_model))
+        model_class = query.model_class
+        serializer = None
+        if getattr(model_class.to_dict, '__func__', model_class.to_dict) is _to_dict:
+            serializer = get_serializer(model_class)
+        columns = serializer.columns(query) if serializer is not None and not is_object else None
+
+        converters = []
+        for item in query._select:
+            converters.append(item.python_value if isinstance(item, Field) else None)
+
+        sql, params = query.sql()
+        names = None
+        for keys, rows in _iter_chunks(query.database, sql, params, chunk_size):
+            if len(converters) == len(keys):
+                rows = [tuple(row[i] if conv is None else conv(row[i]) for i, conv in enumerate(converters))
+                        for row in rows]
+
+            if columns is not None:
+                for item in serializer.iter_tuples(rows, columns):
+                    yield item
+                continue
+
+            # 其他查询构造模型实例，dict 与 to_dict 的字段和 exclude 一致
+            if names is None:
+                names = _instance_names(query, keys)
+            for row in rows:
+                instance = model_class()
+                for name, value in zip(names, row):
+                    if name is not None:
+                        setattr(instance, name, value)
+                instance._prepare_instance()
+                if is_object:
+                    yield instance
+                elif serializer is not None:
+                    yield serializer.from_instance(instance)
+                else:
+                    yield instance.to_dict()
 
     @classmethod
     def execute(cls, sql, statement=None, one=False):
-        cursor = cls.db.execute_sql(sql, statement)
+        cursor = cls._database_for(sql).execute_sql(sql, statement)
         return _format(cursor, one)
 
+    @classmethod
+    def execute_iter(cls, sql, statement=None, chunk_size=CHUNK_SIZE):
+        """
+        流式版本的 execute，逐行 yield dict
+        """
+        for keys, rows in _iter_chunks(cls._database_for(sql), sql, statement, chunk_size):
+            for row in rows:
+                yield dict(zip(keys, row))
+
+    @classmethod
+    def _database_for(cls, sql):
+        if Model.router is not None and sql.lstrip()[:6].upper() == 'SELECT':
+            return Model.router.read_database()
+        return cls.db
+
+    # asyncio 版本的查询和写入，见 aio 模块
+    aget_one = _async('get_one')
+    aget_one_by_query = _async('get_one_by_query')
+    aget_by_id = _async('get_by_id')
+    aget_by_ids = _async('get_by_ids')
+    aget_by_key_values = _async('get_by_key_values')
+    aget_list = _async('get_list')
+    aexecute = _async('execute')
+    aadd = _async('add')
+    aadd_many = _async('add_many')
+
     @classmethod
     def rows_found(cls):
-        row = cls.execute('SELECT FOUND_ROWS() AS rows_found', one=True)
+        """
+        上一条 SQL_CALC_FOUND_ROWS 查询的总行数，在执行该查询的库（同一线程的同一连接）上读取
+        """
+        database = Model.router.last_read_database() if Model.router is not None else cls.db
+        row = _format(database.execute_sql('SELECT FOUND_ROWS() AS rows_found'), one=True)
         if row:
             return row['rows_found']
         return 0
@@ -180,16 +594,25 @@ class Model(db.Model):
         return int(t)
 
     @classmethod
-    def set_order_by(cls, query, order_by):
-        order_by_list = []
+    def parse_order_by(cls, order_by):
+        """
+        解析 'a,-b' 形式的排序字符串，返回 [(field, is_desc), ...]
+        """
+        ordering = []
         for value in order_by.split(','):
+            if not value:
+                continue
             if value[0] == '-':
-                sort = 'desc'
-                value = value[1:]
+                ordering.append((getattr(cls, value[1:]), True))
             else:
-                sort = 'asc'
+                ordering.append((getattr(cls, value), False))
+        return ordering
 
-            order_by_list.append(getattr(getattr(cls, value), sort)())
+    @classmethod
+    def set_order_by(cls, query, order_by):
+        order_by_list = []
+        for field, desc in cls.parse_order_by(order_by):
+            order_by_list.append(field.desc() if desc else field.asc())
 
         if order_by_list:
             query = query.order_by(*order_by_list)
@@ -303,9 +726,9 @@ class Model(db.Model):
 
 
     @classmethod
-    def add(cls, values):
+    def _prepare_add_values(cls, values):
         if hasattr(cls, 'add_fields'):
-            for key, value in values.items():
+            for key in list(values):
                 if key not in cls.add_fields:
                     del values[key]
         if not hasattr(cls, 'timestamps') or cls.timestamps:
@@ -313,12 +736,57 @@ class Model(db.Model):
             values.setdefault('created_at', now)
             values.setdefault('updated_at', now)
         values.setdefault('is_delete', 0)
+        return values
+
+    @classmethod
+    def add(cls, values):
+        values = cls._prepare_add_values(values)
         try:
             return cls.create(**values)
         except IntegrityError as e:
             if e[0] == 1062:
                 return cls.error_duplicate_response(e)
 
+    @classmethod
+    def add_many(cls, rows, batch_size=BATCH_SIZE):
+        """
+        批量添加，每 batch_size 行一条多行 INSERT、一个事务
+
+        rows 可以是生成器，只有当前批次在内存中；返回插入的行数。
+        同一批次中字段不同的行按字段分组，每组一条 INSERT
+        """
+        fields = cls._meta.fields
+        rows = iter(rows)
+        total = 0
+        while True:
+            batch = []
+            groups = OrderedDict()
+            for values in islice(rows, batch_size):
+                values = cls._prepare_add_values(dict(values))
+                values = dict((key, value) for key, value in values.items() if key in fields)
+                batch.append(values)
+                groups.setdefault(tuple(sorted(values)), []).append(values)
+            if not batch:
+                break
+
+            with cls.db.atomic():
+                for group in groups.values():
+                    cls.insert_many(group).execute()
+                if getattr(cls, 'rollup_on_write', False):
+                    cls.rollup_on_write.record(batch)
+            total += len(batch)
+        return total
+
+
+    def save(self, *args, **kwargs):
+        result = super(Model, self).save(*args, **kwargs)
+        self.invalidate(self._get_pk_value())
+        return result
+
+    def delete_instance(self, *args, **kwargs):
+        result = super(Model, self).delete_instance(*args, **kwargs)
+        self.invalidate(self._get_pk_value())
+        return result
 
     def edit_by_id(self, data):
         values = data.copy()
@@ -345,11 +813,67 @@ class Model(db.Model):
 
 
 
-def _format(cursor, one=False):
-    description = cursor.description
+def _keys(cursor):
     keys = []
-    for item in description:
+    for item in cursor.description:
         keys.append(item[0])
+    return keys
+
+
+def _server_side_cursor(database):
+    """
+    MySQL 驱动使用不缓冲结果集的 SSCursor，其他驱动（如 sqlite）本身就是逐行读取
+    """
+    conn = database.get_conn()
+    module = type(conn).__module__.split('.')[0]
+    if module in ('MySQLdb', 'pymysql'):
+        cursors = __import__(module + '.cursors', fromlist=['SSCursor'])
+        return conn.cursor(cursors.SSCursor)
+    return conn.cursor()
+
+
+def _instance_names(query, keys):
+    """
+    结果列对应的实例属性名：本模型字段和别名优先，其他模型的字段与之重名时丢弃（为 None）
+    """
+    if len(query._select) != len(keys):
+        return list(keys)
+    names = []
+    for i, item in enumerate(query._select):
+        if isinstance(item, Field) and not item._alias:
+            names.append(item.name if item.model_class is query.model_class else None)
+        else:
+            names.append(item._alias or keys[i])
+    taken = set(name for name in names if name is not None)
+    for i, item in enumerate(query._select):
+        if names[i] is None and item.name not in taken:
+            names[i] = item.name
+            taken.add(item.name)
+    return names
+
+
+def _iter_chunks(database, sql, params=None, chunk_size=CHUNK_SIZE):
+    start = time.time()
+    count = 0
+    cursor = _server_side_cursor(database)
+    try:
+        with database.exception_wrapper:
+            cursor.execute(sql, params or ())
+        keys = _keys(cursor)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            count += len(rows)
+            yield keys, rows
+    finally:
+        cursor.close()
+        if Model.profiler is not None:
+            Model.profiler.record(sql, params, count, (time.time() - start) * 1000, None, database)
+
+
+def _format(cursor, one=False):
+    keys = _keys(cursor)
     if one:
         row = cursor.fetchone()
         if row:
@@ -362,6 +886,76 @@ def _format(cursor, one=False):
         return result
 
 
+_to_dict = getattr(Model.to_dict, '__func__', Model.to_dict)
+
+
+def _query_ordering(query):
+    """
+    query 已有的 ORDER BY 转为 [(field, is_desc), ...]，只支持字段排序
+    """
+    ordering = []
+    for item in query._order_by or ():
+        if not isinstance(item, Field):
+            raise Exception('seek paging not support order by {!r}'.format(item))
+        ordering.append((item.model_class._meta.fields[item.name], item._ordering == 'DESC'))
+    return ordering
+
+
+def _ordering_key(ordering):
+    return [(field.model_class, field.name, desc) for field, desc in ordering]
+
+
+def _greater(field, value):
+    # NULL 最小：大于 NULL 即非 NULL
+    return field.is_null(False) if value is None else field > value
+
+
+def _less(field, value):
+    if value is None:
+        return None
+    return (field < value) | field.is_null()
+
+
+def _equal(field, value):
+    return field.is_null() if value is None else field == value
+
+
+def _seek_expression(ordering, values, backward=False):
+    """
+    (a, b, id) > (x, y, z) 按各列排序方向展开为 OR 条件，保证能走索引
+    """
+    clauses = []
+    for i, (field, desc) in enumerate(ordering):
+        clause = _greater(field, values[i]) if desc == backward else _less(field, values[i])
+        if clause is None:
+            continue
+        for j in range(i):
+            clause = _equal(ordering[j][0], values[j]) & clause
+        clauses.append(clause)
+    if not clauses:
+        return SQL('1 = 0')
+    return reduce(operator.or_, clauses)
+
+
+def _encode_cursor(row, ordering):
+    values = [row._data.get(field.name) for field, desc in ordering]
+    raw = json.dumps(values, separators=(',', ':'), default=str)
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def _decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode('ascii'))
+        values = json.loads(raw.decode('utf-8'))
+    except (TypeError, ValueError):
+        # 填充错误（Python 2 为 TypeError）、非 ASCII / UTF-8 和 JSON 解析错误
+        values = None
+    if not isinstance(values, list):
+        raise Exception('cursor = {} is invalid'.format(cursor))
+    return values
+
+
 def join_arr(arr):
     return ','.join(['%s'] * len(arr))
 
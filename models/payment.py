@@ -1,7 +1,9 @@
+# coding=utf-8
 import logging
 
 from peewee import *
 from .model import Model
+from .archive import ArchiveMixin
 
 LOGGER = logging.getLogger()
 
@@ -18,15 +20,21 @@ class Payment(Model):
     nick = CharField(default='')
     info = CharField(default='')
 
+    # 写入时维护日汇总，见 rollup.enable_write_through（开启后为 rollup.WriteThrough）
+    rollup_on_write = False
+
     @classmethod
     def add(cls, values):
         values.setdefault('create_time', cls.now())
 
         with cls.db.transaction():
-            return cls.create(**values)
+            payment = cls.create(**values)
+            if cls.rollup_on_write:
+                cls.rollup_on_write.record([values])
+            return payment
 
 
-class AmountDetail(Model):
+class AmountDetail(ArchiveMixin, Model):
     class Meta:
         db_table = 'amount_detail'
     id = PrimaryKeyField()
@@ -38,12 +46,24 @@ class AmountDetail(Model):
     amount_change = IntegerField(default=0)
     tips = CharField(default='')
 
+    rollup_on_write = False
+    archive_time_field = 'date_id'
+    archive_time_format = 'date_id'
+
     @classmethod
     def add(cls, values):
         values.setdefault('create_time', cls.now())
+        values.setdefault('date_id', cls.get_date_id_from_timestamp(values['create_time']))
+
+        # 开启 write_behind 时异步写入，返回 None
+        if cls.write_behind is not None:
+            return cls.write_behind.put(values)
 
         with cls.db.transaction():
-            return cls.create(**values)
+            detail = cls.create(**values)
+            if cls.rollup_on_write:
+                cls.rollup_on_write.record([values])
+            return detail
 
 
 
@@ -0,0 +1,120 @@
+# coding=utf-8
+"""
+连接池和读写分离
+
+    primary = PooledMySQL('app', max_connections=32, stale_timeout=300, timeout=5, ...)
+    replica = PooledMySQL('app', host='replica', max_connections=32, ...)
+    Model.use_replicas(replica)
+
+连接在第一次查询时从池中取出，请求结束时需要调用 db.close() 归还（如挂在 teardown_request 上）
+"""
+from __future__ import absolute_import, division, unicode_literals
+
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+
+from playhouse.pool import MaxConnectionsExceeded, PooledMySQLDatabase, PooledSqliteDatabase
+
+_local = threading.local()
+
+
+class PoolMetricsMixin(object):
+    """
+    记录连接池的取连接次数、等待次数、超时次数和取连接耗时
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._metrics_lock = threading.Lock()
+        self._metrics = {
+            'checkouts': 0,
+            'waits': 0,
+            'timeouts': 0,
+            'checkout_ms': 0.0,
+            'max_checkout_ms': 0.0
+        }
+        super(PoolMetricsMixin, self).__init__(*args, **kwargs)
+
+    def connect(self):
+        start = time.time()
+        waited = bool(self.max_connections) and len(self._in_use) >= self.max_connections
+        try:
+            super(PoolMetricsMixin, self).connect()
+        except MaxConnectionsExceeded:
+            with self._metrics_lock:
+                self._metrics['timeouts'] += 1
+            raise
+        elapsed = (time.time() - start) * 1000
+        with self._metrics_lock:
+            self._metrics['checkouts'] += 1
+            self._metrics['waits'] += 1 if waited else 0
+            self._metrics['checkout_ms'] += elapsed
+            self._metrics['max_checkout_ms'] = max(self._metrics['max_checkout_ms'], elapsed)
+
+    def pool_stats(self):
+        with self._metrics_lock:
+            stats = dict(self._metrics)
+        stats['in_use'] = len(self._in_use)
+        stats['available'] = len(self._connections)
+        stats['max_connections'] = self.max_connections
+        stats['avg_checkout_ms'] = stats['checkout_ms'] / stats['checkouts'] if stats['checkouts'] else 0
+        return stats
+
+
+class PooledMySQL(PoolMetricsMixin, PooledMySQLDatabase):
+    pass
+
+
+class PooledSqlite(PoolMetricsMixin, PooledSqliteDatabase):
+    """
+    本地测试用，池中的连接会在不同线程间复用
+    """
+
+    def __init__(self, database, **kwargs):
+        kwargs.setdefault('check_same_thread', False)
+        super(PooledSqlite, self).__init__(database, **kwargs)
+
+
+@contextmanager
+def use_primary():
+    """
+    with 块内的读查询都走主库，用于写后立即读的场景
+    """
+    _local.pinned = getattr(_local, 'pinned', 0) + 1
+    try:
+        yield
+    finally:
+        _local.pinned -= 1
+
+
+class ReplicaRouter(object):
+    def __init__(self, primary, replicas):
+        self.primary = primary
+        self.replicas = list(replicas)
+        self._counter = itertools.count()
+
+    def read_database(self):
+        """
+        轮询选择从库；事务内或 use_primary 内返回主库
+        """
+        if not self.replicas or getattr(_local, 'pinned', 0) or self.primary.transaction_depth():
+            database = self.primary
+        else:
+            database = self.replicas[next(self._counter) % len(self.replicas)]
+        _local.last_read = database
+        return database
+
+    def last_read_database(self):
+        """
+        当前线程上一次 read_database 选中的库，用于 FOUND_ROWS() 等依赖同一连接的语句
+        """
+        return getattr(_local, 'last_read', None) or self.primary
+
+    def pool_stats(self):
+        stats = {}
+        for name, database in [('primary', self.primary)] + [
+                ('replica_{}'.format(i), replica) for i, replica in enumerate(self.replicas)]:
+            if hasattr(database, 'pool_stats'):
+                stats[name] = database.pool_stats()
+        return stats
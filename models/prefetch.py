@@ -0,0 +1,92 @@
+# coding=utf-8
+"""
+get_list 的关联预取：每个关联一条（分块的）IN 查询，结果合并到输出的 dict 中，避免逐行查询
+
+    LotteryLog.get_list({'period': 100}, prefetch={
+        'user': (User, 'user_id', ['nickname', 'avatar_url']),
+    })
+    User.get_list({'id__in': ids}, prefetch={
+        'bets': Related(LotteryLog, 'id', ['text', 'amount'], remote_key='user_id', many=True),
+    })
+"""
+from __future__ import absolute_import, unicode_literals
+
+CHUNK_SIZE = 1000
+
+
+class Related(object):
+    def __init__(self, model_class, local_key, fields=None, remote_key=None, many=False):
+        """
+        :param local_key: 本表中关联的字段，如 user_id
+        :param fields: 关联表输出的字段，默认同 to_dict
+        :param remote_key: 关联表中匹配的字段，默认主键
+        :param many: 一对多，输出列表
+        """
+        self.model_class = model_class
+        self.local_key = local_key
+        self.remote_key = remote_key or model_class._meta.primary_key.name
+        self.many = many
+
+        if fields is None:
+            exclude = set(field.name for field in getattr(model_class, 'exclude', None) or ())
+            fields = [field.name for field in model_class._meta.sorted_fields if field.name not in exclude]
+        self.fields = list(fields)
+
+    def load(self, keys, chunk_size=CHUNK_SIZE):
+        """
+        {remote_key 的值: dict}，many 时为 {值: [dict]}
+        """
+        model_class = self.model_class
+        remote_field = model_class._meta.fields[self.remote_key]
+        names = self.fields if self.remote_key in self.fields else self.fields + [self.remote_key]
+        select = [model_class._meta.fields[name] for name in names]
+
+        result = {}
+        for i in range(0, len(keys), chunk_size):
+            query = model_class.select(*select).where(remote_field.in_(keys[i:i + chunk_size]))
+            for item in model_class.route_read(query).dicts():
+                key = item[self.remote_key]
+                if self.remote_key not in self.fields:
+                    del item[self.remote_key]
+                if self.many:
+                    result.setdefault(key, []).append(item)
+                else:
+                    result[key] = item
+        return result
+
+
+def _get(row, name):
+    return row.get(name) if isinstance(row, dict) else getattr(row, name)
+
+
+def _set(row, name, value):
+    if isinstance(row, dict):
+        row[name] = value
+    else:
+        setattr(row, name, value)
+
+
+def prefetch(rows, relations, chunk_size=CHUNK_SIZE):
+    """
+    rows 为 dict 或模型实例的列表，relations 为 {输出名: Related 或 (model_class, local_key, fields)}，
+    原地写入关联数据，未找到时为 None（many 时为 []）
+    """
+    for name, related in relations.items():
+        if not isinstance(related, Related):
+            related = Related(*related)
+
+        keys = []
+        seen = set()
+        for row in rows:
+            key = _get(row, related.local_key)
+            if key is not None and key not in seen:
+                seen.add(key)
+                keys.append(key)
+
+        loaded = related.load(keys, chunk_size) if keys else {}
+        for row in rows:
+            value = loaded.get(_get(row, related.local_key))
+            if related.many:
+                value = value or []
+            _set(row, name, value)
+    return rows
@@ -0,0 +1,208 @@
+# coding=utf-8
+"""
+SQL 统计：按指纹记录次数、耗时分布、行数和调用位置，慢查询可附带 EXPLAIN
+
+开启时替换数据库实例的 execute_sql，关闭后恢复，关闭状态没有额外开销
+"""
+from __future__ import absolute_import, division, unicode_literals
+
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import deque
+
+# 耗时分布的桶上界（毫秒）
+BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000)
+
+_RE_STRING = re.compile(r"'(?:[^'\\]|\\.)*'")
+_RE_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_RE_PARAM = re.compile(r'%s|\?')
+_RE_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_RE_VALUES = re.compile(r'(VALUES\s*\(\.\.\.\))(?:\s*,\s*\(\.\.\.\))+', re.I)
+_RE_SPACE = re.compile(r'\s+')
+
+# 查找调用位置时跳过 ORM 自身的帧
+_HERE = os.path.dirname(os.path.abspath(__file__))
+_SKIP_FILES = ('peewee.py', 'playhouse') + tuple(
+    os.path.join(_HERE, name) for name in ('model.py', 'filters.py', 'serializer.py', 'rows.py', 'cache.py', 'profiler.py'))
+
+
+def fingerprint(sql):
+    """
+    去掉字面量和参数个数差异后的 SQL，用于归类
+    """
+    sql = _RE_STRING.sub('?', sql)
+    sql = _RE_NUMBER.sub('?', sql)
+    sql = _RE_PARAM.sub('?', sql)
+    sql = _RE_LIST.sub('(...)', sql)
+    sql = _RE_VALUES.sub(r'\1', sql)
+    return _RE_SPACE.sub(' ', sql).strip()
+
+
+def _call_site():
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if not any(skip in filename for skip in _SKIP_FILES):
+            return '{}:{} {}'.format(filename, frame.f_lineno, frame.f_code.co_name)
+        frame = frame.f_back
+    return None
+
+
+class QueryProfiler(object):
+    def __init__(self, slow_ms=100, explain=False, max_fingerprints=1000, max_slow=100):
+        """
+        :param slow_ms: 超过该耗时的查询记为慢查询
+        :param explain: 慢 SELECT 是否执行 EXPLAIN
+        """
+        self.slow_ms = slow_ms
+        self.explain = explain
+        self.max_fingerprints = max_fingerprints
+        self._originals = []
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._slow = deque(maxlen=max_slow)
+
+    def install(self, database):
+        """
+        统计 database 上的查询，可对主库和各从库分别调用
+        """
+        if any(installed is database for installed, original in self._originals):
+            return self
+        original = database.execute_sql
+
+        def execute_sql(sql, params=None, require_commit=True):
+            start = time.time()
+            cursor = original(sql, params, require_commit)
+            elapsed = (time.time() - start) * 1000
+            self.record(sql, params, cursor.rowcount, elapsed, _call_site(), database)
+            return cursor
+
+        database.execute_sql = execute_sql
+        self._originals.append((database, original))
+        return self
+
+    def uninstall(self):
+        while self._originals:
+            database, original = self._originals.pop()
+            del database.execute_sql
+
+    def record(self, sql, params, rows, elapsed, site, database=None):
+        key = fingerprint(sql)
+        with self._lock:
+            item = self._stats.get(key)
+            if item is None:
+                if len(self._stats) >= self.max_fingerprints:
+                    key = '<other>'
+                    item = self._stats.get(key)
+                if item is None:
+                    item = self._stats[key] = {
+                        'count': 0,
+                        'total_ms': 0.0,
+                        'max_ms': 0.0,
+                        'rows': 0,
+                        'histogram': [0] * (len(BUCKETS) + 1),
+                        'sites': {},
+                        'sample': None
+                    }
+            item['count'] += 1
+            item['total_ms'] += elapsed
+            item['max_ms'] = max(item['max_ms'], elapsed)
+            if rows is not None and rows >= 0:
+                item['rows'] += rows
+            item['histogram'][_bucket(elapsed)] += 1
+            if site:
+                item['sites'][site] = item['sites'].get(site, 0) + 1
+            item['sample'] = {'sql': sql, 'params': _jsonable(params)}
+
+        if elapsed >= self.slow_ms:
+            slow = {
+                'fingerprint': key,
+                'sql': sql,
+                'params': _jsonable(params),
+                'ms': elapsed,
+                'rows': rows,
+                'site': site,
+                'time': time.time()
+            }
+            if self.explain and sql.lstrip()[:6].upper() == 'SELECT':
+                slow['explain'] = self._explain(sql, params, database)
+            with self._lock:
+                self._slow.append(slow)
+
+    def _explain(self, sql, params, database=None):
+        originals = [original for installed, original in self._originals if installed is database]
+        if not originals and self._originals:
+            originals = [self._originals[0][1]]
+        if not originals:
+            return None
+        try:
+            cursor = originals[0]('EXPLAIN ' + sql, params, False)
+            keys = [item[0] for item in cursor.description]
+            return [dict(zip(keys, _jsonable(row))) for row in cursor.fetchall()]
+        except Exception as e:
+            return '{}'.format(e)
+
+    def stats(self):
+        """
+        {指纹: {count, total_ms, avg_ms, max_ms, p50_ms, p99_ms, rows, histogram, sites, sample}}，
+        分位数按桶上界估算
+        """
+        with self._lock:
+            result = {}
+            for key, item in self._stats.items():
+                item = dict(item, histogram=list(item['histogram']), sites=dict(item['sites']))
+                item['avg_ms'] = item['total_ms'] / item['count']
+                item['p50_ms'] = _percentile(item['histogram'], 0.5, item['max_ms'])
+                item['p99_ms'] = _percentile(item['histogram'], 0.99, item['max_ms'])
+                result[key] = item
+            return result
+
+    def slow_queries(self):
+        with self._lock:
+            return list(self._slow)
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self._slow.clear()
+
+    def dump(self):
+        return json.dumps({
+            'buckets_ms': BUCKETS,
+            'queries': self.stats(),
+            'slow': self.slow_queries()
+        }, default='{}'.format, sort_keys=True)
+
+    def dump_json(self, path):
+        with open(path, 'w') as f:
+            f.write(self.dump())
+
+
+def _bucket(elapsed):
+    for i, bound in enumerate(BUCKETS):
+        if elapsed <= bound:
+            return i
+    return len(BUCKETS)
+
+
+def _percentile(histogram, q, max_ms):
+    total = sum(histogram)
+    if not total:
+        return 0
+    seen = 0
+    for i, count in enumerate(histogram):
+        seen += count
+        if seen >= total * q:
+            return BUCKETS[i] if i < len(BUCKETS) else max_ms
+    return max_ms
+
+
+def _jsonable(values):
+    if values is None:
+        return None
+    return [value if isinstance(value, (int, float, bool)) or value is None else '{}'.format(value)
+            for value in values]
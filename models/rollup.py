@@ -0,0 +1,257 @@
+# coding=utf-8
+"""
+按 (date_id, user_id, type) 预聚合的日汇总
+
+两种维护方式，同一数据源只用其中一种:
+    写入时维护: enable_write_through(AmountDetail)，add / add_many 在同一事务内累加
+    增量补算: 定时调用 catch_up(source)，重算新行和最近 overlap 秒内的日期，晚提交的行也会被补上
+"""
+from __future__ import absolute_import, unicode_literals
+
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from peewee import *
+
+from .model import Model, BATCH_SIZE
+from .payment import Payment, AmountDetail
+
+SOURCE_AMOUNT_DETAIL = 1
+SOURCE_PAYMENT = 2
+
+# catch_up 每次额外重算上次补算前 OVERLAP 秒起的日期，覆盖 id 较小但提交较晚的行
+OVERLAP = 3600
+
+# 数据源 -> (模型, 金额字段, 类型字段)
+SOURCES = {
+    SOURCE_AMOUNT_DETAIL: (AmountDetail, 'amount_change', 'type'),
+    SOURCE_PAYMENT: (Payment, 'charge_amount', None),
+}
+
+
+class DailyStat(Model):
+    class Meta:
+        db_table = 'daily_stat'
+        indexes = (
+            (('source', 'date_id', 'user_id', 'type'), True),
+        )
+    id = PrimaryKeyField()
+    source = SmallIntegerField()
+    date_id = IntegerField()
+    user_id = IntegerField()
+    type = IntegerField(default=0)
+    total = BigIntegerField(default=0)
+    count = IntegerField(default=0)
+
+
+class RollupWatermark(Model):
+    class Meta:
+        db_table = 'rollup_watermark'
+    source = SmallIntegerField(primary_key=True)
+    last_id = BigIntegerField(default=0)
+    update_time = IntegerField(default=0)
+
+
+def _source_of(model_class):
+    for source, (source_model, amount_field, type_field) in SOURCES.items():
+        if source_model is model_class:
+            return source
+    raise Exception('model = {} has no rollup source'.format(model_class.__name__))
+
+
+def _date_id(date_id, create_time):
+    return date_id or Model.get_date_id_from_timestamp(create_time)
+
+
+def _timestamp(date_id):
+    return int(time.mktime(datetime.strptime(str(date_id), '%Y%m%d').timetuple()))
+
+
+def _day_range(date_id):
+    day = datetime.strptime(str(date_id), '%Y%m%d')
+    return _timestamp(date_id), _timestamp(int((day + timedelta(days=1)).strftime('%Y%m%d')))
+
+
+class WriteThrough(object):
+    """
+    开启写入时维护后模型的 rollup_on_write，add / add_many 插入后在同一事务内调用 record
+    """
+
+    def __init__(self, source):
+        self.source = source
+
+    def record(self, rows):
+        _record(self.source, rows)
+
+
+def enable_write_through(model_class, enabled=True):
+    """
+    add / add_many 写入时在同一事务内更新汇总
+    """
+    model_class.rollup_on_write = WriteThrough(_source_of(model_class)) if enabled else False
+
+
+def increment(source, aggregates):
+    """
+    aggregates: {(date_id, user_id, type): [total, count]}，累加到汇总表，需在事务内调用
+    """
+    items = sorted(aggregates.items())
+    if isinstance(Model.db, MySQLDatabase):
+        for i in range(0, len(items), BATCH_SIZE):
+            chunk = items[i:i + BATCH_SIZE]
+            params = []
+            for (date_id, user_id, type), (total, count) in chunk:
+                params.extend([source, date_id, user_id, type, total, count])
+            sql = 'INSERT INTO `{}` (`source`, `date_id`, `user_id`, `type`, `total`, `count`) VALUES {} ' \
+                  'ON DUPLICATE KEY UPDATE `total` = `total` + VALUES(`total`), ' \
+                  '`count` = `count` + VALUES(`count`)'.format(
+                      DailyStat._meta.db_table, ','.join(['(%s, %s, %s, %s, %s, %s)'] * len(chunk)))
+            Model.db.execute_sql(sql, params)
+        return
+
+    for (date_id, user_id, type), (total, count) in items:
+        updated = DailyStat.update(total=DailyStat.total + total, count=DailyStat.count + count) \
+            .where(DailyStat.source == source, DailyStat.date_id == date_id,
+                   DailyStat.user_id == user_id, DailyStat.type == type).execute()
+        if not updated:
+            DailyStat.insert(source=source, date_id=date_id, user_id=user_id, type=type,
+                             total=total, count=count).execute()
+
+
+def record_rows(model_class, rows):
+    """
+    写入时维护：rows 为刚插入的字段 dict
+    """
+    _record(_source_of(model_class), rows)
+
+
+def _record(source, rows):
+    model_class, amount_field, type_field = SOURCES[source]
+    aggregates = defaultdict(lambda: [0, 0])
+    for values in rows:
+        key = (_date_id(values.get('date_id'), values['create_time']),
+               values['user_id'],
+               values.get(type_field, 0) if type_field else 0)
+        aggregates[key][0] += values.get(amount_field, 0) or 0
+        aggregates[key][1] += 1
+    increment(source, aggregates)
+
+
+def _select_fields(source):
+    model_class, amount_field, type_field = SOURCES[source]
+    fields = [model_class.id, model_class.user_id, model_class.create_time, getattr(model_class, amount_field)]
+    fields.append(getattr(model_class, type_field) if type_field else SQL('0'))
+    fields.append(model_class.date_id if 'date_id' in model_class._meta.fields else SQL('0'))
+    return fields
+
+
+def catch_up(source, overlap=OVERLAP):
+    """
+    增量补算：重算 watermark 之后的新行所在的日期，以及上次补算前 overlap 秒起的日期，
+    每天在一个事务内先删后写该天的汇总，重复执行结果不变；最后把 watermark 推进到本次的最大 id。
+    提交时间晚于下一次补算 overlap 秒以上的行不会被计入
+
+    :return: 重算的行数
+    """
+    model_class, amount_field, type_field = SOURCES[source]
+    now = Model.now()
+    watermark = RollupWatermark.get_one(RollupWatermark.source == source)
+    last_id = watermark.last_id if watermark else 0
+    max_id = model_class.select(fn.MAX(model_class.id)).scalar() or 0
+
+    start, end = model_class.select(fn.MIN(model_class.create_time), fn.MAX(model_class.create_time)) \
+        .where(model_class.id > last_id, model_class.id <= max_id).tuples().get()
+    if watermark is not None:
+        start = min(start, watermark.update_time - overlap) if start is not None else watermark.update_time - overlap
+    if start is None:
+        return 0
+    end = max(end or now, now)
+
+    processed = 0
+    day = datetime.strptime(str(Model.get_date_id_from_timestamp(start)), '%Y%m%d')
+    last_day = datetime.strptime(str(Model.get_date_id_from_timestamp(end)), '%Y%m%d')
+    while day <= last_day:
+        date_id = int(day.strftime('%Y%m%d'))
+        processed += _rebuild_day(source, date_id, max_id)
+        day += timedelta(days=1)
+
+    with Model.db.atomic():
+        if watermark is None:
+            RollupWatermark.insert(source=source, last_id=max_id, update_time=now).execute()
+        else:
+            RollupWatermark.update(last_id=max_id, update_time=now) \
+                .where(RollupWatermark.source == source).execute()
+    return processed
+
+
+def _rebuild_day(source, date_id, max_id):
+    """
+    按原始表中 id <= max_id 的行重写一天的汇总，返回行数
+    """
+    model_class, amount_field, type_field = SOURCES[source]
+    day_start, day_end = _day_range(date_id)
+    group_by = [model_class.user_id]
+    if type_field:
+        group_by.append(getattr(model_class, type_field))
+    query = model_class.select(*(group_by + [fn.SUM(getattr(model_class, amount_field)), fn.COUNT(model_class.id)])) \
+        .where(model_class.create_time >= day_start, model_class.create_time < day_end, model_class.id <= max_id) \
+        .group_by(*group_by)
+
+    aggregates = {}
+    for row in query.tuples():
+        user_id, type = row[0], (row[1] if type_field else 0)
+        aggregates[(date_id, user_id, type)] = [int(row[-2] or 0), int(row[-1])]
+
+    with Model.db.atomic():
+        DailyStat.delete().where(DailyStat.source == source, DailyStat.date_id == date_id).execute()
+        increment(source, aggregates)
+    return sum(count for total, count in aggregates.values())
+
+
+def daily_totals(source, start_date_id, end_date_id, user_id=None, type=None):
+    """
+    [start_date_id, end_date_id] 内每天的 {'total', 'count'}，
+    已汇总的部分读汇总表，只有 watermark 之后（上次补算以来，通常是今天）的行扫描原始表
+    """
+    model_class, amount_field, type_field = SOURCES[source]
+    result = defaultdict(lambda: {'total': 0, 'count': 0})
+
+    query = DailyStat.select(DailyStat.date_id, fn.SUM(DailyStat.total), fn.SUM(DailyStat.count)) \
+        .where(DailyStat.source == source, DailyStat.date_id >= start_date_id, DailyStat.date_id <= end_date_id)
+    if user_id is not None:
+        query = query.where(DailyStat.user_id == user_id)
+    if type is not None:
+        query = query.where(DailyStat.type == type)
+    for date_id, total, count in query.group_by(DailyStat.date_id).tuples():
+        result[date_id]['total'] += int(total or 0)
+        result[date_id]['count'] += int(count or 0)
+
+    if getattr(model_class, 'rollup_on_write', False):
+        return dict(result)
+
+    watermark = RollupWatermark.get_one(RollupWatermark.source == source)
+    query = model_class.select(*_select_fields(source)).where(
+        model_class.id > (watermark.last_id if watermark else 0),
+        model_class.create_time >= _timestamp(start_date_id),
+        model_class.create_time < _timestamp(end_date_id) + 86400)
+    if user_id is not None:
+        query = query.where(model_class.user_id == user_id)
+    if type is not None and type_field:
+        query = query.where(getattr(model_class, type_field) == type)
+    for row_id, row_user_id, create_time, amount, row_type, date_id in query.tuples():
+        date_id = _date_id(date_id, create_time)
+        result[date_id]['total'] += amount or 0
+        result[date_id]['count'] += 1
+    return dict(result)
+
+
+def range_total(source, start_date_id, end_date_id, user_id=None, type=None):
+    """
+    [start_date_id, end_date_id] 内的合计 {'total', 'count'}
+    """
+    total = {'total': 0, 'count': 0}
+    for item in daily_totals(source, start_date_id, end_date_id, user_id=user_id, type=type).values():
+        total['total'] += item['total']
+        total['count'] += item['count']
+    return total
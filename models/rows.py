@@ -0,0 +1,93 @@
+# coding=utf-8
+"""
+只读查询结果的轻量行对象
+
+按 (模型, 输出列) 生成一次 namedtuple 子类，直接由游标元组构造，没有 _data 和脏字段跟踪，
+支持 row.nickname、row['nickname'] 和 row.as_dict()。输出列同 to_dict，会去掉模型的 exclude 字段
+"""
+from __future__ import absolute_import, unicode_literals
+
+from collections import namedtuple
+
+import peewee
+
+_row_classes = {}
+
+
+class RowMixin(object):
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, slice)):
+            return tuple.__getitem__(self, key)
+        return tuple.__getitem__(self, self._index[key])
+
+    def get(self, key, default=None):
+        index = self._index.get(key)
+        return default if index is None else tuple.__getitem__(self, index)
+
+    def keys(self):
+        return list(self._fields)
+
+    def as_dict(self):
+        return dict(zip(self._fields, self))
+
+    def __repr__(self):
+        return '{}({})'.format(type(self).__name__, ', '.join(
+            '{}={!r}'.format(name, value) for name, value in zip(self._fields, self)))
+
+
+def row_class(model_class, names):
+    """
+    取缓存的行类型
+    """
+    key = (model_class, tuple(names))
+    klass = _row_classes.get(key)
+    if klass is None:
+        name = str('{}Row'.format(model_class.__name__))
+        base = namedtuple(name, [str(item) for item in names])
+        klass = _row_classes[key] = type(name, (RowMixin, base), {
+            '__slots__': (),
+            '_index': dict((item, i) for i, item in enumerate(names))
+        })
+    return klass
+
+
+def _plan(query):
+    """
+    query 只查询了本模型的字段时，返回 (输出列名, 在结果元组中的下标)，否则返回 None
+    """
+    if not isinstance(query, peewee.SelectQuery) or any(query._joins.values()):
+        return None
+
+    model_class = query.model_class
+    exclude = set(field.name for field in getattr(model_class, 'exclude', None) or ())
+    names, columns = [], []
+    for i, item in enumerate(query._select):
+        if not isinstance(item, peewee.Field) or item.model_class is not model_class:
+            return None
+        if item.name in exclude:
+            continue
+        names.append(item._alias or item.name)
+        columns.append(i)
+    return names, columns
+
+
+def to_rows(query, model_class=None):
+    """
+    查询结果转为行对象列表；query 也可以是模型实例的列表，此时需要传 model_class
+    """
+    model_class = getattr(query, 'model_class', model_class)
+    plan = _plan(query)
+    if plan is not None:
+        names, columns = plan
+        klass = row_class(model_class, names)
+        make = klass._make
+        if columns == list(range(len(query._select))):
+            return [make(row) for row in query.tuples()]
+        return [make([row[i] for i in columns]) for row in query.tuples()]
+
+    exclude = set(field.name for field in getattr(model_class, 'exclude', None) or ())
+    names = [field.name for field in model_class._meta.sorted_fields if field.name not in exclude]
+    make = row_class(model_class, names)._make
+    return [make([instance._data.get(name) for name in names]) for instance in query]
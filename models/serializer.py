@@ -0,0 +1,88 @@
+# coding=utf-8
+"""
+按 (模型, only, exclude, extra_attrs, recurse) 预编译并缓存的序列化器，
+输出与 Model.to_dict 一致
+"""
+from __future__ import absolute_import, unicode_literals
+
+import peewee
+
+_serializers = {}
+
+
+class Serializer(object):
+    def __init__(self, model_class, only=None, exclude=None, extra_attrs=None):
+        self.model_class = model_class
+        only = set(only or ())
+        exclude = set(exclude or ())
+        default_exclude = getattr(model_class, 'exclude', None)
+        if default_exclude is not None:
+            exclude.update(default_exclude)
+
+        self.fields = [field for field in model_class._meta.sorted_fields
+                       if field not in exclude and (not only or field in only)]
+        self.names = [field.name for field in self.fields]
+        self.extra_attrs = tuple(extra_attrs or ())
+
+    def from_instance(self, instance):
+        data = instance._data
+        result = dict((name, data.get(name)) for name in self.names)
+        for attr_name in self.extra_attrs:
+            attr = getattr(instance, attr_name)
+            result[attr_name] = attr() if callable(attr) else attr
+        return result
+
+    def columns(self, query):
+        """
+        query 只查询了本模型的字段且包含全部输出字段时，返回输出字段在结果元组中的下标，否则返回 None
+        """
+        if self.extra_attrs or not isinstance(query, peewee.SelectQuery):
+            return None
+        if query.model_class is not self.model_class or any(query._joins.values()):
+            return None
+
+        positions = {}
+        for i, item in enumerate(query._select):
+            if not isinstance(item, peewee.Field) or item.model_class is not self.model_class or item._alias:
+                return None
+            positions[item.name] = i
+
+        if not all(name in positions for name in self.names):
+            return None
+        return [positions[name] for name in self.names]
+
+    def iter_tuples(self, rows, columns):
+        names = self.names
+        if columns == list(range(len(columns))):
+            for row in rows:
+                yield dict(zip(names, row))
+        else:
+            for row in rows:
+                yield dict(zip(names, [row[i] for i in columns]))
+
+    def serialize(self, query):
+        """
+        序列化查询结果，能直接用结果元组时跳过模型实例的构造
+        """
+        columns = self.columns(query)
+        if columns is not None:
+            return list(self.iter_tuples(query.tuples(), columns))
+        return [self.from_instance(instance) for instance in query]
+
+
+def get_serializer(model_class, only=None, exclude=None, extra_attrs=None, recurse=False):
+    """
+    取缓存的序列化器；recurse 且模型有外键时无法预编译，返回 None
+    """
+    if recurse and model_class._meta.rel:
+        return None
+
+    key = (model_class,
+           frozenset(only or ()),
+           frozenset(exclude or ()),
+           tuple(extra_attrs or ()))
+    serializer = _serializers.get(key)
+    if serializer is None:
+        serializer = _serializers[key] = Serializer(model_class, only=only, exclude=exclude,
+                                                    extra_attrs=extra_attrs)
+    return serializer
@@ -0,0 +1,232 @@
+# coding=utf-8
+"""
+按期结算：一次扫描算出中奖，按用户聚合后用少量集合语句写回
+
+    settlement.configure({'大': '1.98', '小': '1.98'}, sum_odds={13: '13.5', 14: '13.5'})
+    settle_period(lottery_num_id)
+
+赔率必须由调用方按线上玩法显式配置；是否中奖按 LotteryNum.result（玩法）和 num_add（和值）判断。
+一期的下注不少于 KERNEL_MIN_BETS 且安装了 numpy 时用 bet_kernel 批量计算，否则逐行计算（按文本缓存赔率）
+"""
+from __future__ import absolute_import, division, unicode_literals
+
+import logging
+import re
+import time
+from collections import defaultdict
+from decimal import Decimal
+
+from playhouse.shortcuts import case
+
+from .lottery_num import LotteryNum, LotteryLog
+from .model import Model, BATCH_SIZE
+from .payment import AmountDetail
+from .user import User
+
+LOGGER = logging.getLogger()
+
+# AmountDetail.type: 派奖
+PAYOUT_TYPE = 2
+
+SUM = '和值'
+
+KERNEL_MIN_BETS = 10000
+
+_RE_SEPARATOR = re.compile(r'[\s,，|/+=]+')
+
+
+def result_outcomes(lottery_num):
+    """
+    默认的开奖结果解析：result 按分隔符拆分，每一项为一个中奖的下注内容
+
+    '14,大,双,大双' -> {'14', '大', '双', '大双'}
+    """
+    return frozenset(item for item in _RE_SEPARATOR.split(lottery_num.result or '') if item)
+
+
+def _milli(value):
+    """
+    赔率 -> 千分之一为单位的整数，精度超过 0.001 或不大于 0 时报错
+    """
+    milli = Decimal('%s' % value) * 1000
+    if milli <= 0 or milli != milli.to_integral_value():
+        raise Exception('odds = {!r} must be positive with at most 3 decimals'.format(value))
+    return int(milli)
+
+
+class PayoutRules(object):
+    """
+    派奖规则，由调用方按线上玩法配置，模块内不内置任何赔率
+
+    odds: {下注内容: 赔率}，开奖结果 (outcomes) 包含该内容时中奖
+    sum_odds: {和值: 赔率}，下注内容为数字时按 LotteryNum.num_add 判断
+    outcomes: lottery_num -> 中奖的下注内容集合，默认为 result_outcomes
+    赔率保存为千分之一的整数，派奖 = amount * 赔率 // 1000，不经过浮点数
+    """
+
+    def __init__(self, odds, sum_odds=None, outcomes=result_outcomes):
+        self.odds = dict(('%s' % text, _milli(value)) for text, value in odds.items())
+        self.sum_odds = dict((int(total), _milli(value)) for total, value in (sum_odds or {}).items())
+        self.outcomes = outcomes
+
+    def parse(self, text):
+        """
+        解析下注内容，返回 (玩法, 参数)，无法识别时返回 None
+
+        '13' -> ('和值', 13), '大单' -> ('大单', 0)
+        """
+        if text is None:
+            return None
+        text = ('%s' % text).strip()
+        if text in self.odds:
+            return text, 0
+        if text.isdigit() and int(text) in self.sum_odds:
+            return SUM, int(text)
+        return None
+
+    def draw(self, lottery_num):
+        """
+        开奖记录 -> (和值, 中奖的下注内容集合)
+        """
+        return lottery_num.num_add, frozenset(self.outcomes(lottery_num))
+
+    def odds_of(self, bet, draw):
+        """
+        bet 为 parse 的结果，draw 为 self.draw 的结果，中奖返回赔率（千分之一），否则返回 0
+        """
+        if bet is None:
+            return 0
+        kind, value = bet
+        if kind == SUM:
+            return self.sum_odds[value] if draw[0] == value else 0
+        return self.odds[kind] if kind in draw[1] else 0
+
+    def payout_of(self, text, amount, draw):
+        """
+        单注派奖金额，逐行计算的参考实现
+        """
+        return amount * self.odds_of(self.parse(text), draw) // 1000
+
+
+_rules = None
+
+
+def configure(odds, sum_odds=None, outcomes=result_outcomes):
+    """
+    设置进程内默认的派奖规则，参数同 PayoutRules，返回 PayoutRules
+    """
+    global _rules
+    _rules = PayoutRules(odds, sum_odds, outcomes)
+    return _rules
+
+
+def get_rules(rules=None):
+    if rules is not None:
+        return rules
+    if _rules is None:
+        raise Exception('payout rules not configured, call settlement.configure first')
+    return _rules
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def apply_payouts(payouts, tips='', type=PAYOUT_TYPE, batch_size=BATCH_SIZE):
+    """
+    payouts: {user_id: amount}，批量加余额并写入 AmountDetail，需在事务内调用
+    """
+    user_ids = sorted(payouts)
+    now = Model.now()
+    date_id = Model.get_date_id_from_timestamp(now)
+    for chunk in _chunks(user_ids, batch_size):
+        User.update({User.balance: User.balance + case(User.id, [(user_id, payouts[user_id]) for user_id in chunk], 0)}) \
+            .where(User.id.in_(chunk)).execute()
+        User.invalidate(*chunk)
+
+        balances = dict(User.select(User.id, User.balance).where(User.id.in_(chunk)).tuples())
+        AmountDetail.add_many(({
+            'user_id': user_id,
+            'create_time': now,
+            'amount': balances.get(user_id, 0),
+            'amount_change': payouts[user_id],
+            'type': type,
+            'date_id': date_id,
+            'tips': tips
+        } for user_id in chunk), batch_size=batch_size)
+
+
+def _loop_payouts(user_ids, texts, amounts, rules, draw):
+    payouts = defaultdict(int)
+    winning_bets = 0
+    odds_cache = {}
+    for user_id, text, amount in zip(user_ids, texts, amounts):
+        odds = odds_cache.get(text)
+        if odds is None:
+            odds = odds_cache[text] = rules.odds_of(rules.parse(text), draw)
+        if odds:
+            winning_bets += 1
+            payouts[user_id] += amount * odds // 1000
+    return dict((user_id, amount) for user_id, amount in payouts.items() if amount), winning_bets
+
+
+def _payouts(user_ids, texts, amounts, rules, draw, kernel_min_bets):
+    """
+    返回 ({user_id: 派奖金额}, 中奖注数, 计算方式)
+    """
+    if kernel_min_bets is not None and len(texts) >= kernel_min_bets:
+        # bet_kernel 依赖本模块，用到时才导入
+        from . import bet_kernel
+        if bet_kernel.np is not None:
+            payouts, winning_bets = bet_kernel.settle_rows(user_ids, texts, amounts, rules, draw)
+            return payouts, winning_bets, 'numpy'
+    payouts, winning_bets = _loop_payouts(user_ids, texts, amounts, rules, draw)
+    return payouts, winning_bets, 'python'
+
+
+def settle_period(lottery_num_id, rules=None, batch_size=BATCH_SIZE, kernel_min_bets=KERNEL_MIN_BETS):
+    """
+    结算一期：未结算 (is_checked=0) 的下注在同一个事务内派奖并标记为已结算，
+    重复调用不会重复派奖。rules 为 PayoutRules，默认用 configure 设置的规则
+
+    :param kernel_min_bets: 下注数不少于它时用 bet_kernel 计算，为 None 时总是逐行计算
+    :return: 结算报告，包含 bets_per_sec 和计算方式 evaluator
+    """
+    start = time.time()
+    rules = get_rules(rules)
+
+    with Model.db.atomic():
+        # 在事务内读取开奖记录，走主库，刚写入的一期在从库延迟时也能读到
+        lottery_num = LotteryNum.get_one(LotteryNum.id == lottery_num_id)
+        if lottery_num is None:
+            raise Exception('lottery_num id = {} not exist'.format(lottery_num_id))
+        draw = rules.draw(lottery_num)
+
+        query = LotteryLog.select(LotteryLog.id, LotteryLog.user_id, LotteryLog.text, LotteryLog.amount) \
+            .where(LotteryLog.period == lottery_num_id, LotteryLog.is_checked == 0) \
+            .for_update(Model.db.for_update) \
+            .tuples()
+        rows = list(query)
+        log_ids, user_ids, texts, amounts = [list(column) for column in zip(*rows)] if rows else ([], [], [], [])
+        payouts, winning_bets, evaluator = _payouts(user_ids, texts, amounts, rules, draw, kernel_min_bets)
+
+        if payouts:
+            apply_payouts(payouts, tips='第{}期派奖'.format(lottery_num_id), batch_size=batch_size)
+
+        for chunk in _chunks(log_ids, batch_size):
+            LotteryLog.update(is_checked=1).where(LotteryLog.id.in_(chunk)).execute()
+
+    elapsed = time.time() - start
+    report = {
+        'period': lottery_num_id,
+        'bets': len(log_ids),
+        'winning_bets': winning_bets,
+        'winners': len(payouts),
+        'payout': sum(payouts.values()),
+        'evaluator': evaluator,
+        'elapsed': elapsed,
+        'bets_per_sec': len(log_ids) / elapsed if elapsed else 0
+    }
+    LOGGER.info('settle period %s: %s', lottery_num_id, report)
+    return report
@@ -1,63 +1,33 @@
 # -*- coding: utf-8 -*-
-from functools import wraps
-from peewee import *
-from flask import request, g
-from itsdangerous import URLSafeTimedSerializer
-import time
+import sys
 from logging import getLogger
 
+from peewee import *
 
-from config import SECRET_KEY, TOKEN_SALT
-from extensions import db
-from utils.func import random_ascii_string
-from .. import meta
+from .cache import LRUCache
 from .model import Model
-from .user import User
 
 LOGGER = getLogger()
 
+# 已校验 token 的进程内缓存: access_token -> token 数据，用户数据走 User 的缓存（见 auth.enable_user_cache）
+TOKEN_CACHE = LRUCache(maxsize=10000, ttl=60)
 
-def auth_header(f):
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        access_token = request.args.get('access_token')
-        if access_token:
-            g.headers['Authorization'] = "Bearer {}".format(access_token)
-        return f(*args, **kwargs)
-
-    return decorated_function
-
-
-def auth_required(f):
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        authorization = Authorization().get_authorization()
-        print authorization.is_valid, 'dd'
-        if not authorization.is_valid:
-            raise meta.UNAUTHORIZED
-
-        g.auth = authorization
-
-        return f(*args, **kwargs)
+# Token.issue 依赖的唯一索引，已有的库需先执行 Token.migrate_unique_index
+UNIQUE_FIELDS = ('user_id', 'client_id', 'grant_type')
 
-    return decorated_function
 
-
-def admin_required(f):
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        authorization = Authorization().get_authorization()
-        if not authorization.is_valid:
-            raise meta.UNAUTHORIZED
-
-        g.auth = authorization
-
-        return f(*args, **kwargs)
-
-    return decorated_function
+def token_cache_stats():
+    return TOKEN_CACHE.stats()
 
 
 class Token(Model):
+    class Meta:
+        indexes = (
+            (('user_id', 'client_id', 'grant_type'), True),
+            (('client_id',), False),
+            (('create_time',), False),
+        )
+
     id = PrimaryKeyField()
     grant_type = CharField(choices=['PASSWORD'])
     access_token = CharField(max_length=128, unique=True)
@@ -67,101 +37,111 @@ class Token(Model):
     user_id = IntegerField(default=0)
     create_time = IntegerField(default=0)
 
-
-class Authorization(dict):
-    def __init__(self, *args, **kwargs):
-        super(Authorization, self).__init__(*args, **kwargs)
-        self.is_valid = False
-        self.token_length = 40
-        self.token_serializer = URLSafeTimedSerializer(SECRET_KEY, salt=TOKEN_SALT)
-        self.user = None
-
-    def gen_token(self, grant_type, client_id, user_id):
-
-        token_type = 'Bearer'
-
-        token = Token.get_one(Token.grant_type == grant_type, Token.user_id == user_id,
-                              Token.client_id == client_id)
-
-        if token:
-            return {
-                'access_token': token.access_token,
-                'token_type': token_type,
-                'expires_in': token.expires_in,
-                'refresh_token': token.refresh_token,
-            }
-
-        time_now = int(time.time())
-
-        # 永不过期
-        expires_in = 0
-        refresh_token = random_ascii_string(self.token_length)
-        access_token = self.token_serializer.dumps((grant_type, client_id, user_id, time_now, expires_in))
-
-        values = {
-            'grant_type': grant_type,
-            'access_token': access_token,
-            'expires_in': expires_in,
-            'refresh_token': refresh_token,
-            'client_id': client_id,
-            'user_id': user_id,
-            'create_time': time_now
-        }
-
-        # 保存token信息
-        try:
-            with db.database.atomic():
-                # Token.delete().
-                # where((getattr(Token, self.foreign_key) == user_id) & (Token.grant_type == grant_type)).execute()
-                Token.create(**values)
-        except IntegrityError as e:
-            if e[0] == 1062:
-                raise meta.LOGIN_TOO_OFTEN
-            raise e
-        return {
-            'access_token': access_token,
-            'token_type': token_type,
-            'expires_in': expires_in,
-            'refresh_token': refresh_token,
-        }
-
-    def get_token(self, access_token):
-        token = Token.get_one_by_query(
-            Token.select(Token, User).join(User, on=(Token.user_id == User.id).alias('user')).where(
-                Token.access_token == access_token))
-        if token:
-            self.update(token.to_dict(recurse=False))
-            self.user = token.user
-        return token
-
-    def destroy(self):
-        return Token.delete().where(Token.access_token == self['access_token']).execute()
-
-    # @cache_it(expire=60)
-    def get_authorization(self):
-        if 'Authorization' in request.headers:
-            header = request.headers.get('Authorization')
-        elif request.args.get('access_token'):
-            header = "Bearer {}".format(request.args.get('access_token'))
+    @classmethod
+    def issue(cls, values):
+        """
+        插入 token，(user_id, client_id, grant_type) 已有 token 时返回已有的，返回 (token, created)
+
+        MySQL 用 ON DUPLICATE KEY UPDATE id = LAST_INSERT_ID(id)，新建只需一条语句，
+        已存在时按 LAST_INSERT_ID 取回（连接不能开启 CLIENT.FOUND_ROWS）；SQLite 用 INSERT OR IGNORE。
+        没有 (user_id, client_id, grant_type) 唯一索引时会插入重复的 token，上线前先执行 migrate_unique_index
+        """
+        database = cls._meta.database
+        sql, params = cls.insert(**values).sql()
+        if isinstance(database, MySQLDatabase):
+            cursor = database.execute_sql(sql + ' ON DUPLICATE KEY UPDATE `id` = LAST_INSERT_ID(`id`)', params)
+            if cursor.rowcount == 1:
+                return cls(id=cursor.lastrowid, **values), True
+            return cls.select().where(cls.id == cursor.lastrowid).get(), False
+
+        if isinstance(database, SqliteDatabase):
+            cursor = database.execute_sql(sql.replace('INSERT INTO', 'INSERT OR IGNORE INTO', 1), params)
         else:
-            header = g.headers.get('Authorization')
-
-        if header and header.split:
-            header = header.split()
-            print 'header', header
-
-            if len(header) > 1 and header[0] == 'Bearer':
-                print header[1], 'h'
-                # try:
-                row = self.token_serializer.loads(header[1])
-                print row, 'row'
-                grant_type, client_id, foreign_key_id, create_time, expires_in = row
-
-                # 过期时间为0为不过期
-                if expires_in == 0 or (create_time + expires_in) > time.time():
-                    if self.get_token(header[1]):
-                        self.is_valid = True
-                # except Exception as e:
-                #     LOGGER.debug(e)
-
-        return self
+            try:
+                with database.atomic():
+                    cursor = database.execute_sql(sql, params)
+            except IntegrityError:
+                cursor = None
+        if cursor is not None and cursor.rowcount == 1:
+            return cls(id=cursor.lastrowid, **values), True
+        return cls.select().where(cls.user_id == values['user_id'], cls.client_id == values['client_id'],
+                                  cls.grant_type == values['grant_type']).get(), False
+
+    @classmethod
+    def has_unique_index(cls):
+        columns = sorted(cls._meta.fields[name].db_column for name in UNIQUE_FIELDS)
+        return any(index.unique and sorted(index.columns) == columns
+                   for index in cls._meta.database.get_indexes(cls._meta.db_table))
+
+    @classmethod
+    def migrate_unique_index(cls):
+        """
+        给已有的 token 表加上 (user_id, client_id, grant_type) 唯一索引：
+        重复的组合只保留 id 最大（最近登录）的一条，删除的 token 同时移出本进程的 TOKEN_CACHE。
+        索引已存在时不做任何事；清理后仍有并发插入的重复行时建索引失败，重新执行即可
+
+        :return: 删除的重复行数
+        """
+        if cls.has_unique_index():
+            return 0
+        group = [getattr(cls, name) for name in UNIQUE_FIELDS]
+        duplicates = cls.select(fn.MAX(cls.id), *group).group_by(*group).having(fn.COUNT(cls.id) > 1).tuples()
+
+        deleted = []
+        with cls._meta.database.atomic():
+            for row in list(duplicates):
+                conditions = [field == value for field, value in zip(group, row[1:])] + [cls.id < row[0]]
+                deleted.extend(cls.select(cls.id, cls.access_token).where(*conditions).tuples())
+            for start in range(0, len(deleted), 1000):
+                cls.delete().where(cls.id << [row[0] for row in deleted[start:start + 1000]]).execute()
+        for _, access_token in deleted:
+            TOKEN_CACHE.delete(access_token)
+
+        cls._meta.database.create_index(cls, list(UNIQUE_FIELDS), unique=True)
+        return len(deleted)
+
+    @classmethod
+    def revoke(cls, user_id=None, client_id=None, before=None):
+        """
+        批量吊销：按用户、客户端或 create_time 早于 before 的 token，条件同时给出时取交集；
+        同时清理本进程的 TOKEN_CACHE，其他进程的缓存最多 TOKEN_CACHE.ttl 秒后失效
+
+        :return: 删除的行数
+        """
+        conditions = []
+        if user_id is not None:
+            conditions.append(cls.user_id == user_id)
+        if client_id is not None:
+            conditions.append(cls.client_id == client_id)
+        if before is not None:
+            conditions.append(cls.create_time < before)
+        if not conditions:
+            raise Exception('revoke requires user_id, client_id or before')
+
+        count = cls.delete().where(*conditions).execute()
+
+        def match(access_token, data):
+            return (user_id is None or data['user_id'] == user_id) and \
+                   (client_id is None or data['client_id'] == client_id) and \
+                   (before is None or data['create_time'] < before)
+
+        TOKEN_CACHE.delete_where(match)
+        return count
+
+
+# 兼容旧的导入路径 from .token import Authorization，web 相关部分已移到 auth.py
+_AUTH_NAMES = ('Authorization', 'auth_required', 'auth_header', 'admin_required', 'get_token_serializer',
+               'enable_user_cache')
+
+
+def __getattr__(name):
+    if name in _AUTH_NAMES:
+        from . import auth
+        return getattr(auth, name)
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+
+
+if sys.version_info < (3, 7):
+    # 不支持模块级 __getattr__，换成带 __getattr__ 的模块对象，auth.py 仍在第一次访问时才导入
+    from . import _lazy_module
+    _lazy_module(__name__, __getattr__, _AUTH_NAMES)
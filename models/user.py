@@ -1,13 +1,13 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
-from werkzeug.security import generate_password_hash, check_password_hash
 from peewee import *
 import logging
 
 from .. import meta
 
-from .model import Model
+from . import hashing
+from .model import Model, BATCH_SIZE
 
 LOGGER = logging.getLogger()
 
@@ -26,21 +26,29 @@ class User(Model):
     exclude = [password]
 
     def check_password(self, password):
-        if password:
-            return check_password_hash(self.password, password)
+        """
+        校验通过且哈希参数已变更时，按新参数重新计算并保存
+        """
+        hasher = hashing.get_hasher()
+        if not hasher.verify(self.password, password):
+            return False
 
-        return False
+        pwhash = hasher.rehash(self.password, password)
+        if pwhash:
+            self.password = pwhash
+            self.save(only=[User.password])
+        return True
 
     def set_password(self, password):
         if len(str(password)) >= 6:
-            self.password = generate_password_hash(password)
+            self.password = hashing.get_hasher().hash(password)
             self.save()
             return True
         return False
 
     def modify(self, values):
         if values.get('password'):
-            values['password'] = generate_password_hash(values['password'])
+            values['password'] = hashing.get_hasher().hash(values['password'])
 
         return super(User, self).modify(values)
 
@@ -63,7 +71,7 @@ class User(Model):
         try:
             values.setdefault('enabled', True)
             values.setdefault('create_time', cls.now())
-            values['password'] = generate_password_hash(values['password'])
+            values['password'] = hashing.get_hasher().hash(values['password'])
 
             with cls.db.transaction():
 
@@ -74,6 +82,25 @@ class User(Model):
 
             raise e
 
+    @classmethod
+    def import_users(cls, rows, batch_size=BATCH_SIZE):
+        """
+        批量导入帐号，rows 为 dict 列表（password 为明文），密码在线程池中并行哈希
+
+        :return: 插入的行数
+        """
+        now = cls.now()
+        hasher = hashing.get_hasher()
+        total = 0
+        for start in range(0, len(rows), batch_size):
+            batch = [dict(row) for row in rows[start:start + batch_size]]
+            for row, pwhash in zip(batch, hasher.hash_many([row['password'] for row in batch])):
+                row['password'] = pwhash
+                row.setdefault('enabled', True)
+                row.setdefault('create_time', now)
+            total += cls.add_many(batch, batch_size=batch_size)
+        return total
+
     @classmethod
     def get_user_infos_by_ids(cls, ids):
         if not ids:
@@ -87,8 +114,11 @@ class User(Model):
     @classmethod
     def update_amount(cls, user_id, amount, adding=False):
         if adding:
-            return cls.update({User.balance: User.balance + amount}).where(cls.id == user_id).execute()
-        return cls.update({User.balance: User.balance - amount}).where(cls.id == user_id).execute()
+            result = cls.update({User.balance: User.balance + amount}).where(cls.id == user_id).execute()
+        else:
+            result = cls.update({User.balance: User.balance - amount}).where(cls.id == user_id).execute()
+        cls.invalidate(user_id)
+        return result
 
 
 
@@ -0,0 +1,296 @@
+# coding=utf-8
+"""
+写缓冲（write-behind）：写入先进有界队列，后台线程每 interval_ms 毫秒或攒够 max_rows 行用 add_many 批量插入
+
+    LotteryLog.enable_write_behind(max_rows=500, interval_ms=50, spool_path='/data/spool/lottery_log.jsonl')
+
+- 队列满时调用方等待 put_timeout 秒，仍满则在调用线程直接写库
+- 写库失败时整批追加到本地 spool 文件（每行一批，带批次 id，fsync），之后写库成功时逐行读出重放；
+  每批的行和它的批次 id（write_behind_batch 表）在同一事务中写入，重放中途崩溃后再次重放时跳过已写入的批次
+- 进程退出时（atexit）把队列写完
+开启后 create_record / add 不再返回插入的行，写入对同一进程的后续查询最多延迟 interval_ms
+"""
+from __future__ import absolute_import, division, unicode_literals
+
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+from peewee import *
+
+from .model import Model
+
+try:
+    from queue import Empty, Full, Queue
+except ImportError:
+    from Queue import Empty, Full, Queue
+
+LOGGER = logging.getLogger()
+
+MAX_ROWS = 500
+INTERVAL_MS = 50
+MAXSIZE = 10000
+PUT_TIMEOUT = 1
+REPLAY_INTERVAL = 5
+
+_STOP = object()
+_instances = []
+_instances_lock = threading.Lock()
+
+
+class SpoolBatch(Model):
+    """
+    已重放的 spool 批次，spool 文件清空后删除
+    """
+    class Meta:
+        db_table = 'write_behind_batch'
+    id = PrimaryKeyField()
+    batch_id = CharField(max_length=32, unique=True)
+    create_time = IntegerField(default=0)
+
+
+class _Flush(object):
+    def __init__(self):
+        self.event = threading.Event()
+
+
+class WriteBehind(object):
+    def __init__(self, model_class, max_rows=MAX_ROWS, interval_ms=INTERVAL_MS, maxsize=MAXSIZE,
+                 put_timeout=PUT_TIMEOUT, spool_path=None):
+        """
+        :param max_rows: 每批最多行数
+        :param interval_ms: 第一行入队后最多等待多久写库
+        :param maxsize: 队列容量
+        :param spool_path: 写库失败时的落盘文件，为 None 时失败的批次只记日志
+        """
+        self.model_class = model_class
+        self.max_rows = max_rows
+        self.interval = interval_ms / 1000
+        self.put_timeout = put_timeout
+        self.spool_path = spool_path
+        self._queue = Queue(maxsize)
+        self._thread = None
+        self._stopped = False
+        # 正在入队的 put 数，stop 等它们入队后再放入 _STOP，避免行排在 _STOP 之后丢失
+        self._putting = 0
+        self._put_cond = threading.Condition()
+        self._lock = threading.Lock()
+        self._spool_lock = threading.Lock()
+        self._last_replay = 0
+        self._batch_table = False
+        self._metrics = {
+            'enqueued': 0,
+            'max_depth': 0,
+            'flushes': 0,
+            'flushed_rows': 0,
+            'flush_ms': 0.0,
+            'max_flush_ms': 0.0,
+            'direct_rows': 0,
+            'spooled_rows': 0,
+            'replayed_rows': 0,
+            'errors': 0
+        }
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='write-behind-{}'.format(self.model_class.__name__))
+        self._thread.daemon = True
+        self._thread.start()
+        with _instances_lock:
+            _instances.append(self)
+        return self
+
+    def _count(self, name, value=1):
+        with self._lock:
+            self._metrics[name] += value
+
+    def put(self, values):
+        """
+        写入一行（字段 dict），已停止时直接写库
+        """
+        with self._put_cond:
+            stopped = self._stopped
+            if not stopped:
+                self._putting += 1
+        if stopped:
+            self._write_direct(values)
+            return
+        try:
+            self._queue.put(values, timeout=self.put_timeout)
+        except Full:
+            self._write_direct(values)
+            return
+        finally:
+            with self._put_cond:
+                self._putting -= 1
+                if not self._putting:
+                    self._put_cond.notify_all()
+        depth = self._queue.qsize()
+        with self._lock:
+            self._metrics['enqueued'] += 1
+            self._metrics['max_depth'] = max(self._metrics['max_depth'], depth)
+
+    def _write_direct(self, values):
+        self._count('direct_rows')
+        self._write([values])
+
+    def _run(self):
+        self._replay(force=True)
+        stopping = False
+        while not stopping:
+            batch, waiters = [], []
+            item = self._queue.get()
+            deadline = time.time() + self.interval
+            while True:
+                if item is _STOP:
+                    stopping = True
+                    break
+                if isinstance(item, _Flush):
+                    waiters.append(item)
+                    break
+                batch.append(item)
+                if len(batch) >= self.max_rows:
+                    break
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except Empty:
+                    break
+
+            if batch:
+                self._write(batch)
+            for waiter in waiters:
+                waiter.event.set()
+
+    def _write(self, batch):
+        start = time.time()
+        try:
+            self.model_class.add_many(batch, batch_size=self.max_rows)
+        except Exception as e:
+            LOGGER.exception('write behind %s failed: %s', self.model_class.__name__, e)
+            self._count('errors')
+            self._spool(batch)
+            if threading.current_thread() is self._thread:
+                # 连接可能已断开，下次写入时重新连接
+                try:
+                    self.model_class.db.close()
+                except Exception:
+                    pass
+            return
+
+        elapsed = (time.time() - start) * 1000
+        with self._lock:
+            self._metrics['flushes'] += 1
+            self._metrics['flushed_rows'] += len(batch)
+            self._metrics['flush_ms'] += elapsed
+            self._metrics['max_flush_ms'] = max(self._metrics['max_flush_ms'], elapsed)
+        self._replay()
+
+    def _spool(self, batch):
+        if not self.spool_path:
+            LOGGER.error('write behind %s dropped %s rows', self.model_class.__name__, len(batch))
+            return
+        line = json.dumps({'batch_id': uuid.uuid4().hex, 'rows': batch}, default=str)
+        with self._spool_lock:
+            with open(self.spool_path, 'a') as f:
+                f.write(line + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+        self._count('spooled_rows', len(batch))
+
+    def _replay(self, force=False):
+        """
+        逐行重放 spool 文件中的批次，全部写完后清空文件；失败时保留文件，REPLAY_INTERVAL 秒后再试
+        """
+        if not self.spool_path or (not force and time.time() - self._last_replay < REPLAY_INTERVAL):
+            return
+        self._last_replay = time.time()
+        with self._spool_lock:
+            if not os.path.exists(self.spool_path) or not os.path.getsize(self.spool_path):
+                return
+            batch_ids = []
+            try:
+                if not self._batch_table:
+                    SpoolBatch.create_table(fail_silently=True)
+                    self._batch_table = True
+                with open(self.spool_path) as f:
+                    for line in f:
+                        if not line.strip():
+                            continue
+                        try:
+                            record = json.loads(line)
+                        except ValueError:
+                            # 落盘时崩溃留下的半行，写入的调用方没有等到 fsync
+                            LOGGER.error('write behind %s skipped broken spool line', self.model_class.__name__)
+                            continue
+                        self._replay_batch(record['batch_id'], record['rows'])
+                        batch_ids.append(record['batch_id'])
+            except Exception as e:
+                LOGGER.warning('write behind %s replay failed: %s', self.model_class.__name__, e)
+                return
+            self._truncate_spool()
+        for start in range(0, len(batch_ids), self.max_rows):
+            SpoolBatch.delete().where(SpoolBatch.batch_id << batch_ids[start:start + self.max_rows]).execute()
+
+    def _replay_batch(self, batch_id, rows):
+        with self.model_class.db.atomic():
+            if SpoolBatch.select().where(SpoolBatch.batch_id == batch_id).exists():
+                return
+            SpoolBatch.insert(batch_id=batch_id, create_time=int(time.time())).execute()
+            self.model_class.add_many(rows, batch_size=self.max_rows)
+        self._count('replayed_rows', len(rows))
+
+    def _truncate_spool(self):
+        open(self.spool_path, 'w').close()
+
+    def flush(self, timeout=None):
+        """
+        等待此前入队的行写完，超时返回 False
+        """
+        if self._thread is None or not self._thread.is_alive():
+            return True
+        marker = _Flush()
+        self._queue.put(marker)
+        return marker.event.wait(timeout)
+
+    def stop(self, timeout=None):
+        """
+        写完队列后停止后台线程，之后的 put 直接写库
+        """
+        with self._put_cond:
+            if self._stopped:
+                return
+            self._stopped = True
+            while self._putting:
+                self._put_cond.wait()
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+        with _instances_lock:
+            if self in _instances:
+                _instances.remove(self)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._metrics)
+        stats['depth'] = self._queue.qsize()
+        stats['avg_flush_ms'] = stats['flush_ms'] / stats['flushes'] if stats['flushes'] else 0
+        stats['spool_bytes'] = os.path.getsize(self.spool_path) \
+            if self.spool_path and os.path.exists(self.spool_path) else 0
+        return stats
+
+
+@atexit.register
+def stop_all(timeout=10):
+    """
+    停止所有写缓冲，队列中的行写库（失败则落盘）
+    """
+    with _instances_lock:
+        instances = list(_instances)
+    for instance in instances:
+        instance.stop(timeout)
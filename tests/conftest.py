@@ -0,0 +1,110 @@
+# coding=utf-8
+"""
+models 是宿主应用的子包，依赖应用提供的 extensions.db、config、utils.func 和上级包的 meta。
+这里用临时 SQLite 文件搭一个最小的宿主应用 webapp，测试中以 webapp.models 导入
+"""
+from __future__ import absolute_import, unicode_literals
+
+import os
+import shutil
+import sys
+import tempfile
+import types
+
+import peewee
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DIRECTORY = tempfile.mkdtemp()
+DATABASE = peewee.SqliteDatabase(os.path.join(DIRECTORY, 'test.db'), check_same_thread=False)
+
+# aio 使用 async 语法，只支持 Python 3
+collect_ignore = ['test_aio.py'] if sys.version_info[0] == 2 else []
+
+
+class _Database(object):
+    """
+    flask_peewee.db.Database 中 models 用到的部分
+    """
+
+    def __init__(self, database):
+        self.database = database
+
+        class Model(peewee.Model):
+            class Meta:
+                database = self.database
+
+        self.Model = Model
+
+
+class MetaError(Exception):
+    pass
+
+
+def _module(name, **attrs):
+    module = types.ModuleType(str(name))
+    module.__dict__.update(attrs)
+    sys.modules[name] = module
+    return module
+
+
+def _random_ascii_string(length):
+    import random
+    import string
+    return ''.join(random.choice(string.ascii_letters) for _ in range(length))
+
+
+_module('extensions', db=_Database(DATABASE))
+_module('config', SECRET_KEY='test-secret', TOKEN_SALT='test-salt')
+_module('utils', __path__=[])
+_module('utils.func', random_ascii_string=_random_ascii_string)
+_module('webapp', __path__=[ROOT])
+_module('webapp.meta', UNAUTHORIZED=MetaError('unauthorized'), LOGIN_TOO_OFTEN=MetaError('login too often'),
+        USER_USERNAME_EXIST=MetaError('username exist'))
+
+
+def _close():
+    if not DATABASE.is_closed():
+        DATABASE.close()
+
+
+@pytest.fixture
+def db():
+    """
+    每个测试使用空库，测试自己建表
+    """
+    _close()
+    for table in DATABASE.get_tables():
+        DATABASE.execute_sql('DROP TABLE "{}"'.format(table))
+    yield DATABASE
+    _close()
+
+
+@pytest.fixture
+def tmpdir_path():
+    path = tempfile.mkdtemp(dir=DIRECTORY)
+    yield path
+    shutil.rmtree(path, ignore_errors=True)
+
+
+@pytest.fixture
+def lagging_replica(db, tmpdir_path):
+    """
+    调用时把主库拷贝为从库并启用读写分离，之后主库的修改不会同步过去（模拟复制延迟）
+    """
+    from webapp.models.model import Model
+    from webapp.models.pool import PooledSqlite
+    replicas = []
+
+    def snapshot():
+        _close()
+        path = os.path.join(tmpdir_path, 'replica-{}.db'.format(len(replicas)))
+        shutil.copy(DATABASE.database, path)
+        replicas.append(PooledSqlite(path, max_connections=4))
+        Model.use_replicas(replicas[-1])
+        return replicas[-1]
+    yield snapshot
+    if replicas:
+        Model.use_replicas()
+        for replica in replicas:
+            replica.close_all()
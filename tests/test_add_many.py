@@ -0,0 +1,60 @@
+# coding=utf-8
+from __future__ import absolute_import, unicode_literals
+
+import peewee
+import pytest
+
+from webapp.models import LotteryLog
+from webapp.models.model import Model
+
+
+class Note(Model):
+    class Meta:
+        db_table = 'add_many_note'
+    id = peewee.PrimaryKeyField()
+    user_id = peewee.IntegerField()
+    text = peewee.CharField(null=True)
+    score = peewee.IntegerField(null=True)
+
+    timestamps = False
+    add_fields = ('user_id', 'text', 'score')
+
+
+@pytest.fixture
+def logs(db):
+    db.create_tables([LotteryLog])
+
+
+def test_add_many_accepts_generator_and_batches(logs):
+    rows = ({'user_id': i, 'period': 1, 'text': '大', 'amount': i, 'create_time': '2017-03-01'} for i in range(7))
+    assert LotteryLog.add_many(rows, batch_size=3) == 7
+    assert [row['amount'] for row in LotteryLog.get_list(LotteryLog.select().order_by(LotteryLog.id))] == list(range(7))
+
+
+def test_add_many_rows_with_different_keys(logs):
+    rows = [
+        {'user_id': 1, 'period': 1, 'text': '大', 'amount': 10, 'create_time': '2017-03-01'},
+        {'user_id': 2, 'period': 1, 'text': '小', 'amount': 20, 'create_time': '2017-03-01', 'room_id': 7},
+        {'user_id': 3, 'text': '单', 'amount': 30, 'create_time': '2017-03-01', 'is_checked': 1},
+        {'user_id': 4, 'period': 1, 'text': '双', 'amount': 40, 'create_time': '2017-03-01', 'unknown': 1},
+    ]
+    assert LotteryLog.add_many(rows) == 4
+    data = dict((row['user_id'], row) for row in LotteryLog.get_list(None))
+    assert [data[i]['amount'] for i in (1, 2, 3, 4)] == [10, 20, 30, 40]
+    assert data[2]['room_id'] == 7 and data[1]['room_id'] == 0
+    assert data[3]['is_checked'] == 1 and data[3]['period'] == 0
+    assert data[4]['text'] == '双'
+
+
+def test_add_many_keeps_values_of_optional_fields(db):
+    db.create_tables([Note])
+    rows = [{'user_id': 1}, {'user_id': 2, 'text': 'b'}, {'user_id': 3, 'score': 3}, {'user_id': 4, 'text': 'd'}]
+    assert Note.add_many(rows, batch_size=10) == 4
+    data = dict((row['user_id'], row) for row in Note.get_list(None))
+    assert [(data[i]['text'], data[i]['score']) for i in (1, 2, 3, 4)] == [(None, None), ('b', None), (None, 3), ('d', None)]
+
+
+def test_bulk_create_records(logs):
+    records = ({'user_id': i, 'num_id': 5, 'text': '大', 'amount': 1} for i in range(5))
+    assert LotteryLog.bulk_create_records(records, batch_size=2) == 5
+    assert LotteryLog.select().where(LotteryLog.period == 5).count() == 5
@@ -0,0 +1,61 @@
+# coding=utf-8
+from __future__ import absolute_import, unicode_literals
+
+import sys
+
+import pytest
+
+from webapp.models import LotteryLog, User
+from webapp.models.model import Model
+
+pytestmark = pytest.mark.skipif(sys.version_info < (3, 7), reason='asyncio interface needs Python 3.7+')
+
+
+@pytest.fixture
+def aio(db):
+    from webapp.models import aio
+    db.create_tables([User, LotteryLog])
+    for i in range(3):
+        User.create(username='user-{}'.format(i), password='x', balance=i)
+    aio.configure(max_workers=2)
+    yield aio
+    aio.shutdown()
+
+
+def run(coroutine):
+    import asyncio
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def test_async_wrappers_match_sync(aio):
+    async def main():
+        return await aio.gather(
+            User.aget_by_id(1),
+            User.aget_list(None, paging={'limit': 2}),
+            Model.aexecute('SELECT COUNT(*) AS n FROM user', one=True),
+            aio.gather_dict({'ids': User.aget_by_ids([1, 2]), 'added': LotteryLog.aadd_many(
+                [{'user_id': 1, 'text': '大', 'amount': 1, 'create_time': 'x'}])}))
+
+    user, page, count, named = run(main())
+    assert user.username == 'user-0'
+    assert page == User.get_list(None, paging={'limit': 2})
+    assert count == {'n': 3}
+    assert named == {'ids': User.get_by_ids([1, 2]), 'added': 1}
+    assert User.aget_one.__doc__ and User.aget_list.__name__ == 'aget_list'
+
+
+def test_worker_connections_are_closed(aio):
+    async def main():
+        return await User.aget_one(User.id == 1)
+
+    assert run(main()).id == 1
+    assert aio.get_executor().submit(Model.db.is_closed).result()
+
+
+def test_run_requires_running_loop(aio):
+    with pytest.raises(RuntimeError):
+        aio.run(User.get_by_id, 1)
@@ -0,0 +1,69 @@
+# coding=utf-8
+from __future__ import absolute_import, unicode_literals
+
+import random
+from collections import Counter
+
+import pytest
+
+from webapp.models import LotteryNum
+
+np = pytest.importorskip('numpy')
+from webapp.models import analytics  # noqa: E402
+
+
+@pytest.fixture
+def draws(db):
+    db.create_tables([LotteryNum])
+    rng = random.Random(1)
+    rows = []
+    for period in range(1, 301):
+        digits = [rng.randint(0, 9) for _ in range(3)]
+        rows.append({'id': period, 'time': '{}'.format(period), 'num_one': digits[0], 'num_sec': digits[1],
+                     'num_thr': digits[2], 'num_add': sum(digits), 'num_str': '', 'result': '',
+                     'type': 1 + period % 2, 'create_time': '0'})
+    LotteryNum.add_many(rows)
+    return rows
+
+
+def test_export_draws(draws):
+    exported = analytics.export_draws(chunk_size=64)
+    assert exported['id'].tolist() == [row['id'] for row in draws]
+    assert exported['num_add'].tolist() == [row['num_add'] for row in draws]
+    assert analytics.export_draws({'type': 1})['id'].tolist() == [row['id'] for row in draws if row['type'] == 1]
+    assert len(analytics.export_draws({'id__gt': 1000})) == 0
+
+
+def test_frequencies(draws):
+    exported = analytics.export_draws()
+    frequency = analytics.digit_frequency(exported)
+    for i, name in enumerate(analytics.DIGITS):
+        counts = Counter(row[name] for row in draws)
+        assert frequency[i].tolist() == [counts[value] for value in range(10)]
+    sums = Counter(row['num_add'] for row in draws)
+    assert analytics.sum_distribution(exported).tolist() == [sums[value] for value in range(28)]
+
+    hot_cold = analytics.hot_cold(exported, window=50, top=2)
+    counts = Counter(row[name] for row in draws[-50:] for name in analytics.DIGITS)
+    assert hot_cold['counts'].tolist() == [counts[value] for value in range(10)]
+    assert counts[int(hot_cold['hot'][0])] == max(counts.values())
+
+
+def test_omission():
+    values = [1, 2, 1, 3, 0]
+    assert analytics.omission(values, 5, block=2).tolist() == [0, 2, 3, 1, 5]
+
+
+def test_runs():
+    mask = [True, True, False, True, True, True, False, True]
+    assert analytics.longest_run(mask) == 3
+    assert analytics.current_run(mask) == 1
+    assert analytics.longest_run([False, False]) == 0
+    assert analytics.current_run([True, True]) == 2
+
+
+def test_rolling_frequency():
+    values = [0, 1, 1, 2, 0]
+    result = analytics.rolling_frequency(values, 3, 3)
+    assert result.tolist() == [[1, 2, 0], [0, 2, 1], [1, 1, 1]]
+    assert analytics.rolling_frequency(values, 9, 3).shape == (0, 3)
@@ -0,0 +1,124 @@
+# coding=utf-8
+from __future__ import absolute_import, unicode_literals
+
+import datetime
+import json
+import os
+import threading
+
+import pytest
+
+from webapp.models import AmountDetail, LotteryLog
+
+
+@pytest.fixture
+def details(db, monkeypatch):
+    db.create_tables([AmountDetail, LotteryLog])
+    monkeypatch.setattr(AmountDetail, 'rollup_on_write', False)
+    rows = []
+    for month in (201701, 201702, 201703):
+        for day in range(1, 6):
+            rows.append({'user_id': day % 2, 'create_time': 1, 'amount': day, 'type': 1,
+                         'date_id': month * 100 + day, 'tips': '中文' if day == 2 else ''})
+    rows.append({'user_id': 1, 'create_time': 1, 'amount': 9, 'date_id': 0})
+    AmountDetail.add_many(rows)
+    return AmountDetail.get_list(None)
+
+
+def ids(rows):
+    return sorted(row['id'] for row in rows)
+
+
+def test_month_helpers():
+    assert AmountDetail.month_of(20170131) == 201701 and AmountDetail.month_of(0) is None
+    assert AmountDetail.month_conditions(201612) == {'date_id__gte': 20161200, 'date_id__lt': 20170100}
+    assert LotteryLog.month_of('2017-03-01 12:00:00') == 201703
+    assert LotteryLog.month_of(datetime.date(2017, 3, 1)) == 201703
+    assert LotteryLog.month_of('0') is None and LotteryLog.month_of(0) is None
+    assert LotteryLog.month_conditions(201712) == {'create_time__gte': '2017-12', 'create_time__lt': '2018-01'}
+    months = [201701, 201702, 201703]
+    assert AmountDetail.prune({'date_id__gte': 20170201, 'date_id__lt': 20170231}, months) == [201702]
+    assert AmountDetail.prune({'date_id__in': [20170101, 20170301]}, months) == [201701, 201703]
+    assert AmountDetail.prune({'date_id__gte': 0, '$or': [{'date_id': 20170101}]}, months) == months
+
+
+def test_timestamp_format(monkeypatch):
+    monkeypatch.setattr(AmountDetail, 'archive_time_field', 'create_time')
+    monkeypatch.setattr(AmountDetail, 'archive_time_format', 'timestamp')
+    conditions = AmountDetail.month_conditions(201612)
+    low, high = conditions['create_time__gte'], conditions['create_time__lt']
+    assert AmountDetail.month_of(low) == 201612 and AmountDetail.month_of(high) == 201701
+    assert AmountDetail.month_of(high - 1) == 201612 and AmountDetail.month_of(0) is None
+    assert AmountDetail.prune({'create_time__between': (low, high - 1)}, [201611, 201612, 201701]) == [201612]
+
+
+@pytest.mark.parametrize('name, time_format', [(None, None), ('created', 'date_id'), ('date_id', 'YYYYMMDD')])
+def test_archive_time_validated(monkeypatch, name, time_format):
+    monkeypatch.setattr(AmountDetail, 'archive_time_field', name)
+    monkeypatch.setattr(AmountDetail, 'archive_time_format', time_format)
+    for call in (lambda: AmountDetail.month_of(20170101), lambda: AmountDetail.month_conditions(201701),
+                 lambda: AmountDetail.prune({}, [201701])):
+        with pytest.raises(Exception) as info:
+            call()
+        assert 'archive_time' in '{}'.format(info.value)
+
+
+def test_archive_month(details, tmpdir_path):
+    assert AmountDetail.archive_month(201701, tmpdir_path) == 5
+    assert AmountDetail.select().count() == 11
+    assert AmountDetail.archived_months(tmpdir_path) == [201701]
+    with open(os.path.join(tmpdir_path, 'manifest.json')) as f:
+        assert json.load(f)['amount_detail']['201701']['rows'] == 5
+
+    assert AmountDetail.get_archived_list(None, archive_dir=tmpdir_path) == details
+    assert ids(AmountDetail.get_archived_list({'user_id': 1}, archive_dir=tmpdir_path)) == \
+        ids(row for row in details if row['user_id'] == 1)
+    assert [row['date_id'] for row in AmountDetail.get_archived_list(
+        {'tips__contains': '中'}, archive_dir=tmpdir_path)] == [20170102, 20170202, 20170302]
+    assert [row['amount'] for row in AmountDetail.get_archived_list(
+        {'$or': [{'amount__gt': 4}, {'tips': '中文'}], 'date_id__lte': 20170131}, archive_dir=tmpdir_path)] == [2, 5, 9]
+
+    data, pagination = AmountDetail.get_archived_list({'user_id': 1}, paging={'offset': 2, 'limit': 3},
+                                                      archive_dir=tmpdir_path)
+    assert [row['date_id'] for row in data] == [20170105, 20170201, 20170203]
+    assert pagination == {'offset': 2, 'limit': 3, 'rows_found': 10}
+
+    # 已归档的月份不再导出
+    assert AmountDetail.archive_month(201701, tmpdir_path) == 0
+    with pytest.raises(Exception):
+        AmountDetail.archive_month(int(datetime.date.today().strftime('%Y%m')), tmpdir_path)
+
+
+def test_archive_resumes_after_interrupted_delete(details, tmpdir_path, monkeypatch):
+    def interrupted(ids, batch_size=None):
+        raise KeyboardInterrupt
+    monkeypatch.setattr(AmountDetail, '_delete_archived', interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        AmountDetail.archive_month(201702, tmpdir_path)
+    assert AmountDetail.select().count() == 16
+    assert AmountDetail.get_archived_list(None, archive_dir=tmpdir_path) == details
+
+    monkeypatch.undo()
+    assert AmountDetail.archive_month(201702, tmpdir_path, batch_size=2) == 0
+    assert AmountDetail.select().count() == 11
+    assert ids(AmountDetail.get_archived_list(None, archive_dir=tmpdir_path)) == ids(details)
+
+
+def test_concurrent_archive(details, tmpdir_path):
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(AmountDetail.archive_month(201703, tmpdir_path)))
+               for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(results) == [0, 0, 5]
+    assert AmountDetail.select().count() == 11
+
+
+def test_archive_lottery_log(details, tmpdir_path):
+    for create_time in ('2017-02-28 23:59:59', '2017-03-01 00:00:00', '2017-03-31 12:00:00', '0'):
+        LotteryLog.insert(user_id=1, period=1, text='大', amount=1, create_time=create_time).execute()
+    assert LotteryLog.archive_month(201703, tmpdir_path) == 2
+    assert sorted(row['create_time'] for row in LotteryLog.get_list(None)) == ['0', '2017-02-28 23:59:59']
+    assert len(LotteryLog.get_archived_list({'create_time__gte': '2017-03-01'}, archive_dir=tmpdir_path)) == 2
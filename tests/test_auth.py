@@ -0,0 +1,101 @@
+# coding=utf-8
+from __future__ import absolute_import, unicode_literals
+
+import pytest
+
+flask = pytest.importorskip('flask')
+
+from webapp.models import Token, User
+from webapp.models import auth
+from webapp.models.token import TOKEN_CACHE
+
+
+@pytest.fixture
+def app(db, monkeypatch):
+    db.create_tables([User, Token])
+    monkeypatch.setattr(User, 'cache', None)
+    TOKEN_CACHE.clear()
+    User.create(username='alice', password='x', balance=10)
+    return flask.Flask(__name__)
+
+
+def authorize(app, access_token):
+    with app.test_request_context(headers={'Authorization': 'Bearer {}'.format(access_token)}):
+        flask.g.headers = {}
+        return auth.Authorization().get_authorization()
+
+
+def count_user_selects(monkeypatch):
+    selects = []
+    original = User.get_one_by_query.__func__
+
+    def get_one_by_query(cls, query):
+        selects.append(query)
+        return original(cls, query)
+    monkeypatch.setattr(User, 'get_one_by_query', classmethod(get_one_by_query))
+    return selects
+
+
+def test_gen_token_returns_existing_token(app):
+    with app.app_context():
+        first = auth.Authorization().gen_token('PASSWORD', 1, 1)
+        second = auth.Authorization().gen_token('PASSWORD', 1, 1)
+    assert first['access_token'] == second['access_token']
+    assert Token.select().count() == 1
+
+
+def test_cached_token_without_user_cache_reads_user(app, monkeypatch):
+    with app.app_context():
+        access_token = auth.Authorization().gen_token('PASSWORD', 1, 1)['access_token']
+    assert authorize(app, access_token).is_valid
+    selects = count_user_selects(monkeypatch)
+    authorization = authorize(app, access_token)
+    assert authorization.is_valid and authorization.user.username == 'alice'
+    assert len(selects) == 1
+
+
+def test_cached_token_with_user_cache_skips_queries(app, monkeypatch):
+    auth.enable_user_cache()
+    with app.app_context():
+        access_token = auth.Authorization().gen_token('PASSWORD', 1, 1)['access_token']
+    assert authorize(app, access_token).is_valid
+    selects = count_user_selects(monkeypatch)
+    # token 命中后第一次从主库读取用户并放入缓存
+    assert authorize(app, access_token).user.balance == 10
+    assert len(selects) == 1
+    assert authorize(app, access_token).user.balance == 10
+    assert len(selects) == 1
+
+    # 余额写入后读到新值
+    User.update_amount(1, 5, adding=True)
+    assert authorize(app, access_token).user.balance == 15
+    assert len(selects) == 2
+
+
+def test_user_cache_not_filled_from_replica(app, lagging_replica):
+    auth.enable_user_cache()
+    with app.app_context():
+        access_token = auth.Authorization().gen_token('PASSWORD', 1, 1)['access_token']
+    lagging_replica()
+    User.update(balance=200).where(User.id == 1).execute()
+
+    # token 校验的 JOIN 读到从库上的旧余额，缓存中的用户仍然来自主库
+    assert authorize(app, access_token).user.balance == 10
+    assert User.get_by_id(1).balance == 200
+    assert authorize(app, access_token).user.balance == 200
+
+
+def test_destroy_and_revoke_evict(app):
+    with app.app_context():
+        access_token = auth.Authorization().gen_token('PASSWORD', 1, 1)['access_token']
+    authorization = authorize(app, access_token)
+    authorization.destroy()
+    assert TOKEN_CACHE.get(access_token) is None
+    assert not authorize(app, access_token).is_valid
+
+    with app.app_context():
+        access_token = auth.Authorization().gen_token('PASSWORD', 2, 1)['access_token']
+    assert authorize(app, access_token).is_valid
+    assert Token.revoke(user_id=1) == 1
+    assert TOKEN_CACHE.get(access_token) is None
+    assert not authorize(app, access_token).is_valid
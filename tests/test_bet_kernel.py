@@ -0,0 +1,114 @@
+# coding=utf-8
+from __future__ import absolute_import, unicode_literals
+
+import random
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from webapp.models import AmountDetail, LotteryLog, LotteryNum, User
+from webapp.models import bet_kernel
+from webapp.models.benchmarks.datagen import outcomes
+from webapp.models.bet_kernel import BetKernel, evaluate_period, load_period, user_totals
+from webapp.models.settlement import PayoutRules, settle_period
+
+KINDS = ('大', '小', '单', '双', '大单', '大双', '小单', '小双', '极大', '极小', '豹子')
+RULES = PayoutRules(
+    odds=dict((text, '{}.{}'.format(2 + i, i)) for i, text in enumerate(KINDS)),
+    sum_odds=dict((value, 10 + value) for value in range(28) if value != 13)
+)
+TEXTS = list(KINDS) + [str(value) for value in range(29)] + [' 大 ', '大 单', '和值14', '', 'x', None]
+
+
+def all_draws():
+    for digits in ((0, 0, 0), (0, 1, 2), (4, 5, 5), (4, 4, 5), (9, 9, 9), (7, 8, 9), (3, 5, 6), (1, 1, 1)):
+        yield sum(digits), frozenset(outcomes(list(digits)))
+    # 开奖结果中没有任何玩法时只有和值可能中奖
+    yield 14, frozenset(['14'])
+
+
+def test_encode_decode():
+    kernel = BetKernel(RULES)
+    codes = kernel.encode(TEXTS)
+    assert codes.dtype == np.uint16
+    assert [kernel.decode(code) for code in codes] == [RULES.parse(text) for text in TEXTS]
+    assert kernel.encode_text('xyz') == kernel.invalid
+
+
+@pytest.mark.parametrize('draw', list(all_draws()))
+def test_evaluate_matches_oracle_for_every_text(draw):
+    kernel = BetKernel(RULES)
+    amounts = [1, 3, 7, 10, 99, 1000]
+    texts = [text for text in TEXTS for _ in amounts]
+    amounts = amounts * len(TEXTS)
+    payouts = kernel.evaluate(kernel.encode(texts), amounts, draw)
+    assert payouts.tolist() == kernel.oracle(texts, amounts, draw)
+
+
+def test_evaluate_matches_oracle_random():
+    rng = random.Random(7)
+    kernel = BetKernel(RULES)
+    texts = [rng.choice(TEXTS) for _ in range(5000)]
+    amounts = [rng.randint(1, 100000) for _ in range(5000)]
+    codes = kernel.encode(texts)
+    for draw in all_draws():
+        assert kernel.evaluate(codes, amounts, draw).tolist() == kernel.oracle(texts, amounts, draw)
+
+
+def test_user_totals():
+    assert user_totals([3, 1, 3, 2], [5, 0, 7, 0]) == {3: 12}
+
+
+@pytest.fixture
+def period(db):
+    db.create_tables([User, LotteryNum, LotteryLog, AmountDetail])
+    for i in range(20):
+        User.create(username='user-{}'.format(i), password='x', balance=0)
+    LotteryNum.create_record(7, '1500000000', 4, 5, 5, 14, '4,5,5', ','.join(outcomes([4, 5, 5])), 1, 0)
+    rng = random.Random(3)
+    bets = [dict(user_id=rng.randint(1, 20), period=7, text=rng.choice(TEXTS) or '', amount=rng.randint(1, 500),
+                 create_time='2017-01-01') for _ in range(500)]
+    LotteryLog.add_many(bets)
+    return bets
+
+
+def test_evaluate_period(period):
+    bets, payouts = evaluate_period(7, rules=RULES)
+    assert bets['id'].tolist() == list(range(1, 501))
+    draw = RULES.draw(LotteryNum.get_one(LotteryNum.id == 7))
+    assert payouts.tolist() == [RULES.payout_of(bet['text'], bet['amount'], draw) for bet in period]
+    assert len(load_period(7, rules=RULES, chunk_size=64)) == 500
+
+
+def test_settle_period_kernel_matches_loop(period):
+    balances = []
+    reports = []
+    for kernel_min_bets in (None, 1):
+        User.update(balance=0).execute()
+        LotteryLog.update(is_checked=0).execute()
+        reports.append(settle_period(7, RULES, kernel_min_bets=kernel_min_bets))
+        balances.append([user.balance for user in User.select().order_by(User.id)])
+    assert [report['evaluator'] for report in reports] == ['python', 'numpy']
+    assert balances[0] == balances[1] and sum(balances[0]) == reports[0]['payout'] > 0
+    for name in ('bets', 'winning_bets', 'winners', 'payout'):
+        assert reports[0][name] == reports[1][name]
+
+
+def test_settle_period_without_numpy(period, monkeypatch):
+    monkeypatch.setattr(bet_kernel, 'np', None)
+    assert settle_period(7, RULES, kernel_min_bets=1)['evaluator'] == 'python'
+
+
+def test_evaluate_period_from_primary(db, lagging_replica):
+    db.create_tables([User, LotteryNum, LotteryLog, AmountDetail])
+    lagging_replica()
+    LotteryNum.create_record(7, '1500000000', 4, 5, 5, 14, '4,5,5', ','.join(outcomes([4, 5, 5])), 1, 0)
+    LotteryLog.add_many([dict(user_id=1, period=7, text='大', amount=100, create_time='2017-01-01')])
+
+    with pytest.raises(Exception):
+        evaluate_period(7, rules=RULES)
+    assert len(load_period(7, rules=RULES)) == 0
+    bets, payouts = evaluate_period(7, rules=RULES, primary=True)
+    assert bets['id'].tolist() == [1]
+    assert payouts.tolist() == [200]
@@ -0,0 +1,83 @@
+# coding=utf-8
+from __future__ import absolute_import, unicode_literals
+
+import threading
+
+import pytest
+
+from webapp.models import User
+from webapp.models.cache import after_commit, unit_of_work
+
+
+@pytest.fixture
+def users(db, monkeypatch):
+    db.create_tables([User])
+    monkeypatch.setattr(User, 'cache', None)
+    User.enable_cache(maxsize=100, ttl=60)
+    for i in range(3):
+        User.create(username='user-{}'.format(i), password='x', balance=100)
+    return db
+
+
+def read_in_thread(func):
+    result = []
+    thread = threading.Thread(target=lambda: result.append(func()))
+    thread.start()
+    thread.join()
+    return result[0]
+
+
+def test_get_by_ids_reads_only_missing(users):
+    User.get_by_id(1)
+    queries = []
+    original = User.get_list
+    def get_list(query, *args, **kwargs):
+        queries.append(query.sql())
+        return original(query, *args, **kwargs)
+    User.get_list = get_list
+    try:
+        result = User.get_by_ids([1, 2, 3])
+    finally:
+        del User.get_list
+    assert sorted(result) == [1, 2, 3]
+    assert len(queries) == 1 and sorted(queries[0][1]) == [2, 3]
+    assert 'password' not in result[1]
+
+
+def test_identity_map_returns_same_instance(users):
+    with unit_of_work():
+        assert User.get_by_id(1) is User.get_by_id(1)
+    assert User.get_by_id(1) is not User.get_by_id(1)
+
+
+def test_save_and_update_amount_invalidate(users):
+    user = User.get_by_id(1)
+    user.nickname = 'changed'
+    user.save()
+    assert User.get_by_id(1).nickname == 'changed'
+    User.update_amount(1, 50, adding=True)
+    assert User.get_by_id(1).balance == 150
+
+
+def test_invalidate_again_after_commit(users):
+    assert User.get_by_id(1).balance == 100
+    with users.atomic():
+        User.update_amount(1, 30, adding=True)
+        # 其他线程在提交前读到旧值并放入缓存
+        assert read_in_thread(lambda: User.get_by_id(1).balance) == 100
+    assert User.get_by_id(1).balance == 130
+
+
+def test_after_commit_dropped_on_rollback(users):
+    called = []
+    with pytest.raises(ValueError):
+        with users.atomic():
+            after_commit(users, lambda: called.append(1))
+            raise ValueError()
+    with users.atomic():
+        with users.atomic():
+            after_commit(users, lambda: called.append(2))
+        assert called == []
+    assert called == [2]
+    after_commit(users, lambda: called.append(3))
+    assert called == [2, 3]
@@ -0,0 +1,44 @@
+# coding=utf-8
+from __future__ import absolute_import, unicode_literals
+
+import os
+import random
+
+import peewee
+
+from webapp.models import LotteryNum
+from webapp.models.benchmarks import datagen, runner
+from webapp.models.ingest import validate
+from webapp.models.settlement import PayoutRules
+
+RULES = PayoutRules(odds=dict((text, 2) for text in datagen.BET_TEXTS if not text.isdigit()),
+                    sum_odds=dict((value, 10) for value in range(28)))
+
+
+def test_outcomes():
+    assert datagen.outcomes([4, 5, 5]) == ['14', '大', '双', '大双']
+    assert datagen.outcomes([0, 1, 2]) == ['3', '小', '单', '小单', '极小']
+    assert datagen.outcomes([9, 9, 9]) == ['27', '大', '单', '大单', '极大', '豹子']
+
+
+def test_generated_rows_are_valid():
+    rng = random.Random(datagen.SEED)
+    for draw in datagen.draws(rng, 200):
+        validate(dict(draw))
+        digits = [draw['num_one'], draw['num_sec'], draw['num_thr']]
+        assert RULES.draw(LotteryNum(**draw))[1] == frozenset(datagen.outcomes(digits))
+    assert all(RULES.parse(text) is not None for text in datagen.BET_TEXTS)
+
+
+def test_generate(tmpdir_path):
+    database = peewee.SqliteDatabase(os.path.join(tmpdir_path, 'bench.db'))
+    sizes = datagen.generate(database, 'tiny')
+    assert sizes == dict(user=100, lottery_num=200, lottery_log=2000, payment=200, amount_detail=2000)
+    database.close()
+
+
+def test_measure_reports_rss_growth():
+    result = runner.measure(lambda: None, duration=0.01, warmup=1)
+    assert result['ops'] > 0
+    assert 'peak_rss_kb' not in result
+    assert result['rss_growth_kb'] is None or result['rss_growth_kb'] >= 0
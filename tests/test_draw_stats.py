@@ -0,0 +1,79 @@
+# coding=utf-8
+from __future__ import absolute_import, unicode_literals
+
+import os
+import random
+
+import pytest
+
+from webapp.models import LotteryNum
+from webapp.models.draw_stats import DrawStats
+
+
+@pytest.fixture
+def draws(db, monkeypatch):
+    db.create_tables([LotteryNum])
+    monkeypatch.setattr(LotteryNum, 'stats', None)
+    monkeypatch.setattr(LotteryNum, 'pipeline', None)
+    return random.Random(1)
+
+
+def insert(rng, period, type=1):
+    digits = [rng.randint(0, 9) for _ in range(3)]
+    LotteryNum.create_record(period, 't', digits[0], digits[1], digits[2], sum(digits),
+                             ','.join('{}'.format(digit) for digit in digits), '{}'.format(sum(digits)), type, 0)
+    return digits
+
+
+def test_stats_are_kept_per_type(draws):
+    stats = {1: DrawStats(window=5, type=1), 2: DrawStats(window=5, type=2)}
+    LotteryNum.stats = stats
+    counts = {1: [0] * 28, 2: [0] * 28}
+    for period in range(1, 41):
+        type = 1 + period % 2
+        counts[type][sum(insert(draws, period, type))] += 1
+    for type in (1, 2):
+        assert stats[type].draws == 20
+        assert stats[type].sum_counts == counts[type]
+        assert stats[type].verify() == []
+
+
+def test_snapshot_written_in_background(draws, tmpdir_path):
+    path = os.path.join(tmpdir_path, 'stats.json')
+    for period in range(1, 11):
+        insert(draws, period)
+    stats = DrawStats.open(path, window=5, type=1, snapshot_interval=3600)
+    assert stats.draws == 10 and os.path.exists(path)
+    mtime = os.path.getmtime(path)
+
+    LotteryNum.stats = {1: stats}
+    insert(draws, 11)
+    assert stats.draws == 11 and os.path.getmtime(path) == mtime
+    stats.close()
+    assert DrawStats.open(path, window=5, type=1).state() == stats.state()
+    assert [name for name in os.listdir(tmpdir_path) if name.endswith('.tmp')] == []
+
+
+def test_other_processes_refresh(draws, tmpdir_path):
+    path = os.path.join(tmpdir_path, 'stats.json')
+    writer = DrawStats.open(path, window=5, type=1)
+    reader = DrawStats.open(path, window=5, type=1, refresh_interval=0)
+    LotteryNum.stats = {1: writer}
+    for period in range(1, 6):
+        insert(draws, period)
+    assert reader.snapshot()['draws'] == 5
+
+    # 写入进程更正后全量重算并保存，读取进程从快照文件读到更正
+    LotteryNum.update(num_one=9, num_sec=9, num_thr=9, num_add=27).where(LotteryNum.id == 3).execute()
+    writer.load(DrawStats.rebuild(window=5, type=1).state())
+    writer.save()
+    os.utime(path, (0, 0))  # 文件系统的 mtime 精度可能不足以区分两次写入
+    assert reader.snapshot()['sum_counts'][27] >= 1
+    assert reader.state() == writer.state()
+    writer.close()
+    reader.close()
+
+
+def test_load_rejects_other_type():
+    with pytest.raises(Exception):
+        DrawStats(type=1).load(DrawStats(type=2).state())
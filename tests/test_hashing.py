@@ -0,0 +1,97 @@
+# coding=utf-8
+from __future__ import absolute_import, unicode_literals
+
+import threading
+import time
+
+import pytest
+
+pytest.importorskip('werkzeug')
+
+from webapp.models import User
+from webapp.models import hashing
+from webapp.models.hashing import HashingBusy, PasswordHasher
+
+METHOD = 'pbkdf2:sha256:1000'
+
+
+@pytest.fixture
+def hasher():
+    hasher = PasswordHasher(method=METHOD, threads=2, max_pending=4, timeout=5)
+    yield hasher
+    hasher.close()
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            raise AssertionError('condition not met')
+        time.sleep(0.01)
+
+
+def test_hash_and_verify(hasher):
+    pwhash = hasher.hash('secret1')
+    assert pwhash.startswith(METHOD + '$')
+    assert hasher.verify(pwhash, 'secret1')
+    assert not hasher.verify(pwhash, 'secret2')
+    assert not hasher.verify('', 'secret1')
+    stats = hasher.stats()
+    assert (stats['hashed'], stats['verified'], stats['pending'], stats['threads']) == (1, 2, 0, 2)
+
+
+def test_rehash_on_method_change(hasher):
+    old = PasswordHasher(method='pbkdf2:sha1:1000', threads=0).hash('secret1')
+    assert hasher.verify(old, 'secret1')
+    assert hasher.needs_rehash(old)
+    pwhash = hasher.rehash(old, 'secret1')
+    assert pwhash.startswith(METHOD + '$') and hasher.verify(pwhash, 'secret1')
+    assert hasher.rehash(pwhash, 'secret1') is None
+
+
+def test_hash_many_keeps_order(hasher):
+    passwords = ['p{}'.format(i) for i in range(10)]
+    pwhashes = hasher.hash_many(passwords, chunk_size=3)
+    assert [hasher.verify(pwhash, password) for pwhash, password in zip(pwhashes, passwords)] == [True] * 10
+    assert len(set(pwhashes)) == 10
+
+
+def test_timeout_keeps_slot_until_done(monkeypatch):
+    started, done = threading.Event(), threading.Event()
+
+    def slow(password, method, salt_length):
+        started.set()
+        done.wait(5)
+        return 'hashed'
+    monkeypatch.setattr(hashing, '_generate', slow)
+    hasher = PasswordHasher(method=METHOD, threads=2, max_pending=1, timeout=0.05)
+    try:
+        with pytest.raises(HashingBusy):
+            hasher.hash('secret1')
+        assert started.is_set()
+        # 超时的任务还在计算，空位没有释放
+        assert hasher.stats()['pending'] == 1
+        with pytest.raises(HashingBusy):
+            hasher.hash('secret1')
+        assert hasher.stats()['busy'] == 2
+
+        done.set()
+        wait_for(lambda: hasher.stats()['pending'] == 0)
+        assert hasher.hash('secret1') == 'hashed'
+    finally:
+        done.set()
+        hasher.close()
+
+
+def test_user_password_upgraded_on_login(db, monkeypatch):
+    db.create_tables([User])
+    monkeypatch.setattr(hashing, '_hasher', PasswordHasher(method='pbkdf2:sha1:1000', threads=1))
+    user = User.add({'username': 'alice', 'password': 'secret1'})
+    assert user.password.startswith('pbkdf2:sha1:1000$')
+
+    monkeypatch.setattr(hashing, '_hasher', PasswordHasher(method=METHOD, threads=1))
+    user = User.get_by_id(user.id)
+    assert not user.check_password('secret2')
+    assert user.check_password('secret1')
+    assert User.get_by_id(user.id).password.startswith(METHOD + '$')
+    assert User.get_by_id(user.id).check_password('secret1')
@@ -0,0 +1,122 @@
+# coding=utf-8
+from __future__ import absolute_import, unicode_literals
+
+import pytest
+from peewee import OperationalError
+
+from webapp.models import AmountDetail, LotteryLog, LotteryNum, User
+from webapp.models import ingest, settlement
+from webapp.models.draw_stats import DrawStats
+from webapp.models.ingest import DrawInvalid, DrawPipeline, stats_subscriber, validate
+
+DRAW = dict(id=1, time='1500000000', num_one=5, num_sec=6, num_thr=7, num_add=18, num_str='5,6,7',
+            result='18,大,双,大双', type=1)
+
+
+@pytest.fixture
+def pipeline(db, monkeypatch):
+    db.create_tables([LotteryNum])
+    monkeypatch.setattr(LotteryNum, 'cache', None)
+    pipeline = DrawPipeline()
+    yield pipeline
+    pipeline.close()
+
+
+@pytest.mark.parametrize('changes', [
+    {'id': 0}, {'num_one': 10}, {'num_add': 17}, {'num_str': '5,6,8'}, {'result': '17,小'}, {'result': ''},
+    {'time': None}, {'time': ''}, {'type': None}, {'type': 'x'}, {'by_hand': 2}, {'result': 'x' * 17},
+])
+def test_validate_rejects(changes):
+    with pytest.raises(DrawInvalid):
+        validate(dict(DRAW, **changes))
+
+
+def test_validate_converts():
+    values = validate(dict(DRAW, id='1', num_one='5', type='1', num_str='5+6+7=18'))
+    assert (values['id'], values['num_one'], values['type'], values['by_hand']) == (1, 5, 1, 0)
+
+
+def test_ingest_kinds(pipeline):
+    events = []
+    pipeline.subscribe('events', events.append)
+    assert pipeline.ingest(DRAW, source='a')[0] == ingest.INSERTED
+    assert pipeline.ingest(dict(DRAW, id='1'), source='b')[0] == ingest.DUPLICATE
+    corrected = dict(DRAW, num_thr=8, num_add=19, num_str='5,6,8', result='19,大,单,大单')
+    assert pipeline.ingest(corrected, source='b')[0] == ingest.CONFLICT
+    assert pipeline.ingest(dict(corrected, by_hand=1))[0] == ingest.CORRECTED
+    with pytest.raises(DrawInvalid):
+        pipeline.ingest(dict(DRAW, id=2, time=None))
+    pipeline.join()
+
+    assert [(event.period, event.kind) for event in events] == [(1, ingest.INSERTED), (1, ingest.CORRECTED)]
+    assert events[1].digits() == (5, 6, 8, 19)
+    assert LotteryNum.get_one(LotteryNum.id == 1).num_thr == 8
+    assert LotteryNum.select().count() == 1
+    counts = pipeline.stats()['counts']
+    assert (counts['inserted'], counts['duplicate'], counts['conflict'], counts['corrected'], counts['invalid']) == \
+        (1, 1, 1, 1, 1)
+    assert set(pipeline.latency(1)) == {'ingest', 'events'}
+
+
+def test_create_record_goes_through_pipeline(pipeline, monkeypatch):
+    monkeypatch.setattr(LotteryNum, 'pipeline', pipeline)
+    stats = DrawStats(type=1)
+    pipeline.subscribe('stats', stats_subscriber(stats))
+    LotteryNum.create_record(1, '1500000000', 5, 6, 7, 18, '5,6,7', '18,大,双,大双', 1, 0)
+    LotteryNum.create_record(2, '1500000210', 1, 1, 1, 3, '1,1,1', '3,小,单,小单', 2, 0)
+    pipeline.join()
+    assert (stats.draws, stats.last_period, stats.sum_counts[18]) == (1, 1, 1)
+
+
+def test_retry_on_lock(pipeline, monkeypatch):
+    calls = []
+    upsert = pipeline._upsert
+
+    def locked_once(values):
+        calls.append(values['id'])
+        if len(calls) == 1:
+            raise OperationalError('database is locked')
+        return upsert(values)
+    monkeypatch.setattr(pipeline, '_upsert', locked_once)
+    assert pipeline.ingest(DRAW)[0] == ingest.INSERTED
+    assert calls == [1, 1]
+
+    del calls[:]
+    monkeypatch.setattr(ingest, 'MAX_RETRIES', 0)
+    with pytest.raises(OperationalError):
+        pipeline.ingest(dict(DRAW, id=2))
+
+
+def test_settlement_subscriber_retries(monkeypatch):
+    calls = []
+
+    def settle_period(lottery_num_id, rules=None):
+        calls.append(lottery_num_id)
+        if len(calls) < 3:
+            raise OperationalError('database is locked')
+        return {'bets': 0}
+    monkeypatch.setattr(settlement, 'settle_period', settle_period)
+    callback = ingest.settlement_subscriber()
+    event = ingest.DrawEvent(7, ingest.INSERTED, dict(DRAW, id=7), None, 0, 0)
+    assert callback(event) == {'bets': 0}
+    assert calls == [7, 7, 7]
+
+    monkeypatch.setattr(ingest, 'MAX_RETRIES', 1)
+    del calls[:]
+    with pytest.raises(OperationalError):
+        callback(event)
+
+
+def test_settlement_subscriber_with_lagging_replica(db, pipeline, lagging_replica):
+    db.create_tables([User, LotteryLog, AmountDetail])
+    User.create(username='user', password='x', balance=0)
+    LotteryLog.create_record(1, 1, '大', 100)
+    lagging_replica()
+    # 从库上没有这一期，也看不到下注已结算
+    pipeline.subscribe('settlement', ingest.settlement_subscriber(settlement.PayoutRules({'大': 2})))
+    assert pipeline.ingest(DRAW)[0] == ingest.INSERTED
+    pipeline.close(5)
+    assert LotteryNum.get_one(LotteryNum.id == 1) is None
+
+    assert User.select(User.balance).where(User.id == 1).scalar() == 200
+    assert LotteryLog.select().where(LotteryLog.is_checked == 0).count() == 0
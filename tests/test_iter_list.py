@@ -0,0 +1,43 @@
+# coding=utf-8
+from __future__ import absolute_import, unicode_literals
+
+import pytest
+
+from webapp.models import LotteryLog, User
+
+
+@pytest.fixture
+def users(db):
+    db.create_tables([User, LotteryLog])
+    for i in range(5):
+        user = User.create(username='user-{}'.format(i), password='secret', nickname='n{}'.format(i), balance=i)
+        LotteryLog.create_record(user.id, 1, '大', 10 + i)
+    return db
+
+
+def test_iter_list_matches_get_list(users):
+    query = User.select().order_by(User.id)
+    assert list(User.iter_list(query, chunk_size=2)) == User.get_list(query)
+    assert list(User.iter_list({'balance__gte': 3})) == User.get_list({'balance__gte': 3})
+    assert [user.id for user in User.iter_list(None, is_object=True)] == [1, 2, 3, 4, 5]
+
+
+def test_iter_list_partial_select_keeps_exclude(users):
+    query = User.select(User.id, User.password, User.nickname).order_by(User.id)
+    data = list(User.iter_list(query))
+    assert data == User.get_list(query)
+    assert 'password' not in data[0] and (data[0]['id'], data[0]['nickname']) == (1, 'n0')
+
+
+def test_iter_list_join_does_not_clobber_own_fields(users):
+    query = LotteryLog.select(LotteryLog, User.id, User.nickname) \
+        .join(User, on=(LotteryLog.user_id == User.id)).where(User.id > 1).order_by(LotteryLog.id)
+    data = list(LotteryLog.iter_list(query))
+    assert [(row['id'], row['user_id'], row['amount']) for row in data] == [(2, 2, 11), (3, 3, 12), (4, 4, 13), (5, 5, 14)]
+    assert 'nickname' not in data[0]
+    assert [log.nickname for log in LotteryLog.iter_list(query, is_object=True)] == ['n1', 'n2', 'n3', 'n4']
+
+
+def test_execute_iter(users):
+    rows = list(User.execute_iter('SELECT id, balance FROM user ORDER BY id', chunk_size=2))
+    assert rows == [{'id': i + 1, 'balance': i} for i in range(5)]
@@ -0,0 +1,56 @@
+# coding=utf-8
+from __future__ import absolute_import, unicode_literals
+
+import os
+import subprocess
+import sys
+import types
+
+import pytest
+
+from webapp.models import _lazy_module
+
+TESTS = os.path.dirname(os.path.abspath(__file__))
+
+CHECK_IMPORTS = '''
+import sys
+sys.path.insert(0, {tests!r})
+import conftest
+import webapp.models as models
+from webapp.models import User
+from webapp.models.token import Token, TOKEN_CACHE
+models.LotteryLog, models.Payment
+print(sorted(set(name.split('.')[0] for name in sys.modules) & set(['flask', 'itsdangerous'])))
+'''
+
+
+def test_lazy_module(monkeypatch):
+    module = types.ModuleType(str('lazy_example'))
+    module.value = 1
+    monkeypatch.setitem(sys.modules, 'lazy_example', module)
+
+    def getattr_func(name):
+        if name == 'extra':
+            return 2
+        raise AttributeError(name)
+
+    lazy = _lazy_module('lazy_example', getattr_func, ['extra'])
+    assert sys.modules['lazy_example'] is lazy
+    assert (lazy.value, lazy.extra) == (1, 2)
+    assert 'extra' in dir(lazy) and 'value' in dir(lazy)
+    with pytest.raises(AttributeError):
+        lazy.missing
+
+
+def test_models_import_without_web_dependencies():
+    output = subprocess.check_output([sys.executable, '-c', CHECK_IMPORTS.format(tests=str(TESTS))])
+    assert output.strip() == b'[]'
+
+
+def test_auth_names_load_on_access():
+    pytest.importorskip('flask')
+    from webapp import models
+    from webapp.models import auth
+    from webapp.models.token import Authorization
+    assert Authorization is auth.Authorization is models.Authorization
+    assert models.auth_required is auth.auth_required
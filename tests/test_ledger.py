@@ -0,0 +1,99 @@
+# coding=utf-8
+from __future__ import absolute_import, unicode_literals
+
+import pytest
+from peewee import OperationalError
+
+from webapp.models import AmountDetail, User
+from webapp.models.ledger import BalanceSlot, InsufficientBalance, Ledger
+from webapp.models.model import Model
+
+HOUSE = 5
+
+
+@pytest.fixture
+def ledger(db):
+    db.create_tables([User, AmountDetail, BalanceSlot])
+    for i in range(5):
+        User.create(username='user-{}'.format(i), password='x', balance=100)
+    return Ledger(hot_accounts={HOUSE: 4})
+
+
+def details(user_id):
+    return list(AmountDetail.select(AmountDetail.amount_change, AmountDetail.amount)
+                .where(AmountDetail.user_id == user_id).order_by(AmountDetail.id).tuples())
+
+
+def balances():
+    return [user.balance for user in User.select().order_by(User.id)]
+
+
+def test_apply_writes_one_detail_per_delta(ledger):
+    assert ledger.apply([(1, 10), (2, -50), (1, -5)], type=3) == {1: 105, 2: 50}
+    assert balances() == [105, 50, 100, 100, 100]
+    assert details(1) == [(10, 110), (-5, 105)]
+
+
+def test_apply_rolls_back_on_insufficient_balance(ledger):
+    with pytest.raises(InsufficientBalance):
+        ledger.apply([(1, 1), (3, -500)])
+    assert balances() == [100] * 5
+    assert AmountDetail.select().count() == 0
+
+
+def test_hot_account_details_record_folded_balance(ledger):
+    assert ledger.apply([(HOUSE, 30), (1, -10), (HOUSE, 20)]) == {1: 90, HOUSE: 150}
+    assert User.get_by_id(HOUSE).balance == 100
+    assert details(HOUSE) == [(30, 130), (20, 150)]
+    assert ledger.get_balance(HOUSE) == 150
+    assert ledger.apply([(HOUSE, 5)]) == {HOUSE: 155}
+    assert details(HOUSE)[-1] == (5, 155)
+
+
+def test_hot_account_overdraft_counts_slots(ledger):
+    ledger.apply([(HOUSE, 50)])
+    with pytest.raises(InsufficientBalance):
+        ledger.apply([(HOUSE, -151)])
+    assert ledger.apply([(HOUSE, -140)]) == {HOUSE: 10}
+    assert details(HOUSE)[-1] == (-140, 10)
+    assert ledger.get_balance(HOUSE) == 10
+
+
+def test_debit(ledger):
+    assert ledger.debit(4, 60) == 40
+    with pytest.raises(InsufficientBalance):
+        ledger.debit(4, 60)
+    assert details(4) == [(-60, 40)]
+
+    ledger.apply([(HOUSE, 50)])
+    with pytest.raises(InsufficientBalance):
+        ledger.debit(HOUSE, 151)
+    assert ledger.debit(HOUSE, 120) == 30
+    assert ledger.get_balance(HOUSE) == 30
+
+
+def test_fold(ledger):
+    ledger.apply([(HOUSE, 30), (HOUSE, 20)])
+    assert ledger.fold(HOUSE) == 50
+    assert User.get_by_id(HOUSE).balance == 150
+    assert ledger.get_balance(HOUSE) == 150
+
+
+def test_retry_only_outside_transaction(ledger, monkeypatch):
+    calls = []
+
+    def locked(*args):
+        calls.append(1)
+        raise OperationalError('database is locked')
+
+    monkeypatch.setattr(ledger, '_apply', locked)
+    ledger.max_retries = 2
+    with pytest.raises(OperationalError):
+        ledger.apply([(1, 1)])
+    assert len(calls) == 3
+
+    del calls[:]
+    with pytest.raises(OperationalError):
+        with Model.db.atomic():
+            ledger.apply([(1, 1)])
+    assert len(calls) == 1
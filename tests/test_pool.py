@@ -0,0 +1,66 @@
+# coding=utf-8
+from __future__ import absolute_import, unicode_literals
+
+import os
+import shutil
+
+import pytest
+
+from webapp.models import User
+from webapp.models.model import Model
+from webapp.models.pool import PooledSqlite, use_primary
+
+
+@pytest.fixture
+def replica(db, tmpdir_path, monkeypatch):
+    """
+    从库是主库的一份拷贝，之后主库的修改不会同步过去（模拟复制延迟）
+    """
+    db.create_tables([User])
+    User.create(username='user', password='x', balance=100)
+    db.close()
+    path = os.path.join(tmpdir_path, 'replica.db')
+    shutil.copy(db.database, path)
+    User.update(balance=200).where(User.id == 1).execute()
+
+    monkeypatch.setattr(User, 'cache', None)
+    replica = PooledSqlite(path, max_connections=4)
+    Model.use_replicas(replica)
+    yield replica
+    Model.use_replicas()
+    Model.disable_profiler()
+    replica.close_all()
+
+
+def test_reads_go_to_replica(replica):
+    assert User.get_one(User.id == 1).balance == 100
+    with use_primary():
+        assert User.get_one(User.id == 1).balance == 200
+    with Model.db.atomic():
+        assert User.get_one(User.id == 1).balance == 200
+    assert replica.pool_stats()['checkouts'] >= 1
+
+
+def test_cached_reads_come_from_primary(replica):
+    User.enable_cache(maxsize=10, ttl=60)
+    assert User.get_by_id(1).balance == 200
+    assert User.get_by_ids([1], is_object=True)[1].balance == 200
+    assert User.get_one(User.id == 1).balance == 100
+
+
+def test_last_read_database(replica):
+    router = Model.router
+    assert router.read_database() is replica
+    assert router.last_read_database() is replica
+    with use_primary():
+        router.read_database()
+    assert router.last_read_database() is Model.db
+
+
+def test_profiler_covers_replicas(replica):
+    profiler = Model.enable_profiler()
+    assert 'execute_sql' in vars(replica)
+    User.get_list(User.select().where(User.id == 1))
+    assert any(key.startswith('SELECT') for key in profiler.stats())
+    Model.disable_profiler()
+    assert 'execute_sql' not in vars(replica) and 'execute_sql' not in vars(Model.db)
@@ -0,0 +1,70 @@
+# coding=utf-8
+from __future__ import absolute_import, unicode_literals
+
+import pytest
+
+from webapp.models import LotteryLog, User
+from webapp.models.prefetch import Related, prefetch
+
+
+@pytest.fixture
+def logs(db, monkeypatch):
+    db.create_tables([User, LotteryLog])
+    monkeypatch.setattr(User, 'cache', None)
+    for i in range(5):
+        User.create(username='user-{}'.format(i), nickname='nick-{}'.format(i), password='x')
+    for user_id in (1, 2, 2, 3, 5, 9, 1):
+        LotteryLog.create_record(user_id, 100, '大', 10)
+
+
+def count_reads(monkeypatch, model_class):
+    reads = []
+    original = model_class.route_read.__func__
+
+    def route_read(cls, query):
+        reads.append(query)
+        return original(cls, query)
+    monkeypatch.setattr(model_class, 'route_read', classmethod(route_read))
+    return reads
+
+
+def test_prefetch_one(logs, monkeypatch):
+    reads = count_reads(monkeypatch, User)
+    data = LotteryLog.get_list({'period': 100}, prefetch={'user': (User, 'user_id', ['nickname'])})
+    assert [(row['user_id'], row['user']) for row in data] == [
+        (1, {'nickname': 'nick-0'}), (2, {'nickname': 'nick-1'}), (2, {'nickname': 'nick-1'}),
+        (3, {'nickname': 'nick-2'}), (5, {'nickname': 'nick-4'}), (9, None), (1, {'nickname': 'nick-0'})]
+    assert len(reads) == 1
+
+
+def test_prefetch_chunks(logs, monkeypatch):
+    reads = count_reads(monkeypatch, User)
+    rows = LotteryLog.get_list({'period': 100})
+    prefetch(rows, {'user': (User, 'user_id', ['username'])}, chunk_size=2)
+    assert [row['user'] and row['user']['username'] for row in rows] == [
+        'user-0', 'user-1', 'user-1', 'user-2', 'user-4', None, 'user-0']
+    # 5 个不同的 user_id，每块 2 个
+    assert len(reads) == 3
+
+
+def test_prefetch_many_and_default_fields(logs):
+    data = User.get_list({'id__in': [1, 2, 4]}, prefetch={
+        'bets': Related(LotteryLog, 'id', ['amount'], remote_key='user_id', many=True),
+        'me': (User, 'id'),
+    })
+    assert [len(row['bets']) for row in data] == [2, 2, 0]
+    assert data[0]['bets'][0] == {'amount': 10}
+    assert 'password' not in data[0]['me'] and data[0]['me']['username'] == 'user-0'
+
+
+def test_prefetch_objects_and_paging(logs):
+    relations = {'user': (User, 'user_id', ['nickname'])}
+    objects = LotteryLog.get_list({'user_id': 2}, is_object=True, prefetch=relations)
+    assert [item.user['nickname'] for item in objects] == ['nick-1', 'nick-1']
+
+    data, pagination = LotteryLog.get_list(None, paging={'limit': 2}, prefetch=relations)
+    assert pagination['rows_found'] == 7
+    assert [row['user']['nickname'] for row in data] == ['nick-0', 'nick-1']
+
+    with pytest.raises(Exception):
+        LotteryLog.get_list(None, as_rows=True, prefetch=relations)
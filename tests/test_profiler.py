@@ -0,0 +1,57 @@
+# coding=utf-8
+from __future__ import absolute_import, unicode_literals
+
+import json
+import os
+
+import pytest
+
+from webapp.models import User
+from webapp.models.model import Model
+from webapp.models.profiler import fingerprint
+
+
+@pytest.fixture
+def profiler(db):
+    db.create_tables([User])
+    profiler = Model.enable_profiler(slow_ms=0, explain=True)
+    yield profiler
+    Model.disable_profiler()
+
+
+def test_fingerprint():
+    assert fingerprint("SELECT * FROM t WHERE a = 1 AND b IN (?, ?, ?) AND c = 'x'") == \
+        'SELECT * FROM t WHERE a = ? AND b IN (...) AND c = ?'
+    assert fingerprint('INSERT INTO t (a) VALUES (?), (?)') == fingerprint('INSERT INTO t (a) VALUES (?)')
+
+
+def test_records_queries_with_call_site(profiler):
+    for i in range(3):
+        User.create(username='user-{}'.format(i), password='x')
+    User.get_list({'id__in': [1, 2]})
+    User.get_list({'id__in': [1, 2, 3]})
+
+    stats = profiler.stats()
+    selects = [item for key, item in stats.items() if key.startswith('SELECT') and 'IN (...)' in key]
+    assert len(selects) == 1 and selects[0]['count'] == 2 and selects[0]['rows'] >= 0
+    assert any('test_profiler.py' in site for site in selects[0]['sites'])
+    assert sum(selects[0]['histogram']) == 2
+
+
+def test_slow_queries_explain_and_dump(profiler, tmpdir_path):
+    User.create(username='user', password='x')
+    list(User.execute_iter('SELECT id FROM user'))
+    slow = [item for item in profiler.slow_queries() if item['sql'].startswith('SELECT')]
+    assert slow and isinstance(slow[-1]['explain'], list)
+
+    path = os.path.join(tmpdir_path, 'profile.json')
+    profiler.dump_json(path)
+    with open(path) as f:
+        assert set(json.load(f)) == {'buckets_ms', 'queries', 'slow'}
+
+
+def test_disable_restores_execute_sql(db):
+    Model.enable_profiler()
+    Model.disable_profiler()
+    assert 'execute_sql' not in vars(Model.db)
+    assert Model.profiler is None
@@ -0,0 +1,70 @@
+# coding=utf-8
+from __future__ import absolute_import, unicode_literals
+
+import pytest
+
+from webapp.models import AmountDetail, Payment, User
+from webapp.models import rollup
+from webapp.models.ledger import Ledger
+from webapp.models.model import Model
+
+NOW = Model.now()
+TODAY = Model.get_date_id_from_timestamp(NOW)
+YESTERDAY = Model.get_date_id_from_timestamp(NOW - 86400)
+
+
+@pytest.fixture
+def tables(db, monkeypatch):
+    db.create_tables([User, AmountDetail, Payment, rollup.DailyStat, rollup.RollupWatermark])
+    monkeypatch.setattr(AmountDetail, 'rollup_on_write', False)
+    monkeypatch.setattr(Payment, 'rollup_on_write', False)
+    return db
+
+
+def detail(user_id, amount, create_time=NOW, **values):
+    values.update({'user_id': user_id, 'amount_change': amount, 'type': 1, 'create_time': create_time})
+    return values
+
+
+def stored(source, date_id):
+    return dict(((stat.user_id, stat.type), (stat.total, stat.count)) for stat in rollup.DailyStat.select()
+                .where(rollup.DailyStat.source == source, rollup.DailyStat.date_id == date_id))
+
+
+def test_catch_up_is_idempotent(tables):
+    AmountDetail.add_many([detail(1, 10), detail(1, 5), detail(2, 7), detail(1, 3, NOW - 86400)])
+    assert rollup.catch_up(rollup.SOURCE_AMOUNT_DETAIL) == 4
+    assert stored(rollup.SOURCE_AMOUNT_DETAIL, TODAY) == {(1, 1): (15, 2), (2, 1): (7, 1)}
+    assert stored(rollup.SOURCE_AMOUNT_DETAIL, YESTERDAY) == {(1, 1): (3, 1)}
+
+    rollup.catch_up(rollup.SOURCE_AMOUNT_DETAIL)
+    assert stored(rollup.SOURCE_AMOUNT_DETAIL, TODAY) == {(1, 1): (15, 2), (2, 1): (7, 1)}
+    assert rollup.range_total(rollup.SOURCE_AMOUNT_DETAIL, YESTERDAY, TODAY) == {'total': 25, 'count': 4}
+
+
+def test_catch_up_counts_rows_committed_out_of_order(tables):
+    AmountDetail.add_many([detail(1, 10, id=5), detail(1, 20, id=9)])
+    rollup.catch_up(rollup.SOURCE_AMOUNT_DETAIL)
+    assert rollup.RollupWatermark.get_one(rollup.RollupWatermark.source == rollup.SOURCE_AMOUNT_DETAIL).last_id == 9
+
+    # id 7 的事务在上次补算之后才提交
+    AmountDetail.add_many([detail(1, 4, id=7)])
+    rollup.catch_up(rollup.SOURCE_AMOUNT_DETAIL)
+    assert stored(rollup.SOURCE_AMOUNT_DETAIL, TODAY) == {(1, 1): (34, 3)}
+
+
+def test_daily_totals_scans_rows_after_watermark(tables):
+    Payment.add({'user_id': 1, 'charge_amount': 5})
+    rollup.catch_up(rollup.SOURCE_PAYMENT)
+    Payment.add({'user_id': 1, 'charge_amount': 6})
+    assert rollup.daily_totals(rollup.SOURCE_PAYMENT, TODAY, TODAY, user_id=1) == {TODAY: {'total': 11, 'count': 2}}
+
+
+def test_write_through(tables):
+    rollup.enable_write_through(AmountDetail)
+    User.create(username='user', password='x', balance=100)
+    AmountDetail.add_many([detail(1, 10), detail(1, 5)])
+    AmountDetail.add(detail(1, 1))
+    Ledger().debit(1, 30, type=1)
+    assert stored(rollup.SOURCE_AMOUNT_DETAIL, TODAY) == {(1, 1): (-14, 4)}
+    assert rollup.range_total(rollup.SOURCE_AMOUNT_DETAIL, TODAY, TODAY, user_id=1) == {'total': -14, 'count': 4}
@@ -0,0 +1,48 @@
+# coding=utf-8
+from __future__ import absolute_import, unicode_literals
+
+import pytest
+
+from webapp.models import LotteryLog, User
+from webapp.models.rows import row_class
+
+
+@pytest.fixture
+def users(db):
+    db.create_tables([User, LotteryLog])
+    for i in range(3):
+        User.create(username='user-{}'.format(i), password='secret', nickname='n{}'.format(i), balance=i)
+        LotteryLog.create_record(i + 1, 7, '大', 10 + i)
+    return db
+
+
+def test_rows_match_dicts(users):
+    for model_class in (User, LotteryLog):
+        query = model_class.select().order_by(model_class._meta.primary_key)
+        rows = model_class.get_list(query, as_rows=True)
+        assert [row.as_dict() for row in rows] == model_class.get_list(query)
+
+
+def test_row_access(users):
+    row = User.get_list(User.select().where(User.id == 2), as_rows=True)[0]
+    assert row.nickname == row['nickname'] == row.get('nickname') == 'n1'
+    assert row.get('password') is None and 'password' not in row.keys()
+    with pytest.raises(AttributeError):
+        row.nickname = 'x'
+    assert not hasattr(row, '__dict__')
+
+
+def test_partial_select_and_paging(users):
+    query = LotteryLog.select(LotteryLog.amount, LotteryLog.id).order_by(LotteryLog.id)
+    rows = LotteryLog.get_list(query, as_rows=True)
+    assert [tuple(row) for row in rows] == [(10, 1), (11, 2), (12, 3)]
+    assert rows[0].keys() == ['amount', 'id']
+
+    rows, pagination = LotteryLog.get_list({'period': 7}, paging={'limit': 2}, as_rows=True)
+    assert [row.id for row in rows] == [1, 2] and pagination['rows_found'] == 3
+    assert LotteryLog.get_list({'period': 7}, as_rows=True)[2].amount == 12
+
+
+def test_row_class_is_cached():
+    assert row_class(User, ['id', 'nickname']) is row_class(User, ['id', 'nickname'])
+    assert row_class(User, ['id']) is not row_class(User, ['id', 'nickname'])
@@ -0,0 +1,95 @@
+# coding=utf-8
+from __future__ import absolute_import, unicode_literals
+
+import peewee
+import pytest
+
+from webapp.models.model import Model
+
+
+class Item(Model):
+    class Meta:
+        db_table = 'seek_item'
+    id = peewee.PrimaryKeyField()
+    score = peewee.IntegerField(null=True)
+    name = peewee.CharField(default='')
+
+
+@pytest.fixture
+def items(db):
+    db.create_tables([Item])
+    scores = [3, None, 1, 3, None, 2, 5, 1, 3, None]
+    for i, score in enumerate(scores):
+        Item.create(score=score, name='item-{}'.format(i))
+    return scores
+
+
+def walk(paging, query=None, direction='after'):
+    pages = []
+    paging = dict(paging, **{direction: None})
+    while True:
+        data, pagination = Item.get_list(query, paging=paging)
+        pages.append([row['id'] for row in data])
+        if not pagination[direction]:
+            return pages
+        paging[direction] = pagination[direction]
+
+
+def flatten(pages):
+    return [item for page in pages for item in page]
+
+
+def expected(order_by):
+    """
+    OFFSET 分页的顺序，主键按最后一个排序列的方向追加
+    """
+    last = order_by.split(',')[-1]
+    if last.lstrip('-') != 'id':
+        order_by += ',-id' if last.startswith('-') else ',id'
+    return [row['id'] for row in Item.get_list(Item.set_order_by(Item.select(), order_by))]
+
+
+@pytest.mark.parametrize('order_by', ['id', '-id', 'score', '-score', 'score,-name', '-score,name'])
+def test_forward_pages_match_offset_order(items, order_by):
+    pages = walk({'limit': 3, 'order_by': order_by})
+    assert [len(page) for page in pages] == [3, 3, 3, 1]
+    assert flatten(pages) == expected(order_by)
+
+
+@pytest.mark.parametrize('order_by', ['score', '-score'])
+def test_backward_pages_from_last_page(items, order_by):
+    forward = walk({'limit': 4, 'order_by': order_by})
+    data, pagination = Item.get_list(None, paging={'limit': 4, 'order_by': order_by, 'after': None})
+    _, pagination = Item.get_list(None, paging={'limit': 4, 'order_by': order_by, 'after': pagination['after']})
+    data, pagination = Item.get_list(None, paging={'limit': 4, 'order_by': order_by, 'before': pagination['before']})
+    assert [row['id'] for row in data] == forward[0]
+    assert pagination['before'] is None
+
+
+def test_uses_ordering_of_query(items):
+    query = Item.set_order_by(Item.select(), '-score')
+    pages = walk({'limit': 4}, query=query)
+    assert flatten(pages) == expected('-score')
+
+
+def test_conflicting_order_by_raises(items):
+    query = Item.set_order_by(Item.select(), '-score')
+    with pytest.raises(Exception) as info:
+        Item.get_list(query, paging={'limit': 4, 'after': None, 'order_by': 'score'})
+    assert 'conflicts' in str(info.value)
+    data, _ = Item.get_list(query, paging={'limit': 4, 'after': None, 'order_by': '-score'})
+    assert len(data) == 4
+
+
+@pytest.mark.parametrize('cursor', ['!!!', 'abc', 'eyJh', '5Lit5paH', '中文'])
+def test_invalid_cursor(items, cursor):
+    with pytest.raises(Exception) as info:
+        Item.get_list(None, paging={'limit': 2, 'after': cursor})
+    assert 'is invalid' in str(info.value)
+
+
+def test_count_modes(items):
+    _, pagination = Item.get_list(None, paging={'limit': 2, 'after': None})
+    assert pagination['rows_found'] is None
+    _, pagination = Item.get_list(None, paging={'limit': 2, 'after': None, 'count': True})
+    assert pagination['rows_found'] == len(items)
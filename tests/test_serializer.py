@@ -0,0 +1,55 @@
+# coding=utf-8
+from __future__ import absolute_import, unicode_literals
+
+import pytest
+
+from webapp.models import LotteryLog, User
+from webapp.models.serializer import get_serializer
+
+
+@pytest.fixture
+def users(db):
+    db.create_tables([User, LotteryLog])
+    for i in range(5):
+        user = User.create(username='user-{}'.format(i), password='secret', nickname='n{}'.format(i), balance=i)
+        LotteryLog.create_record(user.id, 1, '大', 10 + i)
+    return db
+
+
+def to_dicts(query):
+    return [instance.to_dict() for instance in query]
+
+
+def test_get_list_matches_to_dict(users):
+    for model_class in (User, LotteryLog):
+        query = model_class.select().order_by(model_class._meta.primary_key)
+        assert model_class.get_list(query) == to_dicts(query)
+
+
+def test_default_exclude(users):
+    data = User.get_list(User.select())
+    assert data and all('password' not in row for row in data)
+    assert User.get_list({'username': 'user-1'}) == to_dicts(User.select().where(User.username == 'user-1'))
+
+
+def test_partial_select_and_join_fall_back_to_instances(users):
+    query = User.select(User.id, User.nickname).order_by(User.id)
+    assert User.get_list(query) == to_dicts(query)
+
+    query = LotteryLog.select(LotteryLog, User.nickname).join(User, on=(LotteryLog.user_id == User.id)) \
+        .order_by(LotteryLog.id)
+    assert LotteryLog.get_list(query) == to_dicts(query)
+
+
+def test_serializer_is_cached_per_arguments():
+    assert get_serializer(User) is get_serializer(User)
+    assert get_serializer(User, only=[User.id]) is not get_serializer(User)
+    assert get_serializer(User, only=[User.id]).names == ['id']
+    assert 'password' not in get_serializer(User).names
+
+
+def test_custom_to_dict_is_used(db, monkeypatch):
+    db.create_tables([LotteryLog])
+    LotteryLog.create_record(1, 1, '大', 10)
+    monkeypatch.setattr(LotteryLog, 'to_dict', lambda self, **kwargs: {'text': self.text})
+    assert LotteryLog.get_list(LotteryLog.select()) == [{'text': '大'}]
@@ -0,0 +1,94 @@
+# coding=utf-8
+from __future__ import absolute_import, unicode_literals
+
+import pytest
+
+from webapp.models import AmountDetail, LotteryLog, LotteryNum, User
+from webapp.models import settlement
+from webapp.models.settlement import PayoutRules, settle_period
+
+RULES = PayoutRules(
+    odds={'大': '1.98', '小': '1.98', '单': 1.95, '双': '1.95', '大双': '4.2', '豹子': 80},
+    sum_odds={3: '50', 14: '13.5'}
+)
+
+
+@pytest.fixture
+def period(db):
+    db.create_tables([User, LotteryNum, LotteryLog, AmountDetail])
+    for i in range(3):
+        User.create(username='user-{}'.format(i), password='x', balance=1000)
+    # 4 + 5 + 5 = 14，开奖结果给出中奖的玩法
+    LotteryNum.create_record(7, '1500000000', 4, 5, 5, 14, '4,5,5', '14,大,双,大双', 1, 0)
+    return LotteryNum.get_one(LotteryNum.id == 7)
+
+
+def test_odds_must_be_exact():
+    assert RULES.odds['单'] == 1950 and RULES.sum_odds[14] == 13500
+    with pytest.raises(Exception):
+        PayoutRules({'大': '1.9855'})
+    with pytest.raises(Exception):
+        PayoutRules({'大': 0})
+
+
+def test_parse_bet():
+    assert RULES.parse(' 大双 ') == ('大双', 0)
+    assert RULES.parse('14') == (settlement.SUM, 14)
+    assert RULES.parse('13') is None
+    assert RULES.parse('和值14') is None
+    assert RULES.parse('大单') is None
+    assert RULES.parse(None) is None
+
+
+def test_payout_per_bet_type(period):
+    draw = RULES.draw(period)
+    assert draw == (14, frozenset(['14', '大', '双', '大双']))
+    payouts = dict((text, RULES.payout_of(text, 100, draw)) for text in
+                   ('大', '小', '单', '双', '大双', '豹子', '14', '3', '13', 'x'))
+    assert payouts == {'大': 198, '小': 0, '单': 0, '双': 195, '大双': 420, '豹子': 0,
+                       '14': 1350, '3': 0, '13': 0, 'x': 0}
+    # 向下取整到整数金额
+    assert RULES.payout_of('大', 3, draw) == 5
+
+
+def test_outcomes_follow_result(period):
+    period.result = '14 小 单'
+    assert RULES.payout_of('小', 100, RULES.draw(period)) == 198
+    assert RULES.payout_of('大', 100, RULES.draw(period)) == 0
+
+
+def test_settle_period(period):
+    for user_id, text, amount in ((1, '大', 100), (1, '14', 10), (2, '小', 100), (3, '大双', 7), (3, 'x', 5)):
+        LotteryLog.create_record(user_id, 7, text, amount)
+
+    report = settle_period(7, RULES)
+    assert (report['bets'], report['winning_bets'], report['winners'], report['payout']) == (5, 3, 2, 198 + 135 + 29)
+    assert [User.get_by_id(i).balance for i in (1, 2, 3)] == [1000 + 333, 1000, 1000 + 29]
+    assert sorted(AmountDetail.select(AmountDetail.user_id, AmountDetail.amount_change).tuples()) == [(1, 333), (3, 29)]
+    assert LotteryLog.select().where(LotteryLog.is_checked == 0).count() == 0
+
+    assert settle_period(7, RULES)['bets'] == 0
+    assert User.get_by_id(1).balance == 1333
+
+
+def test_settle_period_requires_rules(period, monkeypatch):
+    monkeypatch.setattr(settlement, '_rules', None)
+    with pytest.raises(Exception):
+        settle_period(7)
+    settlement.configure({'大': 2})
+    LotteryLog.create_record(1, 7, '大', 100)
+    assert settle_period(7)['payout'] == 200
+
+
+def test_settle_period_reads_draw_from_primary(db, lagging_replica):
+    db.create_tables([User, LotteryNum, LotteryLog, AmountDetail])
+    User.create(username='user', password='x', balance=1000)
+    lagging_replica()
+    # 从库上还没有刚开奖的一期
+    LotteryNum.create_record(7, '1500000000', 4, 5, 5, 14, '4,5,5', '14,大,双,大双', 1, 0)
+    LotteryLog.create_record(1, 7, '大', 100)
+    assert LotteryNum.get_one(LotteryNum.id == 7) is None
+
+    assert settle_period(7, RULES)['payout'] == 198
+    with pytest.raises(Exception):
+        settle_period(8, RULES)
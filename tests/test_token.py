@@ -0,0 +1,58 @@
+# coding=utf-8
+from __future__ import absolute_import, unicode_literals
+
+import pytest
+
+from webapp.models import Token
+from webapp.models.token import TOKEN_CACHE
+
+
+def values(user_id, access_token, client_id=1):
+    return {'grant_type': 'PASSWORD', 'user_id': user_id, 'client_id': client_id,
+            'access_token': access_token, 'create_time': 100}
+
+
+@pytest.fixture
+def old_table(db):
+    # 旧库的 token 表：只有建表语句，没有 Meta.indexes 中的索引
+    db.create_table(Token)
+    TOKEN_CACHE.clear()
+    return db
+
+
+def test_migrate_unique_index(old_table):
+    for user_id, access_token in ((1, 'a'), (1, 'b'), (2, 'c'), (1, 'd')):
+        Token.insert(**values(user_id, access_token)).execute()
+    Token.insert(**values(1, 'e', client_id=2)).execute()
+    TOKEN_CACHE.set('a', {'user_id': 1})
+    TOKEN_CACHE.set('d', {'user_id': 1})
+    assert not Token.has_unique_index()
+
+    assert Token.migrate_unique_index() == 2
+    assert Token.has_unique_index()
+    assert sorted(row.access_token for row in Token.select()) == ['c', 'd', 'e']
+    assert TOKEN_CACHE.get('a') is None and TOKEN_CACHE.get('d') == {'user_id': 1}
+    assert Token.migrate_unique_index() == 0
+
+    token, created = Token.issue(values(1, 'f'))
+    assert (token.access_token, created) == ('d', False)
+    assert Token.select().count() == 3
+
+
+def test_issue_and_revoke(db):
+    Token.create_table()
+    TOKEN_CACHE.clear()
+    assert Token.has_unique_index()
+    token, created = Token.issue(values(1, 'a'))
+    assert created and token.id
+    assert Token.issue(values(1, 'b'))[0].access_token == 'a'
+    assert Token.issue(values(2, 'c'))[1]
+
+    TOKEN_CACHE.set('a', {'user_id': 1, 'client_id': 1, 'create_time': 100})
+    TOKEN_CACHE.set('c', {'user_id': 2, 'client_id': 1, 'create_time': 100})
+    assert Token.revoke(user_id=1) == 1
+    assert TOKEN_CACHE.get('a') is None and TOKEN_CACHE.get('c') is not None
+    assert Token.revoke(before=101) == 1
+    assert Token.select().count() == 0
+    with pytest.raises(Exception):
+        Token.revoke()
@@ -0,0 +1,148 @@
+# coding=utf-8
+from __future__ import absolute_import, unicode_literals
+
+import json
+import os
+import threading
+import time
+
+import pytest
+
+from webapp.models import LotteryLog
+from webapp.models import writebehind
+from webapp.models.writebehind import SpoolBatch, WriteBehind
+
+
+@pytest.fixture
+def spool(db, tmpdir_path):
+    db.create_tables([LotteryLog])
+    return os.path.join(tmpdir_path, 'lottery_log.jsonl')
+
+
+def texts():
+    return sorted(row.text for row in LotteryLog.select())
+
+
+def write_spool(path, batches):
+    with open(path, 'w') as f:
+        for batch_id, names in batches:
+            rows = [dict(user_id=1, period=1, text=name, amount=1, create_time=0) for name in names]
+            f.write(json.dumps({'batch_id': batch_id, 'rows': rows}) + '\n')
+
+
+def test_batches_and_flush(spool):
+    wb = LotteryLog.enable_write_behind(max_rows=10, interval_ms=1000, spool_path=spool)
+    try:
+        for i in range(25):
+            assert LotteryLog.create_record(1, 1, 'bet', 1) is None
+        assert wb.flush(5)
+        assert LotteryLog.select().count() == 25
+        stats = wb.stats()
+        assert (stats['enqueued'], stats['flushed_rows'], stats['depth'], stats['spool_bytes']) == (25, 25, 0, 0)
+        assert stats['flushes'] >= 3
+    finally:
+        LotteryLog.disable_write_behind()
+    assert LotteryLog.create_record(1, 1, 'direct', 1)
+
+
+def test_failed_batches_spool_and_replay(spool, monkeypatch):
+    wb = WriteBehind(LotteryLog, spool_path=spool)
+
+    def broken(rows, batch_size=None):
+        raise Exception('db down')
+    monkeypatch.setattr(LotteryLog, 'add_many', broken)
+    wb._write([dict(user_id=1, period=1, text='a', amount=1, create_time=0)])
+    assert wb.stats()['spooled_rows'] == 1 and wb.stats()['spool_bytes'] > 0
+
+    monkeypatch.undo()
+    wb._replay(force=True)
+    assert texts() == ['a']
+    assert wb.stats()['spool_bytes'] == 0
+    assert SpoolBatch.select().count() == 0
+
+
+def test_replay_after_crash_before_truncate(spool, monkeypatch):
+    write_spool(spool, [('b1', ['a', 'b']), ('b2', ['c'])])
+    wb = WriteBehind(LotteryLog, spool_path=spool)
+
+    def crash():
+        raise KeyboardInterrupt
+    monkeypatch.setattr(wb, '_truncate_spool', crash)
+    with pytest.raises(KeyboardInterrupt):
+        wb._replay(force=True)
+    assert texts() == ['a', 'b', 'c']
+
+    monkeypatch.undo()
+    wb._replay(force=True)
+    assert texts() == ['a', 'b', 'c']
+    assert os.path.getsize(spool) == 0
+
+
+def test_replay_resumes_after_failed_batch(spool, monkeypatch):
+    write_spool(spool, [('b1', ['a']), ('b2', ['b']), ('b3', ['c'])])
+    wb = WriteBehind(LotteryLog, spool_path=spool)
+    original = LotteryLog.add_many.__func__
+
+    def fail_on_b(cls, rows, batch_size=None):
+        if rows[0]['text'] == 'b':
+            raise Exception('db down')
+        return original(cls, rows, batch_size=batch_size)
+    monkeypatch.setattr(LotteryLog, 'add_many', classmethod(fail_on_b))
+    wb._replay(force=True)
+    assert texts() == ['a']
+    assert os.path.getsize(spool) > 0
+
+    monkeypatch.undo()
+    monkeypatch.setattr(writebehind, 'REPLAY_INTERVAL', 0)
+    wb._replay()
+    assert texts() == ['a', 'b', 'c']
+    assert wb.stats()['replayed_rows'] == 3
+
+
+def test_broken_line_is_skipped(spool):
+    write_spool(spool, [('b1', ['a'])])
+    with open(spool, 'a') as f:
+        f.write('{"batch_id": "b2", "ro')
+    WriteBehind(LotteryLog, spool_path=spool)._replay(force=True)
+    assert texts() == ['a']
+    assert os.path.getsize(spool) == 0
+
+
+def test_put_racing_stop_is_not_lost(spool):
+    wb = LotteryLog.enable_write_behind(max_rows=50, interval_ms=5, spool_path=spool)
+    start = threading.Event()
+
+    def put(n):
+        start.wait()
+        for i in range(n):
+            wb.put(dict(user_id=1, period=1, text='bet', amount=1, create_time=0))
+    threads = [threading.Thread(target=put, args=(200,)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    start.set()
+    time.sleep(0.01)
+    wb.stop(5)
+    for thread in threads:
+        thread.join(5)
+    LotteryLog.disable_write_behind()
+    stats = wb.stats()
+    assert stats['depth'] == 0
+    assert LotteryLog.select().count() == 800 == stats['flushed_rows'] + stats['direct_rows']
+
+
+def test_stop_waits_for_put_in_progress(spool):
+    wb = LotteryLog.enable_write_behind(max_rows=50, interval_ms=5, spool_path=spool)
+    queue_put = wb._queue.put
+    stopper = threading.Thread(target=wb.stop, args=(5,))
+
+    def put(item, block=True, timeout=None):
+        # put 检查过 _stopped、还没入队时 stop 开始执行
+        if stopper.ident is None and item is not writebehind._STOP:
+            stopper.start()
+            time.sleep(0.05)
+        queue_put(item, block, timeout)
+    wb._queue.put = put
+    wb.put(dict(user_id=1, period=1, text='bet', amount=1, create_time=0))
+    stopper.join(5)
+    LotteryLog.disable_write_behind()
+    assert texts() == ['bet']